@@ -1,5 +1,7 @@
 import asyncio
 import os
+import threading
+import time
 from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime, timedelta
@@ -8,11 +10,14 @@ from typing import Dict, List, Optional, Tuple
 import psycopg2
 from psycopg2.extras import DictCursor
 from dotenv import load_dotenv
-from telegram import Update
+from telegram import Bot, Update
+from telegram.error import ChatMigrated, RetryAfter
 from telegram.ext import Application, CommandHandler, ContextTypes
 import requests
 from zoneinfo import ZoneInfo
 
+import neon_db
+
 
 @dataclass
 class BotConfig:
@@ -29,6 +34,14 @@ class BotConfig:
     kvant_api_key: Optional[str] = None
     kvant_assignee_id: Optional[int] = None
 
+    # Читать материализованные витрины *_mat вместо вьюх (docs/migrations/materialize-weekly-mart.sql)
+    use_materialized: bool = False
+
+    # Режим bot: сколько соединений с Neon держит пул (столько же /week строится одновременно)
+    db_pool_size: int = 4
+    # Режим bot: сколько секунд /week отдаётся из кэша (0 — без кэша); сброс раньше — по max(loaded_at) в RAW
+    cache_ttl: int = 900
+
 
 def _env(name: str) -> str:
     v = os.getenv(name)
@@ -57,24 +70,87 @@ def load_config() -> BotConfig:
         top_n=_int_optional("ALERTS_TOP_N", 5),
         kvant_api_key=os.getenv("KVANT_API_KEY"),
         kvant_assignee_id=int(os.getenv("KVANT_ASSIGNEE_ID")) if os.getenv("KVANT_ASSIGNEE_ID") else None,
+        use_materialized=os.getenv("ALERTS_MAT", "").strip() in ("1", "true", "True", "yes", "YES"),
+        db_pool_size=_int_optional("ALERTS_DB_POOL", 4),
+        cache_ttl=_int_optional("ALERTS_CACHE_TTL", 900),
     )
 
 
+# Витрины, у которых есть материализованная копия *_mat; запросы берут имя через _rel
+MATERIALIZED_VIEWS = (
+    "inventory_mart.weekly_deviation_products_money_v2",
+    "inventory_mart.weekly_deviation_products_qty",
+    "inventory_mart.weekly_product_documents_products",
+    "inventory_core.weekly_movement_products",
+)
+_relations: Dict[str, str] = {v: v for v in MATERIALIZED_VIEWS}
+
+
+def use_materialized_views(enabled: bool) -> None:
+    """Переключает запросы модуля на таблицы *_mat (enabled) или обратно на вьюхи."""
+    for v in MATERIALIZED_VIEWS:
+        _relations[v] = f"{v}_mat" if enabled else v
+
+
+def _rel(view: str) -> str:
+    return _relations[view]
+
+
+def neon_params(cfg: BotConfig) -> neon_db.NeonParams:
+    return neon_db.NeonParams(cfg.neon_host, cfg.neon_db, cfg.neon_user, cfg.neon_password)
+
+
 def db_connect(cfg: BotConfig):
-    return psycopg2.connect(
-        host=cfg.neon_host,
-        dbname=cfg.neon_db,
-        user=cfg.neon_user,
-        password=cfg.neon_password,
-        sslmode="require",
-        cursor_factory=DictCursor,
-    )
+    """Соединение с повтором на холодном Neon (neon_db.connect)."""
+    return neon_db.connect(neon_params(cfg), cursor_factory=DictCursor)
+
+
+class ReportPool:
+    """
+    Пул соединений для режима bot: до cfg.db_pool_size соединений, одно держится открытым
+    между командами (без нового TLS-хендшейка на каждый /week). Отчёты строятся в потоках;
+    когда все соединения заняты, поток ждёт свободное, а не получает PoolError.
+    Перед выдачей соединение проверяется select 1 — Neon рвёт простаивающие соединения,
+    когда засыпает compute.
+    """
+
+    def __init__(self, cfg: BotConfig):
+        size = max(1, cfg.db_pool_size)
+        self._pool = neon_db.new_pool(neon_params(cfg), 1, size, cursor_factory=DictCursor)
+        self._slots = threading.BoundedSemaphore(size)
+
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            conn = self._pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("select 1;")
+                conn.rollback()
+            except psycopg2.Error:
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        try:
+            if not conn.closed:
+                conn.rollback()
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        self._pool.closeall()
 
 
 def get_last_week(conn) -> Tuple[str, str]:
-    sql = """
+    sql = f"""
         select week_start, week_end
-        from inventory_mart.weekly_deviation_products_money_v2
+        from {_rel("inventory_mart.weekly_deviation_products_money_v2")}
         order by week_start desc
         limit 1;
     """
@@ -86,14 +162,46 @@ def get_last_week(conn) -> Tuple[str, str]:
     return str(row["week_start"]), str(row["week_end"])
 
 
+def get_loaded_at(conn) -> Optional[str]:
+    """
+    max(loaded_at) в RAW — метка последней загрузки etl.py. Дешёвый запрос
+    (индекс docs/migrations/olap-postings-loaded-at-idx.sql), в отличие от get_last_week по вьюхе.
+    """
+    with conn.cursor() as cur:
+        cur.execute("select max(loaded_at) as loaded_at from inventory_raw.olap_postings;")
+        row = cur.fetchone()
+    return str(row["loaded_at"]) if row and row["loaded_at"] is not None else None
+
+
+def get_mat_refreshed_at(conn) -> Optional[str]:
+    """
+    max(refreshed_at) — метка последнего пересчёта витрин *_mat (refresh_weekly_mat пишет её в той же
+    транзакции, что и сами *_mat; docs/migrations/weekly-mat-refreshed-at.sql).
+    """
+    with conn.cursor() as cur:
+        cur.execute("select max(refreshed_at) as refreshed_at from inventory_mart.weekly_mat_refreshed;")
+        row = cur.fetchone()
+    return str(row["refreshed_at"]) if row and row["refreshed_at"] is not None else None
+
+
+def get_data_version(conn) -> Optional[str]:
+    """
+    Метка свежести данных, из которых строится отчёт: при ALERTS_MAT — пересчёт *_mat (etl.py коммитит его
+    позже загрузки RAW), иначе — загрузка RAW.
+    """
+    if _rel(MATERIALIZED_VIEWS[0]) != MATERIALIZED_VIEWS[0]:
+        return get_mat_refreshed_at(conn)
+    return get_loaded_at(conn)
+
+
 def get_last_two_weeks(conn) -> List[Tuple[str, str]]:
     """
     Возвращает две последние недели (текущая и предыдущая) из витрины money:
     [(week_start_текущая, week_end_текущая), (week_start_предыдущая, week_end_предыдущая)].
     """
-    sql = """
+    sql = f"""
         select distinct week_start, week_end
-        from inventory_mart.weekly_deviation_products_money_v2
+        from {_rel("inventory_mart.weekly_deviation_products_money_v2")}
         order by week_start desc
         limit 2;
     """
@@ -127,173 +235,192 @@ VEGETABLE_PRODUCT_NAMES: set = set()
 WRITEOFF_ALARM_PCT_OF_MOVEMENT = 0.30
 
 
-def get_departments(conn, week_start: str, week_end: str) -> List[str]:
-    sql = """
-        select distinct department
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s
-        order by 1;
+def _top_money_by_dept(
+    conn, week_start: str, week_end: str, top_n: int, positive: bool
+) -> Dict[str, List[dict]]:
     """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        return [r["department"] for r in cur.fetchall()]
-
-
-def get_missing_by_department(conn, week_start: str, week_end: str) -> Dict[str, List[str]]:
-    sql = """
-        select department, product_name
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s and is_missing_inventory_position
-        order by department, product_name;
+    ТОП-N по филиалу в деньгах: недостачи (positive=False, по excess_loss_money)
+    или излишки (positive=True, по excess_deviation_money). Ранжирует БД (row_number по филиалу) —
+    по сети приходят только top_n строк на филиал, а не все отклонения недели.
+    """
+    sql = f"""
+        with base as (
+            select department, product_num, product_name, deviation_money_signed, allowed_loss_money,
+                   case when %s then excess_deviation_money else excess_loss_money end as excess
+            from {_rel("inventory_mart.weekly_deviation_products_money_v2")}
+            where week_start = %s and week_end = %s and sign(deviation_money_signed) = %s
+              and (is_possible_resort is null or is_possible_resort = false)
+        ),
+        ranked as (
+            select *,
+                   row_number() over (partition by department order by excess desc nulls last, product_name) as rn
+            from base
+        )
+        select department, product_num, product_name, deviation_money_signed,
+               coalesce(allowed_loss_money, 0) as norm,
+               coalesce(excess, 0) as excess
+        from ranked
+        where rn <= %s
+        order by department, rn;
     """
     with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
+        cur.execute(sql, (positive, week_start, week_end, 1 if positive else -1, top_n))
         out = defaultdict(list)
         for r in cur.fetchall():
-            out[r["department"]].append(r["product_name"] or "")
+            out[r["department"]].append(r)
         return dict(out)
 
 
-def get_miscount_by_department(conn, week_start: str, week_end: str) -> Dict[str, List[str]]:
-    sql = """
-        select department, product_name
-        from inventory_mart.weekly_deviation_products_qty
-        where week_start = %s and week_end = %s and is_wrong_prev_inventory
-        order by department, product_name;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        out = defaultdict(list)
-        for r in cur.fetchall():
-            out[r["department"]].append(r["product_name"] or "")
-        return dict(out)
+def _top_neg_money_by_dept(conn, week_start: str, week_end: str, top_n: int) -> Dict[str, List[dict]]:
+    return _top_money_by_dept(conn, week_start, week_end, top_n, positive=False)
 
 
-def get_resort_by_department(conn, week_start: str, week_end: str) -> Dict[str, List[str]]:
-    sql = """
-        select department, product_name
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s and is_possible_resort
-        order by department, product_name;
+@dataclass
+class WeekSnapshot:
+    """
+    Неделя из витрин weekly_deviation_products_money_v2 и weekly_deviation_products_qty,
+    сгруппированная по филиалам. Загружается двумя запросами (load_week_snapshot): ТОПы ранжирует
+    БД (row_number по филиалу), поэтому по сети приходят только строки в пределах top_n и строки
+    с флагами (несохранённые, пересчёт, пересорт), а сумма по филиалу — оконным агрегатом.
+    Блоки отчёта считаются из снимка локально, без повторного вычисления цепочки вьюх на Neon.
     """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        out = defaultdict(list)
-        for r in cur.fetchall():
-            out[r["department"]].append(r["product_name"] or "")
-        return dict(out)
 
+    week_start: str
+    week_end: str
+    top_n: int
+    money: Dict[str, List[dict]]
+    qty: Dict[str, List[dict]]
+    totals: Dict[str, float]
+
+    def departments(self) -> List[str]:
+        """Филиалы витрины money в порядке сортировки БД (load_week_snapshot)."""
+        return list(self.totals)
+
+    def _names(self, rows_by_dept: Dict[str, List[dict]], flag: str) -> Dict[str, List[str]]:
+        out = {}
+        for dept, rows in rows_by_dept.items():
+            names = [r["product_name"] or "" for r in rows if r[flag]]
+            if names:
+                out[dept] = names
+        return out
+
+    def missing(self) -> Dict[str, List[str]]:
+        return self._names(self.money, "is_missing_inventory_position")
+
+    def miscount(self) -> Dict[str, List[str]]:
+        return self._names(self.qty, "is_wrong_prev_inventory")
+
+    def resort(self) -> Dict[str, List[str]]:
+        return self._names(self.money, "is_possible_resort")
+
+    def _top(self, rows_by_dept, rank: str, top_n: int, to_row) -> Dict[str, List[dict]]:
+        if top_n > self.top_n:
+            raise ValueError(f"Снимок загружен с top_n={self.top_n}, запрошен ТОП-{top_n}")
+        out = {}
+        for dept, rows in rows_by_dept.items():
+            picked = sorted((r for r in rows if r[rank] is not None and r[rank] <= top_n), key=lambda r: r[rank])
+            if picked:
+                out[dept] = [to_row(r) for r in picked]
+        return out
+
+    def top_neg_money(self, top_n: int) -> Dict[str, List[dict]]:
+        """То же, что _top_neg_money_by_dept."""
+        return self._top(self.money, "rn_neg", top_n, lambda r: _money_top_row(r, r["excess_loss_money"]))
+
+    def top_pos_money(self, top_n: int) -> Dict[str, List[dict]]:
+        """ТОП-N излишков по филиалу в деньгах (по excess_deviation_money), без возможного пересорта."""
+        return self._top(self.money, "rn_pos", top_n, lambda r: _money_top_row(r, r["excess_deviation_money"]))
+
+    def top_pct(self, top_n: int, positive: bool) -> Dict[str, List[dict]]:
+        """ТОП-N по филиалу в % (недостачи или излишки, по excess_pct_qty), без возможного пересорта."""
+        return self._top(
+            self.qty,
+            "rn_pos" if positive else "rn_neg",
+            top_n,
+            lambda r: {k: r[k] for k in ("department", "product_name", "fact_deviation_pct_qty", "norm_pct", "excess_pct_qty")},
+        )
 
-def _top_neg_money_by_dept(conn, week_start: str, week_end: str, top_n: int) -> Dict[str, List[dict]]:
-    sql = """
-        select department, product_num, product_name, deviation_money_signed,
-               coalesce(allowed_loss_money, 0) as norm,
-               coalesce(excess_loss_money, 0) as excess
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s and deviation_money_signed < 0
-          and (is_possible_resort is null or is_possible_resort = false)
-        order by department, excess_loss_money desc nulls last;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        out = defaultdict(list)
-        for r in cur.fetchall():
-            dept = r["department"]
-            if len(out[dept]) < top_n:
-                out[dept].append(r)
-        return dict(out)
+    def summary_money(self) -> List[Tuple[str, float]]:
+        """Сумма deviation_money_signed по филиалам."""
+        return list(self.totals.items())
 
 
-def _top_pos_money_by_dept(conn, week_start: str, week_end: str, top_n: int) -> Dict[str, List[dict]]:
-    sql = """
-        select department, product_num, product_name, deviation_money_signed,
-               coalesce(allowed_loss_money, 0) as norm,
-               coalesce(excess_deviation_money, 0) as excess
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s and deviation_money_signed > 0
-          and (is_possible_resort is null or is_possible_resort = false)
-        order by department, excess_deviation_money desc nulls last;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        out = defaultdict(list)
-        for r in cur.fetchall():
-            dept = r["department"]
-            if len(out[dept]) < top_n:
-                out[dept].append(r)
-        return dict(out)
+def _money_top_row(r: dict, excess) -> dict:
+    return {
+        "department": r["department"],
+        "product_num": r["product_num"],
+        "product_name": r["product_name"],
+        "deviation_money_signed": r["deviation_money_signed"],
+        "norm": r["allowed_loss_money"] or 0,
+        "excess": excess or 0,
+    }
 
 
-def _top_pct_by_dept(
-    conn, week_start: str, week_end: str, top_n: int, positive: bool
-) -> Dict[str, List[dict]]:
-    sign = ">" if positive else "<"
-    sql = f"""
-        select department, product_name, fact_deviation_pct_qty, norm_pct, excess_pct_qty
-        from inventory_mart.weekly_deviation_products_qty
-        where week_start = %s and week_end = %s and fact_deviation_pct_qty {sign} 0
-          and (is_possible_resort is null or is_possible_resort = false)
-        order by department, excess_pct_qty desc nulls last;
+def _ranked_sql(sign_col: str, excess_neg: str, excess_pos: str) -> Tuple[str, str]:
     """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        out = defaultdict(list)
-        for r in cur.fetchall():
-            dept = r["department"]
-            if len(out[dept]) < top_n:
-                out[dept].append(r)
-        return dict(out)
+    Номера строк в ТОПе недостач (sign < 0) и излишков (sign > 0) по филиалу, без возможного
+    пересорта; порядок — excess desc nulls last, product_name, как у _top_money_by_dept.
+    Вне своего ТОПа номер — null.
+    """
+    keep = "coalesce(is_possible_resort, false) = false"
 
+    def rn(op: str, excess: str) -> str:
+        cond = f"{sign_col} {op} 0 and {keep}"
+        return (
+            f"case when {cond} then row_number() over ("
+            f"partition by department, ({cond}) order by {excess} desc nulls last, product_name) end"
+        )
 
-def get_summary_money_by_department(conn, week_start: str, week_end: str) -> List[Tuple[str, float]]:
-    sql = """
-        select department, sum(deviation_money_signed) as total
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s
-        group by department
-        order by 1;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end))
-        return [(r["department"], float(r["total"] or 0)) for r in cur.fetchall()]
-
-
-def get_movement_qty_for_products(
-    conn, week_start: str, week_end: str, department: str, product_nums: List[str]
-) -> Dict[str, float]:
-    """Недельное движение (qty) по товарам для проверки задублированного прихода."""
-    if not product_nums:
-        return {}
-    sql = """
-        select product_num, movement_qty
-        from inventory_core.weekly_movement_products
-        where week_start = %s and week_end = %s and department = %s and product_num = ANY(%s);
+    return rn("<", excess_neg), rn(">", excess_pos)
+
+
+def load_week_snapshot(conn, week_start: str, week_end: str, top_n: int) -> WeekSnapshot:
+    """Один запрос к каждой витрине за неделю → WeekSnapshot с ТОПами до top_n включительно."""
+    money_neg, money_pos = _ranked_sql("deviation_money_signed", "excess_loss_money", "excess_deviation_money")
+    money_sql = f"""
+        with ranked as (
+            select department, product_num, product_name, deviation_money_signed,
+                   allowed_loss_money, excess_loss_money, excess_deviation_money,
+                   is_missing_inventory_position, is_possible_resort,
+                   {money_neg} as rn_neg,
+                   {money_pos} as rn_pos,
+                   coalesce(sum(deviation_money_signed) over (partition by department), 0) as dept_total,
+                   row_number() over (partition by department) as dept_rn
+            from {_rel("inventory_mart.weekly_deviation_products_money_v2")}
+            where week_start = %s and week_end = %s
+        )
+        select *
+        from ranked
+        where rn_neg <= %s or rn_pos <= %s or dept_rn = 1
+           or is_missing_inventory_position or is_possible_resort
+        order by department, product_name;
     """
-    with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end, department, product_nums))
-        return {
-            r["product_num"]: float(r["movement_qty"] or 0)
-            for r in cur.fetchall()
-        }
-
-
-def get_deviation_for_products(
-    conn, week_start: str, week_end: str, department: str, product_nums: List[str]
-) -> Dict[str, float]:
-    """Отклонение в деньгах по товарам за неделю (любое, не только ТОП)."""
-    if not product_nums:
-        return {}
-    sql = """
-        select product_num, deviation_money_signed
-        from inventory_mart.weekly_deviation_products_money_v2
-        where week_start = %s and week_end = %s and department = %s and product_num = ANY(%s);
+    qty_neg, qty_pos = _ranked_sql("fact_deviation_pct_qty", "excess_pct_qty", "excess_pct_qty")
+    qty_sql = f"""
+        with ranked as (
+            select department, product_name, fact_deviation_pct_qty, norm_pct, excess_pct_qty,
+                   is_wrong_prev_inventory, is_possible_resort,
+                   {qty_neg} as rn_neg,
+                   {qty_pos} as rn_pos
+            from {_rel("inventory_mart.weekly_deviation_products_qty")}
+            where week_start = %s and week_end = %s
+        )
+        select *
+        from ranked
+        where rn_neg <= %s or rn_pos <= %s or is_wrong_prev_inventory
+        order by department, product_name;
     """
+    grouped = []
     with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end, department, product_nums))
-        return {
-            r["product_num"]: float(r["deviation_money_signed"] or 0)
-            for r in cur.fetchall()
-        }
+        for sql in (money_sql, qty_sql):
+            cur.execute(sql, (week_start, week_end, top_n, top_n))
+            out: Dict[str, List[dict]] = {}
+            for r in cur.fetchall():
+                out.setdefault(r["department"], []).append(dict(r))
+            grouped.append(out)
+    money, qty = grouped
+    totals = {dept: float(rows[0]["dept_total"]) for dept, rows in money.items()}
+    return WeekSnapshot(week_start, week_end, top_n, money=money, qty=qty, totals=totals)
 
 
 def get_top_writeoffs_by_department(
@@ -309,20 +436,20 @@ def get_top_writeoffs_by_department(
     только списания (WRITEOFF), без продаж (фритюрное масло, говядина лопатка для персонала и т.п.).
     Возвращает { department: [ {product_name, writeoff_qty, writeoff_money, product_measure_unit}, ... ] }.
     """
-    sql = """
+    sql = f"""
         WITH w AS (
             SELECT department, product_num,
                    max(product_name) AS product_name,
                    max(product_measure_unit) AS product_measure_unit,
                    sum(abs(qty_signed)) AS writeoff_qty,
                    sum(abs(money_signed)) AS writeoff_money
-            FROM inventory_mart.weekly_product_documents_products
+            FROM {_rel("inventory_mart.weekly_product_documents_products")}
             WHERE week_start = %s AND week_end = %s AND transaction_type = 'WRITEOFF'
             GROUP BY department, product_num
         ),
         m AS (
             SELECT department, product_num, movement_qty
-            FROM inventory_core.weekly_movement_products
+            FROM {_rel("inventory_core.weekly_movement_products")}
             WHERE week_start = %s AND week_end = %s
         ),
         has_sales AS (
@@ -370,27 +497,43 @@ def get_top_writeoffs_by_department(
         return dict(out)
 
 
-def get_receipts_for_products(
-    conn, week_start: str, week_end: str, department: str, product_nums: List[str]
-) -> Dict[str, List[dict]]:
-    """По каждому product_num из списка — приходы (INVOICE) за неделю на филиале.
-    Возвращает: { product_num: [ {posting_dt, contr_account_name, qty_signed, money_signed}, ... ] }.
+# Выборки по товарам — одним запросом по всем филиалам сразу. На вход — { department: [product_num, ...] },
+# на выход — { department: { product_num: ... } } для каждого филиала из входа.
+# Пары (филиал, товар) передаются двумя массивами и разворачиваются unnest на стороне БД.
+
+def _dept_product_arrays(products_by_dept: Dict[str, List[str]]) -> Tuple[List[str], List[str]]:
+    depts, nums = [], []
+    for dept, product_nums in products_by_dept.items():
+        for pnum in dict.fromkeys(product_nums):
+            depts.append(dept)
+            nums.append(pnum)
+    return depts, nums
+
+
+def get_receipts_for_products_by_dept(
+    conn, week_start: str, week_end: str, products_by_dept: Dict[str, List[str]]
+) -> Dict[str, Dict[str, List[dict]]]:
     """
-    if not product_nums:
-        return {}
-    sql = """
-        select product_num, posting_dt, contr_account_name, qty_signed, money_signed,
-               product_measure_unit
-        from inventory_mart.weekly_product_documents_products
-        where week_start = %s and week_end = %s and department = %s
-          and transaction_type = 'INVOICE' and product_num = ANY(%s)
-        order by product_num, posting_dt;
+    Приходы (INVOICE) за неделю по товарам каждого филиала:
+    { department: { product_num: [ {posting_dt, contr_account_name, qty_signed, money_signed, product_measure_unit}, ... ] } }.
+    """
+    out: Dict[str, Dict[str, List[dict]]] = {dept: {} for dept in products_by_dept}
+    depts, nums = _dept_product_arrays(products_by_dept)
+    if not nums:
+        return out
+    sql = f"""
+        select d.department, d.product_num, d.posting_dt, d.contr_account_name, d.qty_signed, d.money_signed,
+               d.product_measure_unit
+        from {_rel("inventory_mart.weekly_product_documents_products")} d
+        join unnest(%s::text[], %s::text[]) as w(department, product_num)
+          on w.department = d.department and w.product_num = d.product_num
+        where d.week_start = %s and d.week_end = %s and d.transaction_type = 'INVOICE'
+        order by d.department, d.product_num, d.posting_dt;
     """
     with conn.cursor() as cur:
-        cur.execute(sql, (week_start, week_end, department, product_nums))
-        out = defaultdict(list)
+        cur.execute(sql, (depts, nums, week_start, week_end))
         for r in cur.fetchall():
-            out[r["product_num"]].append(
+            out[r["department"]].setdefault(r["product_num"], []).append(
                 {
                     "posting_dt": r["posting_dt"],
                     "contr_account_name": r["contr_account_name"] or "",
@@ -399,7 +542,51 @@ def get_receipts_for_products(
                     "product_measure_unit": (r.get("product_measure_unit") or "ед.").strip(),
                 }
             )
-        return dict(out)
+    return out
+
+
+def get_movement_qty_for_products_by_dept(
+    conn, week_start: str, week_end: str, products_by_dept: Dict[str, List[str]]
+) -> Dict[str, Dict[str, float]]:
+    """Недельное движение (qty) по товарам каждого филиала — для проверки задублированного прихода."""
+    out: Dict[str, Dict[str, float]] = {dept: {} for dept in products_by_dept}
+    depts, nums = _dept_product_arrays(products_by_dept)
+    if not nums:
+        return out
+    sql = f"""
+        select m.department, m.product_num, m.movement_qty
+        from {_rel("inventory_core.weekly_movement_products")} m
+        join unnest(%s::text[], %s::text[]) as w(department, product_num)
+          on w.department = m.department and w.product_num = m.product_num
+        where m.week_start = %s and m.week_end = %s;
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (depts, nums, week_start, week_end))
+        for r in cur.fetchall():
+            out[r["department"]][r["product_num"]] = float(r["movement_qty"] or 0)
+    return out
+
+
+def get_deviation_for_products_by_dept(
+    conn, week_start: str, week_end: str, products_by_dept: Dict[str, List[str]]
+) -> Dict[str, Dict[str, float]]:
+    """Отклонение в деньгах (любое, не только ТОП) по товарам каждого филиала за неделю."""
+    out: Dict[str, Dict[str, float]] = {dept: {} for dept in products_by_dept}
+    depts, nums = _dept_product_arrays(products_by_dept)
+    if not nums:
+        return out
+    sql = f"""
+        select v.department, v.product_num, v.deviation_money_signed
+        from {_rel("inventory_mart.weekly_deviation_products_money_v2")} v
+        join unnest(%s::text[], %s::text[]) as w(department, product_num)
+          on w.department = v.department and w.product_num = v.product_num
+        where v.week_start = %s and v.week_end = %s;
+    """
+    with conn.cursor() as cur:
+        cur.execute(sql, (depts, nums, week_start, week_end))
+        for r in cur.fetchall():
+            out[r["department"]][r["product_num"]] = float(r["deviation_money_signed"] or 0)
+    return out
 
 
 def _block(title: str, items: List[str], empty_msg: str = "нет") -> str:
@@ -530,41 +717,121 @@ def _block_top_pct(rows: List[dict], title: str) -> str:
     return "\n".join(lines)
 
 
-def build_report_messages_per_department(cfg: BotConfig) -> Tuple[str, str, List[str]]:
+def _freeze(value):
+    """Аргументы запроса → хэшируемый ключ (списки и словари — в кортежи)."""
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class ReportContext:
+    """
+    Контекст одного прогона отчётов: одно соединение с Neon (открывается при первом запросе)
+    и мемоизация результатов по (запрос, аргументы). Telegram-отчёт, сводка и задачи Кванта
+    получают один контекст, поэтому ни один запрос за прогон не выполняется дважды.
+    Результаты общие для всех потребителей — менять их на месте нельзя.
+    С pool (режим bot) соединение берётся из ReportPool и возвращается в него при close.
+    """
+
+    def __init__(self, cfg: BotConfig, pool: Optional[ReportPool] = None):
+        self.cfg = cfg
+        self._pool = pool
+        self._conn = None
+        self._memo: Dict[tuple, object] = {}
+        # Задачи Кванта строятся в потоках параллельно с отчётом: запросы идут по одному
+        # через общее соединение, и одинаковый запрос не выполняется дважды
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._pool.getconn() if self._pool else db_connect(self.cfg)
+            return self._conn
+
+    def query(self, fn, *args):
+        """fn(conn, *args) — один раз на набор аргументов."""
+        key = (fn.__name__, _freeze(args))
+        # Готовый результат — без блокировки: её держит поток, занятый другим запросом
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        with self._lock:
+            if key not in self._memo:
+                conn = self.conn
+                started = time.monotonic()
+                self._memo[key] = fn(conn, *args)
+                neon_db.stats.add_session(time.monotonic() - started)
+            return self._memo[key]
+
+    def last_week(self) -> Tuple[str, str]:
+        return self.query(get_last_week)
+
+    def last_two_weeks(self) -> List[Tuple[str, str]]:
+        return self.query(get_last_two_weeks)
+
+    def snapshot(self, week_start: str, week_end: str) -> WeekSnapshot:
+        # Один снимок на неделю для всех потребителей: ТОПы отчёта и задач Кванта
+        top_n = max(self.cfg.top_n, TOP_SHORTAGES_FOR_KVANT_TASK)
+        return self.query(load_week_snapshot, week_start, week_end, top_n)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                if self._pool:
+                    self._pool.putconn(self._conn)
+                else:
+                    self._conn.close()
+                self._conn = None
+
+    def __enter__(self) -> "ReportContext":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def build_report_messages_per_department(
+    cfg: BotConfig, ctx: Optional[ReportContext] = None
+) -> Tuple[str, str, List[str]]:
     """Возвращает (week_start, week_end, список текстов — по одному на филиал)."""
-    with db_connect(cfg) as conn:
-        week_start, week_end = get_last_week(conn)
-        depts = get_departments(conn, week_start, week_end)
-        missing = get_missing_by_department(conn, week_start, week_end)
-        miscount = get_miscount_by_department(conn, week_start, week_end)
-        resort = get_resort_by_department(conn, week_start, week_end)
-        top_neg_m = _top_neg_money_by_dept(conn, week_start, week_end, cfg.top_n)
-        top_pos_m = _top_pos_money_by_dept(conn, week_start, week_end, cfg.top_n)
-        top_neg_p = _top_pct_by_dept(conn, week_start, week_end, cfg.top_n, positive=False)
-        top_pos_p = _top_pct_by_dept(conn, week_start, week_end, cfg.top_n, positive=True)
-
-        # Приходы и движение по ТОП-5 (недостачи + излишки) для проверки накладных
-        receipts_by_dept: Dict[str, Dict[str, List[dict]]] = {}
-        movement_by_dept: Dict[str, Dict[str, float]] = {}
-        for dept in depts:
-            product_nums = []
-            for r in (top_neg_m.get(dept, []) or []) + (top_pos_m.get(dept, []) or []):
-                pnum = r.get("product_num")
-                if pnum and pnum not in product_nums:
-                    product_nums.append(pnum)
-            receipts_by_dept[dept] = get_receipts_for_products(
-                conn, week_start, week_end, dept, product_nums
-            )
-            # Движение нужно только для ТОП-5 недостач (проверка задублированного прихода)
-            shortage_nums = [r.get("product_num") for r in (top_neg_m.get(dept, []) or []) if r.get("product_num")]
-            movement_by_dept[dept] = get_movement_qty_for_products(
-                conn, week_start, week_end, dept, shortage_nums
-            ) if shortage_nums else {}
-
-        # Топ списаний по всем товарам: списание >= 15% от движения
-        top_writeoffs = get_top_writeoffs_by_department(
-            conn, week_start, week_end, cfg.top_n, WRITEOFF_ALARM_PCT_OF_MOVEMENT
-        )
+    if ctx is None:
+        with ReportContext(cfg) as ctx:
+            return build_report_messages_per_department(cfg, ctx)
+
+    week_start, week_end = ctx.last_week()
+    # Обе витрины за неделю читаем по разу — дальше блоки считаются из снимка
+    snapshot = ctx.snapshot(week_start, week_end)
+    depts = snapshot.departments()
+    missing = snapshot.missing()
+    miscount = snapshot.miscount()
+    resort = snapshot.resort()
+    top_neg_m = snapshot.top_neg_money(cfg.top_n)
+    top_pos_m = snapshot.top_pos_money(cfg.top_n)
+    top_neg_p = snapshot.top_pct(cfg.top_n, positive=False)
+    top_pos_p = snapshot.top_pct(cfg.top_n, positive=True)
+
+    # Приходы и движение по ТОП-5 (недостачи + излишки) для проверки накладных — по запросу на все филиалы
+    receipt_nums: Dict[str, List[str]] = {}
+    shortage_nums: Dict[str, List[str]] = {}
+    for dept in depts:
+        receipt_nums[dept] = [
+            r["product_num"]
+            for r in (top_neg_m.get(dept, []) or []) + (top_pos_m.get(dept, []) or [])
+            if r.get("product_num")
+        ]
+        # Движение нужно только для ТОП-5 недостач (проверка задублированного прихода)
+        shortage_nums[dept] = [r["product_num"] for r in (top_neg_m.get(dept, []) or []) if r.get("product_num")]
+    receipts_by_dept = ctx.query(get_receipts_for_products_by_dept, week_start, week_end, receipt_nums)
+    movement_by_dept = ctx.query(get_movement_qty_for_products_by_dept, week_start, week_end, shortage_nums)
+
+    # Топ списаний по всем товарам: списание >= 15% от движения
+    top_writeoffs = ctx.query(
+        get_top_writeoffs_by_department, week_start, week_end, cfg.top_n, WRITEOFF_ALARM_PCT_OF_MOVEMENT
+    )
 
     display_end = week_end_to_display_end(week_end)
     messages = []
@@ -628,26 +895,24 @@ def build_report_messages_per_department(cfg: BotConfig) -> Tuple[str, str, List
 TOP_SHORTAGES_FOR_KVANT_TASK = 2
 
 
-def build_top2_shortages_description(cfg: BotConfig) -> Tuple[str, str]:
+def build_top2_shortages_description(cfg: BotConfig, ctx: Optional[ReportContext] = None) -> Tuple[str, str]:
     """
     Формирует описание и ожидаемый результат для второй задачи Кванта «ТОП недостач».
     Возвращает (description, expected_result).
     """
-    with db_connect(cfg) as conn:
-        week_start, week_end = get_last_week(conn)
-        depts = get_departments(conn, week_start, week_end)
-        top_neg = _top_neg_money_by_dept(conn, week_start, week_end, TOP_SHORTAGES_FOR_KVANT_TASK)
-        receipts_by_dept = {}
-        movement_by_dept = {}
-        for dept in depts:
-            rows = top_neg.get(dept, [])
-            product_nums = [r["product_num"] for r in rows if r.get("product_num")]
-            receipts_by_dept[dept] = get_receipts_for_products(
-                conn, week_start, week_end, dept, product_nums
-            ) if product_nums else {}
-            movement_by_dept[dept] = get_movement_qty_for_products(
-                conn, week_start, week_end, dept, product_nums
-            ) if product_nums else {}
+    if ctx is None:
+        with ReportContext(cfg) as ctx:
+            return build_top2_shortages_description(cfg, ctx)
+
+    week_start, week_end = ctx.last_week()
+    snapshot = ctx.snapshot(week_start, week_end)
+    depts = snapshot.departments()
+    top_neg = snapshot.top_neg_money(TOP_SHORTAGES_FOR_KVANT_TASK)
+    product_nums = {
+        dept: [r["product_num"] for r in top_neg.get(dept, []) if r.get("product_num")] for dept in depts
+    }
+    receipts_by_dept = ctx.query(get_receipts_for_products_by_dept, week_start, week_end, product_nums)
+    movement_by_dept = ctx.query(get_movement_qty_for_products_by_dept, week_start, week_end, product_nums)
 
     display_end = week_end_to_display_end(week_end)
     lines = [
@@ -707,24 +972,30 @@ def build_top2_shortages_description(cfg: BotConfig) -> Tuple[str, str]:
     return description, expected_result
 
 
-def build_top2_results_description(cfg: BotConfig) -> Tuple[str, str]:
+def build_top2_results_description(cfg: BotConfig, ctx: Optional[ReportContext] = None) -> Tuple[str, str]:
     """
     Результаты по ТОП-2 недостач: сравниваем прошлую и текущую недели.
     Для каждой позиции из ТОП-2 недостач прошлой недели смотрим, осталась ли она в ТОП-2
     на текущей неделе (проблема тянется) или вышла из ТОПа (есть прогресс).
     Возвращает (description, expected_result).
     """
-    with db_connect(cfg) as conn:
-        weeks = get_last_two_weeks(conn)
-        (curr_start, curr_end), (prev_start, prev_end) = weeks[0], weeks[1]
-        prev_top = _top_neg_money_by_dept(conn, prev_start, prev_end, TOP_SHORTAGES_FOR_KVANT_TASK)
-        curr_top = _top_neg_money_by_dept(conn, curr_start, curr_end, TOP_SHORTAGES_FOR_KVANT_TASK)
-        curr_dev_by_dept: Dict[str, Dict[str, float]] = {}
-        for dept, rows_prev in prev_top.items():
-            product_nums = [r.get("product_num") for r in rows_prev if r.get("product_num")]
-            curr_dev_by_dept[dept] = get_deviation_for_products(
-                conn, curr_start, curr_end, dept, product_nums
-            ) if product_nums else {}
+    if ctx is None:
+        with ReportContext(cfg) as ctx:
+            return build_top2_results_description(cfg, ctx)
+
+    weeks = ctx.last_two_weeks()
+    (curr_start, curr_end), (prev_start, prev_end) = weeks[0], weeks[1]
+    prev_top = ctx.query(_top_neg_money_by_dept, prev_start, prev_end, TOP_SHORTAGES_FOR_KVANT_TASK)
+    # Текущая неделя — из снимка, который уже загрузил отчёт по филиалам
+    curr_snapshot = ctx.snapshot(curr_start, curr_end)
+    curr_top = curr_snapshot.top_neg_money(TOP_SHORTAGES_FOR_KVANT_TASK)
+    # Товары прошлого ТОПа на текущей неделе могут быть вне ТОПов снимка — отдельный пакетный запрос
+    curr_dev_by_dept = ctx.query(
+        get_deviation_for_products_by_dept,
+        curr_start,
+        curr_end,
+        {dept: [r.get("product_num") for r in rows_prev if r.get("product_num")] for dept, rows_prev in prev_top.items()},
+    )
 
     prev_display_end = week_end_to_display_end(prev_end)
     curr_display_end = week_end_to_display_end(curr_end)
@@ -821,176 +1092,194 @@ def build_summary_message(week_start: str, week_end: str, summary: List[Tuple[st
     return "\n".join(lines)
 
 
-def build_report_text(cfg: BotConfig) -> str:
+def build_report_text(cfg: BotConfig, ctx: Optional[ReportContext] = None) -> str:
     """Один большой текст (для обратной совместимости /week в режиме bot)."""
-    week_start, week_end, messages = build_report_messages_per_department(cfg)
-    with db_connect(cfg) as conn:
-        summary = get_summary_money_by_department(conn, week_start, week_end)
+    if ctx is None:
+        with ReportContext(cfg) as ctx:
+            return build_report_text(cfg, ctx)
+
+    week_start, week_end, messages = build_report_messages_per_department(cfg, ctx)
+    summary = ctx.snapshot(week_start, week_end).summary_money()
     parts = ["\n\n".join(messages), "", build_summary_message(week_start, week_end, summary)]
     return "\n".join(parts)
 
 
-def send_kvant_test_message(cfg: BotConfig, text: str) -> None:
-    """Создаёт коммуникацию в Кванте с переданным текстом (если заданы KVANT_API_KEY и KVANT_ASSIGNEE_ID)."""
-    if not cfg.kvant_api_key or not cfg.kvant_assignee_id:
-        return
+TELEGRAM_CHAT_INTERVAL_SEC = 1.0  # Telegram: не больше ~1 сообщения в секунду в один чат
+TELEGRAM_SEND_ATTEMPTS = 3
 
-    headers = {
-        # Kvant API: api-key в header (apiKey auth)
-        "api-key": cfg.kvant_api_key,
-        "Content-Type": "application/json",
-    }
 
-    now_msk = datetime.now(ZoneInfo("Europe/Moscow"))
-    # Информативная задача «Ознакомиться…» — крайний срок 24 часа.
-    due_dt = now_msk + timedelta(days=1)
-    due_at_str = due_dt.strftime("%Y-%m-%d %H:%M:%S")
+def _retry_after_seconds(value) -> float:
+    """RetryAfter.retry_after — int или timedelta в зависимости от версии python-telegram-bot."""
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TelegramSender:
+    """
+    Отправка в один чат по порядку: между сообщениями не меньше interval секунд,
+    на RetryAfter (flood control) — пауза, сколько просит Telegram, и повтор того же сообщения.
+    ChatMigrated — переключение на новый chat_id и продолжение с текущего сообщения.
+    """
+
+    def __init__(self, bot, chat_id: int, interval: float = TELEGRAM_CHAT_INTERVAL_SEC):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self._next_at = 0.0
+
+    async def _wait_turn(self) -> None:
+        delay = self._next_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, text: str) -> None:
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, TELEGRAM_SEND_ATTEMPTS + 1):
+            await self._wait_turn()
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=text)
+                self._next_at = loop.time() + self.interval
+                return
+            except RetryAfter as e:
+                if attempt == TELEGRAM_SEND_ATTEMPTS:
+                    raise
+                wait = _retry_after_seconds(e.retry_after)
+                print(f"[telegram] flood control: повтор через {wait:.0f} с")
+                self._next_at = loop.time() + wait
+            except ChatMigrated as e:
+                if attempt == TELEGRAM_SEND_ATTEMPTS:
+                    raise
+                self.chat_id = e.new_chat_id
+                print(f"Чат переехал в супергруппу. Обнови секрет TELEGRAM_CHAT_ID на: {self.chat_id}")
 
-    payload = {
+
+def _kvant_task_payload(cfg: BotConfig, title: str, description: str, expected_result: str, due_days: int) -> dict:
+    """Тело POST /tasks/store: задача на KVANT_ASSIGNEE_ID с крайним сроком через due_days дней (МСК)."""
+    due_dt = datetime.now(ZoneInfo("Europe/Moscow")) + timedelta(days=due_days)
+    return {
         "to_user_id": cfg.kvant_assignee_id,
-        "due_at": due_at_str,
+        "due_at": due_dt.strftime("%Y-%m-%d %H:%M:%S"),
         "required_deadline": 0,
         "type_id": 1,
         "inputs_values": [
-            {
-                # Название коммуникации
-                "value": "Ознакомиться с результатами инвент",
-                "task_input_id": 1,  # Название
-            },
-            {
-                # Описание задачи — полный текст отчёта бота
-                "value": text,
-                "task_input_id": 2,  # Описание
-            },
-            {
-                # Ожидаемый конечный результат
-                "value": "С информацией ознакомлен",
-                "task_input_id": 3,  # Ожидаемый результат
-            },
+            {"value": title, "task_input_id": 1},  # Название
+            {"value": description, "task_input_id": 2},  # Описание
+            {"value": expected_result, "task_input_id": 3},  # Ожидаемый результат
         ],
         "function_user_id": None,
         "task_labels": None,
-        "relation_track_users": [
-            {
-                "id": cfg.kvant_assignee_id,
-                "user_type": 1,
-            }
-        ],
+        "relation_track_users": [{"id": cfg.kvant_assignee_id, "user_type": 1}],
         "program_id": None,
     }
 
-    try:
-        resp = requests.post(
-            KVANT_TASKS_STORE_URL,
-            json=payload,
-            headers=headers,
-            timeout=10,
-        )
-        resp.raise_for_status()
-        print("[kvant] communication created successfully")
-    except requests.HTTPError as e:
-        # Логируем тело ответа, чтобы понимать причину 4xx/5xx, но не роняем workflow
-        resp = e.response
-        status = getattr(resp, "status_code", None)
-        body = getattr(resp, "text", "")
-        print(f"[kvant] http error: status={status}, body={body!r}")
-    except Exception as e:
-        status = getattr(getattr(e, "response", None), "status_code", None)
-        print(f"[kvant] error sending communication: {e!r}, status={status}")
+
+def build_kvant_report_payload(cfg: BotConfig, text: str) -> dict:
+    """Первая задача: «Ознакомиться с результатами инвент» — полный текст отчёта, срок 24 часа."""
+    return _kvant_task_payload(cfg, "Ознакомиться с результатами инвент", text, "С информацией ознакомлен", 1)
+
+
+def build_kvant_top_shortages_payload(cfg: BotConfig, ctx: Optional[ReportContext] = None) -> dict:
+    """Вторая задача: «ТОП недостач» — ТОП-2 по филиалам, проверка приходов, инструкция по ТК и ежедневному инвенту."""
+    description, expected_result = build_top2_shortages_description(cfg, ctx)
+    return _kvant_task_payload(cfg, "ТОП недостач", description, expected_result, 5)
 
 
-def send_kvant_top_shortages_task(cfg: BotConfig) -> None:
-    """Создаёт вторую задачу в Кванте: «ТОП недостач» — ТОП-2 по филиалам, проверка приходов, инструкция по ТК и ежедневному инвенту."""
+def build_kvant_top_shortages_results_payload(cfg: BotConfig, ctx: Optional[ReportContext] = None) -> dict:
+    """
+    Третья задача: «Результаты по ТОП недостач» — сравнение прошлой и текущей недели для позиций
+    из ТОП-2 недостач, фиксация прогресса и оставшихся проблем. Срок 24 часа.
+    """
+    description, expected_result = build_top2_results_description(cfg, ctx)
+    return _kvant_task_payload(cfg, "Результаты по ТОП недостач", description, expected_result, 1)
+
+
+def post_kvant_task(cfg: BotConfig, payload: dict, session: Optional[requests.Session] = None) -> None:
+    """
+    Создаёт задачу в Кванте (если заданы KVANT_API_KEY и KVANT_ASSIGNEE_ID). Ошибку только логируем,
+    не роняя workflow. session — общий пул HTTP-соединений (send_kvant_tasks); без него — отдельный запрос.
+    """
     if not cfg.kvant_api_key or not cfg.kvant_assignee_id:
         return
-    description, expected_result = build_top2_shortages_description(cfg)
+    title = payload["inputs_values"][0]["value"]
     headers = {
+        # Kvant API: api-key в header (apiKey auth)
         "api-key": cfg.kvant_api_key,
         "Content-Type": "application/json",
     }
-    now_msk = datetime.now(ZoneInfo("Europe/Moscow"))
-    due_dt = now_msk + timedelta(days=5)
-    due_at_str = due_dt.strftime("%Y-%m-%d %H:%M:%S")
-    payload = {
-        "to_user_id": cfg.kvant_assignee_id,
-        "due_at": due_at_str,
-        "required_deadline": 0,
-        "type_id": 1,
-        "inputs_values": [
-            {"value": "ТОП недостач", "task_input_id": 1},
-            {"value": description, "task_input_id": 2},
-            {"value": expected_result, "task_input_id": 3},
-        ],
-        "function_user_id": None,
-        "task_labels": None,
-        "relation_track_users": [{"id": cfg.kvant_assignee_id, "user_type": 1}],
-        "program_id": None,
-    }
     try:
-        resp = requests.post(
+        resp = (session or requests).post(
             KVANT_TASKS_STORE_URL,
             json=payload,
             headers=headers,
             timeout=10,
         )
         resp.raise_for_status()
-        print("[kvant] task 'ТОП недостач' created successfully")
+        print(f"[kvant] task '{title}' created successfully")
     except requests.HTTPError as e:
+        # Логируем тело ответа, чтобы понимать причину 4xx/5xx
         resp = e.response
         status = getattr(resp, "status_code", None)
         body = getattr(resp, "text", "")
-        print(f"[kvant] http error (ТОП недостач): status={status}, body={body!r}")
+        print(f"[kvant] http error ({title}): status={status}, body={body!r}")
     except Exception as e:
-        print(f"[kvant] error sending task 'ТОП недостач': {e!r}")
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        print(f"[kvant] error sending task '{title}': {e!r}, status={status}")
 
 
-def send_kvant_top_shortages_results_task(cfg: BotConfig) -> None:
+async def send_telegram_messages(cfg: BotConfig, messages: List[str]) -> None:
+    """Сообщения отчёта в чат TELEGRAM_CHAT_ID по порядку, через TelegramSender."""
+    async with Bot(token=cfg.telegram_token) as bot:
+        sender = TelegramSender(bot, cfg.allowed_chat_id)
+        for msg in messages:
+            await sender.send(msg)
+
+
+async def prepare_kvant_tasks(cfg: BotConfig, ctx: ReportContext) -> List[dict]:
     """
-    Создаёт третью задачу в Кванте: «Результаты по ТОП недостач» — сравнение прошлой и текущей недели
-    для позиций из ТОП-2 недостач, фиксация прогресса и оставшихся проблем.
+    Тела задач «ТОП недостач» и «Результаты по ТОП недостач» — в потоках, пока строится и уходит
+    Telegram-отчёт. Задача, которую не удалось собрать, пропускается с записью в лог.
     """
     if not cfg.kvant_api_key or not cfg.kvant_assignee_id:
+        return []
+    builders = (build_kvant_top_shortages_payload, build_kvant_top_shortages_results_payload)
+    results = await asyncio.gather(*(asyncio.to_thread(b, cfg, ctx) for b in builders), return_exceptions=True)
+    payloads = []
+    for builder, result in zip(builders, results):
+        if isinstance(result, BaseException):
+            print(f"[kvant] {builder.__name__} failed: {result!r}")
+        else:
+            payloads.append(result)
+    return payloads
+
+
+async def send_kvant_tasks(cfg: BotConfig, payloads: List[dict]) -> None:
+    """Готовые задачи Кванта параллельно, через один requests.Session (пул соединений)."""
+    if not cfg.kvant_api_key or not cfg.kvant_assignee_id or not payloads:
         return
-    description, expected_result = build_top2_results_description(cfg)
-    headers = {
-        "api-key": cfg.kvant_api_key,
-        "Content-Type": "application/json",
-    }
-    now_msk = datetime.now(ZoneInfo("Europe/Moscow"))
-    # Задача «Результаты по ТОП недостач» — крайний срок 24 часа.
-    due_dt = now_msk + timedelta(days=1)
-    due_at_str = due_dt.strftime("%Y-%m-%d %H:%M:%S")
-    payload = {
-        "to_user_id": cfg.kvant_assignee_id,
-        "due_at": due_at_str,
-        "required_deadline": 0,
-        "type_id": 1,
-        "inputs_values": [
-            {"value": "Результаты по ТОП недостач", "task_input_id": 1},
-            {"value": description, "task_input_id": 2},
-            {"value": expected_result, "task_input_id": 3},
-        ],
-        "function_user_id": None,
-        "task_labels": None,
-        "relation_track_users": [{"id": cfg.kvant_assignee_id, "user_type": 1}],
-        "program_id": None,
-    }
+    with requests.Session() as session:
+        await asyncio.gather(*(asyncio.to_thread(post_kvant_task, cfg, p, session) for p in payloads))
+
+
+async def deliver_report(cfg: BotConfig, ctx: ReportContext) -> None:
+    """
+    Режим once: отчёт в Telegram, затем задачи в Квант. Задачи создаются только после успешной
+    отправки в Telegram — повторный прогон после сбоя не плодит дубли в Кванте. Тела задач
+    (запросы к Neon и тексты) собираются параллельно с Telegram (prepare_kvant_tasks), так что
+    после отправки остаются только POST в Квант. Сообщения уходят в Telegram с ограничением частоты
+    (TelegramSender).
+    """
+    prepare = asyncio.create_task(prepare_kvant_tasks(cfg, ctx))
     try:
-        resp = requests.post(
-            KVANT_TASKS_STORE_URL,
-            json=payload,
-            headers=headers,
-            timeout=10,
-        )
-        resp.raise_for_status()
-        print("[kvant] task 'Результаты по ТОП недостач' created successfully")
-    except requests.HTTPError as e:
-        resp = e.response
-        status = getattr(resp, "status_code", None)
-        body = getattr(resp, "text", "")
-        print(f"[kvant] http error (Результаты по ТОП недостач): status={status}, body={body!r}")
-    except Exception as e:
-        print(f"[kvant] error sending task 'Результаты по ТОП недостач': {e!r}")
+        week_start, week_end, dept_messages = await asyncio.to_thread(build_report_messages_per_department, cfg, ctx)
+        # Снимок уже в мемоизации, но query может ждать блокировку соединения — не на event loop
+        snapshot = await asyncio.to_thread(ctx.snapshot, week_start, week_end)
+        summary_text = build_summary_message(week_start, week_end, snapshot.summary_money())
+        # Квант: полный отчёт (сводка + все филиалы)
+        report = build_kvant_report_payload(cfg, summary_text + "\n\n\n" + "\n\n\n".join(dept_messages))
+        await send_telegram_messages(cfg, dept_messages + [summary_text])
+    finally:
+        # Потоки подготовки работают на соединении ctx: дожидаемся их до закрытия контекста
+        await asyncio.gather(prepare, return_exceptions=True)
+    await send_kvant_tasks(cfg, [report] + prepare.result())
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1001,13 +1290,73 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("Привет! Команда /week покажет сводку по последней неделе.")
 
 
+class ReportCache:
+    """
+    Кэш текста /week для режима bot. Ключ — неделя (week_start, week_end) из get_last_week;
+    запись живёт ttl секунд и устаревает сразу, как только меняется метка get_data_version
+    (max(loaded_at) в RAW, при ALERTS_MAT — время пересчёта *_mat). Последняя неделя запоминается
+    под той же меткой, так что попадание в кэш стоит одного запроса. TTL страхует изменения,
+    которые метку не двигают (инкрементальный прогон только с удалениями, правка вьюх).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._week: Optional[Tuple[Optional[str], float, Tuple[str, str]]] = None
+        self._texts: Dict[Tuple[str, str], Tuple[Optional[str], float, str]] = {}
+
+    def get(self, version: Optional[str]) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            if self._week is None:
+                return None
+            token, expires_at, week = self._week
+            if token != version or now >= expires_at:
+                return None
+            entry = self._texts.get(week)
+            if entry is None or entry[0] != version or now >= entry[1]:
+                return None
+            return entry[2]
+
+    def put(self, version: Optional[str], week: Tuple[str, str], text: str) -> None:
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._week = (version, expires_at, week)
+            self._texts = {w: e for w, e in self._texts.items() if e[0] == version}
+            self._texts[week] = (version, expires_at, text)
+
+
+def build_week_text(cfg: BotConfig, pool: ReportPool, cache: Optional[ReportCache] = None) -> str:
+    with ReportContext(cfg, pool) as ctx:
+        if cache is None:
+            return build_report_text(cfg, ctx)
+        version = ctx.query(get_data_version)
+        text = cache.get(version)
+        if text is None:
+            text = build_report_text(cfg, ctx)
+            cache.put(version, ctx.last_week(), text)
+        return text
+
+
+async def open_db_pool(app: Application) -> None:
+    app.bot_data["db_pool"] = await asyncio.to_thread(ReportPool, app.bot_data["cfg"])
+
+
+async def close_db_pool(app: Application) -> None:
+    pool = app.bot_data.pop("db_pool", None)
+    if pool is not None:
+        pool.closeall()
+
+
 async def week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     cfg: BotConfig = context.application.bot_data["cfg"]
     if update.effective_chat and update.effective_chat.id != cfg.allowed_chat_id:
         await update.message.reply_text("Доступ к этому боту ограничен.")
         return
     try:
-        text = build_report_text(cfg)
+        # Отчёт строится в потоке на соединении из пула — polling и другие команды не ждут
+        bot_data = context.application.bot_data
+        text = await asyncio.to_thread(build_week_text, cfg, bot_data["db_pool"], bot_data["report_cache"])
     except Exception as e:
         await update.message.reply_text(f"Ошибка при формировании отчёта: {e}")
         return
@@ -1016,51 +1365,31 @@ async def week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 def main() -> None:
     cfg = load_config()
+    use_materialized_views(cfg.use_materialized)
     mode = os.getenv("ALERTS_MODE", "once").lower()
 
     if mode == "bot":
         # Долгоживущий режим: Telegram‑бот с polling (для локального запуска)
-        app = Application.builder().token(cfg.telegram_token).build()
+        # concurrent_updates: команды обрабатываются параллельно, второй /week не ждёт первый
+        app = (
+            Application.builder()
+            .token(cfg.telegram_token)
+            .concurrent_updates(True)
+            .post_init(open_db_pool)
+            .post_shutdown(close_db_pool)
+            .build()
+        )
         app.bot_data["cfg"] = cfg
+        app.bot_data["report_cache"] = ReportCache(cfg.cache_ttl) if cfg.cache_ttl > 0 else None
         app.add_handler(CommandHandler("start", start))
         app.add_handler(CommandHandler("week", week))
         app.run_polling()
     else:
-        # Режим по умолчанию: по одному сообщению на филиал, затем сводка
-        from telegram import Bot
-        from telegram.error import ChatMigrated
-
-        week_start, week_end, dept_messages = build_report_messages_per_department(cfg)
-        with db_connect(cfg) as conn:
-            summary = get_summary_money_by_department(conn, week_start, week_end)
-        summary_text = build_summary_message(week_start, week_end, summary)
-        bot = Bot(token=cfg.telegram_token)
-
-        async def send():
-            chat_id = cfg.allowed_chat_id
-            try:
-                for msg in dept_messages:
-                    await bot.send_message(chat_id=chat_id, text=msg)
-                await bot.send_message(chat_id=chat_id, text=summary_text)
-            except ChatMigrated as e:
-                chat_id = e.new_chat_id
-                print(
-                    f"Чат переехал в супергруппу. Обнови секрет TELEGRAM_CHAT_ID на: {chat_id}"
-                )
-                for msg in dept_messages:
-                    await bot.send_message(chat_id=chat_id, text=msg)
-                await bot.send_message(chat_id=chat_id, text=summary_text)
-
-        asyncio.run(send())
-        # После отправки отчёта в Telegram — три задачи в Кванте (если настроены KVANT_*).
-        # 1) Ознакомиться с результатами инвент — полный отчёт (сводка + все филиалы).
-        kvant_text = summary_text + "\n\n\n" + "\n\n\n".join(dept_messages)
-        send_kvant_test_message(cfg, kvant_text)
-        # 2) ТОП недостач — ТОП-2 по филиалам, проверка задублированных приходов, инструкция по ТК/ежедневному инвенту.
-        send_kvant_top_shortages_task(cfg)
-        # 3) Результаты по ТОП-2 недостач — сравнение прошлой и текущей недели, фиксация прогресса.
-        send_kvant_top_shortages_results_task(cfg)
-
+        # Режим по умолчанию: по одному сообщению на филиал, затем сводка; параллельно — три задачи Кванта.
+        # Один контекст на прогон: Telegram-отчёт, сводка и задачи Кванта делят соединение и результаты запросов
+        with ReportContext(cfg) as ctx:
+            asyncio.run(deliver_report(cfg, ctx))
+        print(f"[neon] {neon_db.stats.summary()}")
 
 if __name__ == "__main__":
     main()
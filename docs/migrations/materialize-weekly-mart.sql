@@ -0,0 +1,73 @@
+-- Материализованные копии недельных витрин: таблицы *_mat с теми же колонками, что у вьюх.
+-- etl.py (ETL_MATERIALIZE=1) после успешной загрузки недели вызывает inventory_mart.refresh_weekly_mat
+-- только для этой недели и следующей (у следующей «прошлая неделя» — загруженная: is_wrong_prev_inventory и т.п.).
+-- alerts_bot.py (ALERTS_MAT=1) читает *_mat вместо вьюх; DataLens можно переводить на *_mat по одному датасету.
+-- Сами вьюхи не меняются.
+-- Выполнить в Neon один раз. После изменения любой из вьюх — пересоздать её *_mat (DROP TABLE + блок ниже)
+-- и перезаполнить: колонки копируются через SELECT *, порядок должен совпадать.
+
+CREATE TABLE IF NOT EXISTS inventory_mart.weekly_deviation_products_money_v2_mat AS
+SELECT * FROM inventory_mart.weekly_deviation_products_money_v2 WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS weekly_deviation_products_money_v2_mat_week_idx
+    ON inventory_mart.weekly_deviation_products_money_v2_mat (week_start, week_end, department);
+
+CREATE TABLE IF NOT EXISTS inventory_mart.weekly_deviation_products_qty_mat AS
+SELECT * FROM inventory_mart.weekly_deviation_products_qty WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS weekly_deviation_products_qty_mat_week_idx
+    ON inventory_mart.weekly_deviation_products_qty_mat (week_start, week_end, department);
+
+CREATE TABLE IF NOT EXISTS inventory_mart.weekly_product_documents_products_mat AS
+SELECT * FROM inventory_mart.weekly_product_documents_products WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS weekly_product_documents_products_mat_week_idx
+    ON inventory_mart.weekly_product_documents_products_mat (week_start, week_end, department, product_num);
+
+CREATE TABLE IF NOT EXISTS inventory_core.weekly_movement_products_mat AS
+SELECT * FROM inventory_core.weekly_movement_products WITH NO DATA;
+
+CREATE INDEX IF NOT EXISTS weekly_movement_products_mat_week_idx
+    ON inventory_core.weekly_movement_products_mat (week_start, week_end, department, product_num);
+
+
+-- Пересчёт одной недели: удалить её строки из *_mat и вставить заново из вьюх, одной транзакцией.
+-- Advisory lock по неделе: параллельные недели бэкфилла не вставят одну и ту же неделю дважды.
+CREATE OR REPLACE FUNCTION inventory_mart.refresh_weekly_mat(p_week_start date, p_week_end date)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('inventory_mart.refresh_weekly_mat'), p_week_start - DATE '2000-01-01');
+
+    DELETE FROM inventory_mart.weekly_deviation_products_money_v2_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_mart.weekly_deviation_products_money_v2_mat
+    SELECT * FROM inventory_mart.weekly_deviation_products_money_v2
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    DELETE FROM inventory_mart.weekly_deviation_products_qty_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_mart.weekly_deviation_products_qty_mat
+    SELECT * FROM inventory_mart.weekly_deviation_products_qty
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    DELETE FROM inventory_mart.weekly_product_documents_products_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_mart.weekly_product_documents_products_mat
+    SELECT * FROM inventory_mart.weekly_product_documents_products
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    DELETE FROM inventory_core.weekly_movement_products_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_core.weekly_movement_products_mat
+    SELECT * FROM inventory_core.weekly_movement_products
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+END;
+$$;
+
+
+-- Первичное заполнение: все недели, которые уже лежат в RAW.
+SELECT inventory_mart.refresh_weekly_mat(w.date_from, w.date_to)
+FROM (SELECT DISTINCT date_from, date_to FROM inventory_raw.olap_postings) w
+ORDER BY w.date_from;
@@ -0,0 +1,8 @@
+-- Индекс по inventory_raw.olap_postings.loaded_at: alerts_bot.py в режиме bot на каждый /week
+-- проверяет свежесть кэша запросом select max(loaded_at) — с индексом это чтение одного конца индекса
+-- (на секционированной таблице — по концу индекса каждой секции), без прохода по RAW.
+-- На секционированной таблице (partition-olap-postings.sql) индекс создаётся на всех секциях,
+-- в том числе будущих. Выполнить в Neon один раз.
+
+CREATE INDEX IF NOT EXISTS olap_postings_loaded_at_idx
+    ON inventory_raw.olap_postings (loaded_at);
@@ -0,0 +1,92 @@
+-- inventory_raw.olap_postings → таблица, секционированная по date_from (RANGE), по секции на период ETL
+-- (olap_postings_YYYYMMDD_YYYYMMDD), плюс DEFAULT-секция для периодов, которые пересекаются с уже заведёнными.
+-- Индексы под пути доступа:
+--   (report_id, date_from, date_to) INCLUDE (source_hash) — удаление/сверка периода в etl.py (index-only scan);
+--   (date_from, date_to, department, product_num)         — PARTITION BY в core-вьюхах, фильтры alerts_bot по неделе и филиалу;
+--   (department, posting_dt) WHERE INVENTORY_CORRECTION   — поиск дней инвентаризации в raw_inventory_* вьюхах.
+-- Уникальность source_hash: у секционированной таблицы ключ обязан включать date_from → UNIQUE (source_hash, date_from).
+-- source_hash сам считается от date_from, так что дублей это не добавляет; etl.py пишет с ON CONFLICT DO NOTHING без списка колонок.
+--
+-- Вьюхи ссылаются на таблицу по OID, поэтому прямые зависимые вьюхи пересоздаются (CREATE OR REPLACE с тем же текстом)
+-- уже поверх новой таблицы; вьюхи второго уровня ссылаются на них и не меняются.
+-- Старая таблица остаётся как inventory_raw.olap_postings_unpartitioned — удалить после проверки (DROP TABLE, без CASCADE).
+--
+-- Выполнить в Neon один раз, целиком (одна транзакция). После — ETL_PARTITIONS=1 в etl.py
+-- и проверка планов: python scripts/check_olap_indexes.py
+
+BEGIN;
+
+-- 1. Тексты вьюх, которые читают olap_postings напрямую (до переименования — иначе в тексте будет старое имя)
+CREATE TEMP TABLE _olap_postings_views ON COMMIT DROP AS
+SELECT DISTINCT v.oid::regclass::text AS view_name,
+       rtrim(rtrim(pg_get_viewdef(v.oid)), ';') AS view_def
+FROM pg_depend d
+JOIN pg_rewrite r ON r.oid = d.objid
+JOIN pg_class v ON v.oid = r.ev_class
+WHERE d.classid = 'pg_rewrite'::regclass
+  AND d.refobjid = 'inventory_raw.olap_postings'::regclass
+  AND v.oid <> d.refobjid
+  AND v.relkind = 'v';
+
+ALTER TABLE inventory_raw.olap_postings RENAME TO olap_postings_unpartitioned;
+
+-- 2. Новая секционированная таблица
+CREATE TABLE inventory_raw.olap_postings (
+    LIKE inventory_raw.olap_postings_unpartitioned INCLUDING DEFAULTS
+) PARTITION BY RANGE (date_from);
+
+ALTER TABLE inventory_raw.olap_postings
+    ADD CONSTRAINT olap_postings_source_hash_date_from_key UNIQUE (source_hash, date_from);
+
+CREATE INDEX olap_postings_period_idx
+    ON inventory_raw.olap_postings (report_id, date_from, date_to) INCLUDE (source_hash);
+
+CREATE INDEX olap_postings_week_dept_product_idx
+    ON inventory_raw.olap_postings (date_from, date_to, department, product_num);
+
+CREATE INDEX olap_postings_inventory_correction_idx
+    ON inventory_raw.olap_postings (department, posting_dt)
+    WHERE transaction_type = 'INVENTORY_CORRECTION';
+
+CREATE TABLE inventory_raw.olap_postings_default PARTITION OF inventory_raw.olap_postings DEFAULT;
+
+-- 3. Секции под уже загруженные периоды (пересекающийся период останется в DEFAULT)
+DO $$
+DECLARE
+    p record;
+BEGIN
+    FOR p IN
+        SELECT DISTINCT date_from, date_to
+        FROM inventory_raw.olap_postings_unpartitioned
+        WHERE date_to > date_from
+        ORDER BY date_from, date_to
+    LOOP
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE inventory_raw.%I PARTITION OF inventory_raw.olap_postings FOR VALUES FROM (%L) TO (%L)',
+                'olap_postings_' || to_char(p.date_from, 'YYYYMMDD') || '_' || to_char(p.date_to, 'YYYYMMDD'),
+                p.date_from,
+                p.date_to
+            );
+        EXCEPTION WHEN invalid_object_definition THEN
+            RAISE NOTICE 'период % → % пересекается с другой секцией, строки останутся в DEFAULT', p.date_from, p.date_to;
+        END;
+    END LOOP;
+END $$;
+
+-- 4. Данные
+INSERT INTO inventory_raw.olap_postings SELECT * FROM inventory_raw.olap_postings_unpartitioned;
+
+-- 5. Прямые зависимые вьюхи — заново поверх новой таблицы
+DO $$
+DECLARE
+    v record;
+BEGIN
+    FOR v IN SELECT view_name, view_def FROM _olap_postings_views LOOP
+        EXECUTE format('CREATE OR REPLACE VIEW %s AS %s', v.view_name, v.view_def);
+    END LOOP;
+END $$;
+
+ANALYZE inventory_raw.olap_postings;
+
+COMMIT;
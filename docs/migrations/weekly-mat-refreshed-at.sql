@@ -0,0 +1,56 @@
+-- Метка пересчёта материализованных витрин: inventory_mart.refresh_weekly_mat пишет время пересчёта недели
+-- в inventory_mart.weekly_mat_refreshed. alerts_bot.py с ALERTS_MAT=1 сбрасывает кэш /week по max(refreshed_at),
+-- а не по max(loaded_at) в RAW: etl.py коммитит пересчёт *_mat отдельной транзакцией после загрузки RAW,
+-- и /week между этими commit закэшировал бы старые *_mat под новой меткой RAW.
+-- Требует materialize-weekly-mart.sql. Выполнить в Neon один раз.
+
+CREATE TABLE IF NOT EXISTS inventory_mart.weekly_mat_refreshed (
+    week_start   date        NOT NULL,
+    week_end     date        NOT NULL,
+    refreshed_at timestamptz NOT NULL,
+    PRIMARY KEY (week_start, week_end)
+);
+
+-- То же, что в materialize-weekly-mart.sql, плюс отметка о пересчёте в конце (в той же транзакции).
+-- Строка на неделю: параллельные недели бэкфилла не ждут друг друга на одной строке метки.
+CREATE OR REPLACE FUNCTION inventory_mart.refresh_weekly_mat(p_week_start date, p_week_end date)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('inventory_mart.refresh_weekly_mat'), p_week_start - DATE '2000-01-01');
+
+    DELETE FROM inventory_mart.weekly_deviation_products_money_v2_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_mart.weekly_deviation_products_money_v2_mat
+    SELECT * FROM inventory_mart.weekly_deviation_products_money_v2
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    DELETE FROM inventory_mart.weekly_deviation_products_qty_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_mart.weekly_deviation_products_qty_mat
+    SELECT * FROM inventory_mart.weekly_deviation_products_qty
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    DELETE FROM inventory_mart.weekly_product_documents_products_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_mart.weekly_product_documents_products_mat
+    SELECT * FROM inventory_mart.weekly_product_documents_products
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    DELETE FROM inventory_core.weekly_movement_products_mat
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+    INSERT INTO inventory_core.weekly_movement_products_mat
+    SELECT * FROM inventory_core.weekly_movement_products
+    WHERE week_start = p_week_start AND week_end = p_week_end;
+
+    INSERT INTO inventory_mart.weekly_mat_refreshed (week_start, week_end, refreshed_at)
+    VALUES (p_week_start, p_week_end, clock_timestamp())
+    ON CONFLICT (week_start, week_end) DO UPDATE SET refreshed_at = EXCLUDED.refreshed_at;
+END;
+$$;
+
+-- Начальная метка для уже заполненных *_mat: иначе до первого пересчёта max(refreshed_at) пуст
+INSERT INTO inventory_mart.weekly_mat_refreshed (week_start, week_end, refreshed_at)
+SELECT DISTINCT week_start, week_end, now() FROM inventory_mart.weekly_deviation_products_money_v2_mat
+ON CONFLICT DO NOTHING;
@@ -1,73 +1,192 @@
 """Точка входа: команды моста ЭДО ↔ iiko."""
 import json
 import sys
+from itertools import chain
+
+INCOMING_FILTER_CATEGORY = "Any.InboundNotRevoked"
 
 
 def _usage() -> str:
     return (
         "Использование:\n"
-        "  python -m edo_iiko_bridge.cli fetch-incoming\n"
-        "  python -m edo_iiko_bridge.cli fetch-document <messageId> <entityId>\n"
+        "  python -m edo_iiko_bridge.cli fetch-incoming [--full]\n"
+        "  python -m edo_iiko_bridge.cli fetch-document <messageId> <entityId> [--stream]\n"
+        "  python -m edo_iiko_bridge.cli fetch-incoming | python -m edo_iiko_bridge.cli fetch-documents\n"
         "  python -m edo_iiko_bridge.cli list-products\n"
         "  python -m edo_iiko_bridge.cli create-incoming "
         "<messageId> <entityId> <supplierId> <storeId> <documentNumber> <dateIncoming>"
     )
 
 
-def cmd_fetch_incoming() -> None:
+def cmd_fetch_incoming(full: bool = False) -> None:
+    """Входящие, пришедшие после прошлого запуска (IndexKey в DIADOC_SYNC_STATE_FILE); full — весь ящик заново."""
     from edo_iiko_bridge.config import Config
     from edo_iiko_bridge.clients import DiadocClient
+    from edo_iiko_bridge.sync_state import load_index_key, save_index_key
 
     cfg = Config.from_env()
     client = DiadocClient(cfg.diadoc)
     box_id = client.get_default_box_id()
     print(f"Ящик: {box_id}", file=sys.stderr)
-    docs = client.get_incoming_documents(box_id=box_id, limit=20)
-    print(f"Входящих документов: {len(docs)}", file=sys.stderr)
-    for i, d in enumerate(docs):
-        doc_type = d.get("DocumentType") or d.get("TypeNamedId") or "?"
-        doc_number = d.get("DocumentNumber") or ""
-        print(
-            json.dumps(
-                {
-                    "index": i + 1,
-                    "type": doc_type,
-                    "documentNumber": doc_number,
-                    "messageId": d.get("MessageId"),
-                    "entityId": d.get("EntityId"),
-                },
-                ensure_ascii=False,
+    after_key = None if full else load_index_key(cfg.sync_state_file, box_id, INCOMING_FILTER_CATEGORY)
+    if after_key:
+        print(f"Синхронизация после IndexKey {after_key} ({cfg.sync_state_file})", file=sys.stderr)
+    else:
+        print("Синхронизация: весь ящик, от старых к новым", file=sys.stderr)
+
+    count = 0
+    last_key = None
+    try:
+        for d in client.iter_documents(box_id, INCOMING_FILTER_CATEGORY, after_index_key=after_key):
+            count += 1
+            last_key = d.get("IndexKey") or last_key
+            doc_type = d.get("DocumentType") or d.get("TypeNamedId") or "?"
+            doc_number = d.get("DocumentNumber") or ""
+            print(
+                json.dumps(
+                    {
+                        "index": count,
+                        "type": doc_type,
+                        "documentNumber": doc_number,
+                        "messageId": d.get("MessageId"),
+                        "entityId": d.get("EntityId"),
+                    },
+                    ensure_ascii=False,
+                )
             )
-        )
+    finally:
+        # Сохраняем и при обрыве: уже выведенные документы в следующий раз не повторятся
+        if last_key:
+            save_index_key(cfg.sync_state_file, box_id, INCOMING_FILTER_CATEGORY, last_key)
+    print(f"Новых входящих документов: {count}", file=sys.stderr)
+
+
+def _line_item_json(item) -> dict:
+    return {
+        "lineNumber": item.line_number,
+        "name": item.name,
+        "quantity": item.quantity,
+        "unit": item.unit,
+        "price": item.price,
+        "sumWithVat": item.sum_with_vat,
+        "productCode": item.product_code,
+    }
+
+
+def _open_document_store(cfg):
+    from edo_iiko_bridge.document_store import DocumentStore
+
+    return DocumentStore(cfg.document_store_dir, cfg.document_store_max_mb * 1024 * 1024)
+
+
+def _get_document_content(cfg, message_id: str, entity_id: str) -> bytes:
+    """XML документа из локального хранилища (DIADOC_STORE_DIR), иначе из Диадока — с сохранением в хранилище."""
+    from edo_iiko_bridge.clients import DiadocClient
+    from edo_iiko_bridge.document_store import document_key
+
+    key = document_key(message_id, entity_id)
+    with _open_document_store(cfg) as store:
+        content = store.get(key)
+        if content is not None:
+            print(f"УПД {key}: из локального хранилища {cfg.document_store_dir}", file=sys.stderr)
+            return content
+        client = DiadocClient(cfg.diadoc)
+        box_id = client.get_default_box_id()
+        content = client.get_entity_content(box_id, message_id, entity_id)
+        store.put(key, content)
+        return content
 
 
 def cmd_fetch_document(message_id: str, entity_id: str) -> None:
     from edo_iiko_bridge.config import Config
-    from edo_iiko_bridge.clients import DiadocClient
     from edo_iiko_bridge.parsers import parse_upd_xml_line_items
 
     cfg = Config.from_env()
-    client = DiadocClient(cfg.diadoc)
-    box_id = client.get_default_box_id()
-    content = client.get_entity_content(box_id, message_id, entity_id)
+    content = _get_document_content(cfg, message_id, entity_id)
     print(f"Размер контента: {len(content)} байт", file=sys.stderr)
     lines = parse_upd_xml_line_items(content)
     print(f"Строк в УПД: {len(lines)}", file=sys.stderr)
     for item in lines:
+        print(json.dumps(_line_item_json(item), ensure_ascii=False))
+
+
+def cmd_fetch_document_stream(message_id: str, entity_id: str) -> None:
+    """Большой УПД: разбор прямо из ответа Диадока, строки печатаются по мере чтения (в хранилище не сохраняется)."""
+    from edo_iiko_bridge.config import Config
+    from edo_iiko_bridge.clients import DiadocClient
+    from edo_iiko_bridge.parsers import iter_upd_line_items
+
+    cfg = Config.from_env()
+    client = DiadocClient(cfg.diadoc)
+    box_id = client.get_default_box_id()
+    stream = client.get_entity_content(box_id, message_id, entity_id, stream=True)
+    count = 0
+    try:
+        for item in iter_upd_line_items(stream):
+            print(json.dumps(_line_item_json(item), ensure_ascii=False))
+            count += 1
+    finally:
+        stream.close()
+    print(f"Строк в УПД: {count}", file=sys.stderr)
+
+
+def cmd_fetch_documents(lines) -> None:
+    """
+    Пакетное скачивание УПД: на входе JSON-строки с messageId/entityId (вывод fetch-incoming),
+    содержимое качается параллельно (DIADOC_DOWNLOAD_WORKERS) и разбирается по мере готовности.
+    На выходе — по JSON-строке на документ: messageId, entityId, строки УПД или ошибка.
+    """
+    from edo_iiko_bridge.config import Config
+    from edo_iiko_bridge.clients import DiadocClient, EntityDownload
+    from edo_iiko_bridge.document_store import document_key
+    from edo_iiko_bridge.parsers import parse_upd_xml_line_items
+
+    refs = []
+    for raw in lines:
+        raw = raw.strip()
+        if not raw:
+            continue
+        d = json.loads(raw)
+        if d.get("messageId") and d.get("entityId"):
+            refs.append((d["messageId"], d["entityId"]))
+
+    cfg = Config.from_env()
+    with _open_document_store(cfg) as store:
+        cached = []
+        to_download = []
+        for message_id, entity_id in refs:
+            content = store.get(document_key(message_id, entity_id))
+            if content is not None:
+                cached.append(EntityDownload(message_id, entity_id, content=content))
+            else:
+                to_download.append((message_id, entity_id))
         print(
-            json.dumps(
-                {
-                    "lineNumber": item.line_number,
-                    "name": item.name,
-                    "quantity": item.quantity,
-                    "unit": item.unit,
-                    "price": item.price,
-                    "sumWithVat": item.sum_with_vat,
-                    "productCode": item.product_code,
-                },
-                ensure_ascii=False,
-            )
+            f"Документов: {len(refs)}, из локального хранилища: {len(cached)}, "
+            f"к скачиванию: {len(to_download)} (параллельно: {cfg.diadoc.download_workers})",
+            file=sys.stderr,
         )
+        downloads = iter(())
+        if to_download:
+            client = DiadocClient(cfg.diadoc)
+            downloads = client.iter_entity_contents(client.get_default_box_id(), to_download)
+        failed = 0
+        for downloaded, res in chain(((False, r) for r in cached), ((True, r) for r in downloads)):
+            out = {"messageId": res.message_id, "entityId": res.entity_id}
+            if downloaded and res.error is None:
+                store.put(document_key(res.message_id, res.entity_id), res.content)
+            if res.error is not None:
+                failed += 1
+                out["error"] = str(res.error)
+                print(f"Ошибка скачивания {res.message_id}/{res.entity_id}: {res.error}", file=sys.stderr)
+            else:
+                try:
+                    out["lines"] = [_line_item_json(item) for item in parse_upd_xml_line_items(res.content)]
+                except Exception as e:
+                    failed += 1
+                    out["error"] = f"разбор УПД: {e}"
+                    print(f"Ошибка разбора {res.message_id}/{res.entity_id}: {e}", file=sys.stderr)
+            print(json.dumps(out, ensure_ascii=False), flush=True)
+    print(f"Готово: {len(refs) - failed}, с ошибками: {failed}", file=sys.stderr)
 
 
 def cmd_list_products() -> None:
@@ -77,7 +196,10 @@ def cmd_list_products() -> None:
 
     cfg = Config.from_env()
     client = IikoRestoClient(cfg.iiko)
-    products = client.get_products()
+    try:
+        products = client.get_products()
+    finally:
+        client.close()
     print(f"Товаров в номенклатуре: {len(products)}", file=sys.stderr)
     for p in products:
         print(json.dumps({"id": p["id"], "name": p["name"], "articul": p["articul"]}, ensure_ascii=False))
@@ -99,7 +221,8 @@ def cmd_create_incoming(
     from pathlib import Path
 
     from edo_iiko_bridge.config import Config
-    from edo_iiko_bridge.clients import DiadocClient, IikoRestoClient
+    from edo_iiko_bridge.clients import IikoRestoClient
+    from edo_iiko_bridge.document_store import document_key
     from edo_iiko_bridge.parsers import parse_upd_xml_line_items
     from edo_iiko_bridge.mapping_store import load_mapping, find_mapping_for_line
     from edo_iiko_bridge.incoming_invoice_builder import (
@@ -109,10 +232,8 @@ def cmd_create_incoming(
 
     cfg = Config.from_env()
 
-    # 1. Забираем XML УПД из Диадока
-    diadoc_client = DiadocClient(cfg.diadoc)
-    box_id = diadoc_client.get_default_box_id()
-    content = diadoc_client.get_entity_content(box_id, message_id, entity_id)
+    # 1. Забираем XML УПД (из локального хранилища или из Диадока)
+    content = _get_document_content(cfg, message_id, entity_id)
 
     # 2. Парсим строки УПД
     items = parse_upd_xml_line_items(content)
@@ -120,12 +241,11 @@ def cmd_create_incoming(
 
     # 3. Загружаем маппинг «строка УПД ↔ товар iiko»
     mapping_entries = load_mapping(Path(cfg.mapping_file))
-    document_key = f"{message_id}|{entity_id}"
     lines = []
     for item in items:
         m = find_mapping_for_line(
             mapping_entries,
-            document_key=document_key,
+            document_key=document_key(message_id, entity_id),
             line_number=item.line_number,
             product_code_edo=item.product_code or None,
         )
@@ -145,7 +265,10 @@ def cmd_create_incoming(
 
     # 5. Отправляем в iiko
     iiko_client = IikoRestoClient(cfg.iiko)
-    result = iiko_client.import_incoming_invoice(xml_body)
+    try:
+        result = iiko_client.import_incoming_invoice(xml_body)
+    finally:
+        iiko_client.close()
 
     print(json.dumps(result, ensure_ascii=False))
 
@@ -157,13 +280,21 @@ def main() -> None:
     cmd = sys.argv[1]
     try:
         if cmd == "fetch-incoming":
-            cmd_fetch_incoming()
+            if sys.argv[2:] not in ([], ["--full"]):
+                print(_usage(), file=sys.stderr)
+                sys.exit(1)
+            cmd_fetch_incoming(full=sys.argv[2:] == ["--full"])
         elif cmd == "fetch-document":
-            if len(sys.argv) != 4:
+            if len(sys.argv) not in (4, 5) or sys.argv[4:] not in ([], ["--stream"]):
                 print("fetch-document требует messageId и entityId", file=sys.stderr)
                 print(_usage(), file=sys.stderr)
                 sys.exit(1)
-            cmd_fetch_document(sys.argv[2], sys.argv[3])
+            if sys.argv[4:] == ["--stream"]:
+                cmd_fetch_document_stream(sys.argv[2], sys.argv[3])
+            else:
+                cmd_fetch_document(sys.argv[2], sys.argv[3])
+        elif cmd == "fetch-documents":
+            cmd_fetch_documents(sys.stdin)
         elif cmd == "list-products":
             cmd_list_products()
         elif cmd == "create-incoming":
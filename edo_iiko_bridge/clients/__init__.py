@@ -1,4 +1,5 @@
-from .diadoc_client import DiadocClient
+from .diadoc_client import DiadocClient, EntityDownload
 from .iiko_resto_client import IikoRestoClient
+from .iiko_session import IikoSession
 
-__all__ = ["DiadocClient", "IikoRestoClient"]
+__all__ = ["DiadocClient", "EntityDownload", "IikoRestoClient", "IikoSession"]
@@ -1,15 +1,33 @@
 """Клиент API Диадока: авторизация (логин/пароль + api_client_id), организации, входящие документы."""
 from __future__ import annotations
 
-import urllib.parse
-from typing import Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import IO, Any, Iterable, Iterator
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from edo_iiko_bridge.config import DiadocConfig
 
 DIADOC_API_BASE = "https://diadoc-api.kontur.ru"
 
+# Ответы, после которых запрос повторяется с паузой: лимит запросов и временные ошибки сервера
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF_SEC = 1.0
+
+
+@dataclass
+class EntityDownload:
+    """Результат скачивания одной сущности: content или error (ошибка не прерывает остальные загрузки)."""
+    message_id: str
+    entity_id: str
+    content: bytes | None = None
+    error: Exception | None = None
+
 
 class DiadocClient:
     """Работа с API Диадока: устаревшая схема DiadocAuth (api_client_id + токен по логину/паролю)."""
@@ -17,11 +35,17 @@ class DiadocClient:
     def __init__(self, config: DiadocConfig) -> None:
         self._config = config
         self._session = requests.Session()
+        # Все запросы идут на один хост: пул соединений = число параллельных загрузок
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, config.download_workers))
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._lock = threading.Lock()
         self._token: str | None = None
 
     def _auth_header(self) -> dict[str, str]:
-        if not self._token:
-            self._token = self._authenticate()
+        with self._lock:
+            if not self._token:
+                self._token = self._authenticate()
         return {
             "Authorization": f"DiadocAuth ddauth_api_client_id={self._config.api_key},ddauth_token={self._token}"
         }
@@ -71,8 +95,12 @@ class DiadocClient:
         filter_category: str = "Any.InboundNotRevoked",
         count: int = 100,
         sort_direction: str = "Descending",
+        after_index_key: str | None = None,
     ) -> dict[str, Any]:
-        """Список документов (GET /V3/GetDocuments). По умолчанию — входящие неаннулированные."""
+        """
+        Одна страница документов (GET /V3/GetDocuments, не больше 100). По умолчанию — входящие неаннулированные.
+        after_index_key — IndexKey документа, после которого (в порядке sort_direction) начинается страница.
+        """
         url = f"{DIADOC_API_BASE}/V3/GetDocuments"
         params: dict[str, str | int] = {
             "boxId": box_id,
@@ -80,15 +108,48 @@ class DiadocClient:
             "count": min(max(1, count), 100),
             "sortDirection": sort_direction,
         }
-        encoded = {k: (urllib.parse.quote(str(v)) if k == "afterIndexKey" else v) for k, v in params.items()}
+        if after_index_key:
+            params["afterIndexKey"] = after_index_key
         headers = {
             **self._auth_header(),
             "Accept": "application/json; charset=utf-8",
         }
-        resp = self._session.get(url, params=encoded, headers=headers, timeout=30)
+        resp = self._session.get(url, params=params, headers=headers, timeout=30)
         resp.raise_for_status()
         return resp.json()
 
+    def iter_documents(
+        self,
+        box_id: str,
+        filter_category: str = "Any.InboundNotRevoked",
+        after_index_key: str | None = None,
+        sort_direction: str = "Ascending",
+        page_size: int = 100,
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Все документы ящика по страницам через afterIndexKey, лениво: следующая страница запрашивается,
+        когда дочитана текущая. По умолчанию — от старых к новым после after_index_key, так что
+        IndexKey последнего полученного документа можно сохранить и в следующий раз продолжить с него.
+        """
+        page_size = min(max(1, page_size), 100)
+        key = after_index_key
+        while True:
+            data = self.get_documents(
+                box_id=box_id,
+                filter_category=filter_category,
+                count=page_size,
+                sort_direction=sort_direction,
+                after_index_key=key,
+            )
+            docs = data.get("Documents") or []
+            yield from docs
+            has_more = data.get("HasMoreResults")
+            if not docs or has_more is False or (has_more is None and len(docs) < page_size):
+                return
+            key = docs[-1].get("IndexKey")
+            if not key:
+                return
+
     def get_incoming_documents(self, box_id: str | None = None, limit: int = 20) -> list[dict[str, Any]]:
         """Входящие документы (первые limit записей)."""
         bid = box_id or self.get_default_box_id()
@@ -100,14 +161,72 @@ class DiadocClient:
         )
         return data.get("Documents") or []
 
-    def get_entity_content(self, box_id: str, message_id: str, entity_id: str) -> bytes:
-        """Содержимое сущности документа (GET /V4/GetEntityContent). Возвращает сырые байты (обычно XML)."""
+    def get_entity_content(
+        self,
+        box_id: str,
+        message_id: str,
+        entity_id: str,
+        stream: bool = False,
+    ) -> bytes | IO[bytes]:
+        """
+        Содержимое сущности документа (GET /V4/GetEntityContent). Возвращает сырые байты (обычно XML).
+        stream=True — файловый объект, читающий тело ответа по мере прихода (для iter_upd_line_items
+        на больших УПД); его нужно закрыть после чтения.
+        """
         url = f"{DIADOC_API_BASE}/V4/GetEntityContent"
         params = {"boxId": box_id, "messageId": message_id, "entityId": entity_id}
         headers = self._auth_header()
-        resp = self._session.get(url, params=params, headers=headers, timeout=60)
-        resp.raise_for_status()
-        return resp.content
-
-
-__all__ = ["DiadocClient", "DIADOC_API_BASE"]
+        resp = self._get_with_backoff(url, params=params, headers=headers, timeout=60, stream=stream)
+        if not stream:
+            resp.raise_for_status()
+            return resp.content
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError:
+            resp.close()
+            raise
+        resp.raw.decode_content = True  # gzip/deflate транспорта снимается при чтении
+        return resp.raw
+
+    def _get_with_backoff(self, url: str, **kwargs: Any) -> requests.Response:
+        """GET с повтором на 429/5xx: пауза из Retry-After, иначе 1, 2, 4, 8 с."""
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            resp = self._session.get(url, **kwargs)
+            if resp.status_code not in RETRY_STATUSES or attempt == RETRY_ATTEMPTS:
+                return resp
+            retry_after = resp.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else RETRY_BACKOFF_SEC * 2 ** (attempt - 1)
+            resp.close()
+            time.sleep(delay)
+        return resp
+
+    def iter_entity_contents(
+        self,
+        box_id: str,
+        refs: Iterable[tuple[str, str]],
+        workers: int | None = None,
+    ) -> Iterator[EntityDownload]:
+        """
+        Содержимое нескольких сущностей (messageId, entityId) параллельно, не больше workers запросов
+        к Диадоку одновременно (по умолчанию DiadocConfig.download_workers). Результаты отдаются
+        по мере готовности, не в порядке refs; ошибка одной загрузки — в EntityDownload.error.
+        """
+        refs = list(refs)
+        if not refs:
+            return
+        self._auth_header()  # авторизуемся до старта потоков, дальше все загрузки идут с этим токеном
+        n = max(1, min(workers or self._config.download_workers, len(refs)))
+
+        def download(message_id: str, entity_id: str) -> EntityDownload:
+            try:
+                return EntityDownload(message_id, entity_id, content=self.get_entity_content(box_id, message_id, entity_id))
+            except Exception as e:
+                return EntityDownload(message_id, entity_id, error=e)
+
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            futures = [pool.submit(download, m, e) for m, e in refs]
+            for fut in as_completed(futures):
+                yield fut.result()
+
+
+__all__ = ["DiadocClient", "DIADOC_API_BASE", "EntityDownload"]
@@ -7,43 +7,30 @@ import xml.etree.ElementTree as ET
 
 import requests
 
+from edo_iiko_bridge.clients.iiko_session import IikoSession
 from edo_iiko_bridge.config import IikoRestoConfig
 
 
 class IikoRestoClient:
-    """Клиент iiko Server REST. Авторизация как в ETL: GET .../resto/api/auth?login=&pass= (SHA1)."""
+    """Клиент iiko Server REST. Авторизация как в ETL: GET .../resto/api/auth?login=&pass= (SHA1).
 
-    def __init__(self, config: IikoRestoConfig) -> None:
+    Ключ и HTTP-сессия — в IikoSession; её можно передать снаружи, чтобы делить один ключ с другими клиентами.
+    """
+
+    def __init__(self, config: IikoRestoConfig, session: IikoSession | None = None) -> None:
         self._config = config
-        self._session = requests.Session()
-        self._key: str | None = None
+        self._iiko = session or IikoSession(config)
 
     def _get_key(self) -> str:
-        if self._key is not None:
-            return self._key
-        base = self._config.base_url.rstrip("/")
-        login = self._config.login.strip()
-        sha1 = self._config.password_sha1.strip().lower()
-        for path in ("/api/auth", "/resto/api/auth"):
-            url = base + path
-            resp = self._session.get(
-                url,
-                params={"login": login, "pass": sha1},
-                verify=self._config.verify_ssl,
-                timeout=30,
-            )
-            if resp.status_code == 200 and resp.text.strip():
-                self._key = resp.text.strip()
-                return self._key
-        raise RuntimeError("iiko auth failed")
+        return self._iiko.get_key()
+
+    def close(self) -> None:
+        """Logout в iiko (освобождает слот лицензии) и закрытие HTTP-сессии."""
+        self._iiko.close()
 
     def _get(self, path: str, params: dict[str, str] | None = None) -> Any:
         """GET запрос к Resto API с подстановкой ключа."""
-        base = self._config.base_url.rstrip("/")
-        url = f"{base}/resto/{path.lstrip('/')}"
-        q = dict(params or {})
-        q["key"] = self._get_key()
-        resp = self._session.get(url, params=q, verify=self._config.verify_ssl, timeout=60)
+        resp = self._iiko.request("GET", f"/resto/{path.lstrip('/')}", params=params, timeout=60)
         resp.raise_for_status()
         if not resp.text.strip():
             return None
@@ -82,15 +69,11 @@ class IikoRestoClient:
         и возвращает результат валидации как словарь
         {"documentNumber": str | None, "valid": bool | None, "warning": bool | None, "raw": str}.
         """
-        base = self._config.base_url.rstrip("/")
-        url = f"{base}/resto/api/documents/import/incomingInvoice"
-        params = {"key": self._get_key()}
-        resp = self._session.post(
-            url,
-            params=params,
+        resp = self._iiko.request(
+            "POST",
+            "/resto/api/documents/import/incomingInvoice",
             data=xml_body.encode("utf-8"),
             headers={"Content-Type": "application/xml; charset=utf-8"},
-            verify=self._config.verify_ssl,
             timeout=60,
         )
         resp.raise_for_status()
@@ -0,0 +1,140 @@
+"""Общая сессия iiko Server: keep-alive, кэш ключа с TTL, повторная авторизация на 401, logout.
+
+Используется и ETL (etl.py), и мостом (IikoRestoClient): каждая авторизация в iiko занимает
+слот лицензии, поэтому ключ берём один раз на процесс и отдаём его обратно при выходе.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from edo_iiko_bridge.config import IikoRestoConfig
+
+# Пути авторизации в порядке перебора и соответствующие им пути выхода
+AUTH_PATHS = ("/api/auth", "/resto/api/auth")
+LOGOUT_PATHS = {"/api/auth": "/api/logout", "/resto/api/auth": "/resto/api/logout"}
+
+# Сколько секунд считаем ключ живым без повторной авторизации
+DEFAULT_KEY_TTL = 30 * 60
+
+
+class IikoSession:
+    """Одна keep-alive HTTP-сессия к iiko Server и один ключ на процесс.
+
+    Ключ кэшируется на key_ttl секунд; если iiko ответил 401 (ключ протух раньше),
+    авторизуемся заново и повторяем запрос один раз. Путь авторизации, который сработал,
+    запоминается и пробуется первым при следующей авторизации.
+    """
+
+    def __init__(
+        self,
+        config: IikoRestoConfig,
+        key_ttl: float = DEFAULT_KEY_TTL,
+        pool_size: int = 10,
+    ) -> None:
+        self._config = config
+        self._base = config.base_url.rstrip("/")
+        self._key_ttl = key_ttl
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._key: str | None = None
+        self._key_at = 0.0
+        self._auth_path: str | None = None
+
+    @property
+    def base_url(self) -> str:
+        return self._base
+
+    @property
+    def auth_path(self) -> str | None:
+        """Путь авторизации, который сработал в последний раз (None — ещё не авторизовались)."""
+        return self._auth_path
+
+    def get_key(self) -> str:
+        """Ключ iiko из кэша или новая авторизация, если ключа нет или истёк TTL."""
+        with self._lock:
+            if self._key is not None and time.monotonic() - self._key_at < self._key_ttl:
+                return self._key
+            self._key = self._authenticate()
+            self._key_at = time.monotonic()
+            return self._key
+
+    def _authenticate(self) -> str:
+        login = self._config.login.strip()
+        sha1 = self._config.password_sha1.strip().lower()
+        paths = list(AUTH_PATHS)
+        if self._auth_path in paths:
+            paths.remove(self._auth_path)
+            paths.insert(0, self._auth_path)
+        for path in paths:
+            resp = self._session.get(
+                self._base + path,
+                params={"login": login, "pass": sha1},
+                verify=self._config.verify_ssl,
+                timeout=30,
+            )
+            if resp.status_code == 200 and resp.text.strip():
+                self._auth_path = path
+                return resp.text.strip()
+        raise RuntimeError("iiko auth failed")
+
+    def _invalidate(self, key: str) -> None:
+        with self._lock:
+            if self._key == key:
+                self._key = None
+
+    def request(self, method: str, path: str, params: dict[str, Any] | None = None, **kwargs: Any) -> requests.Response:
+        """Запрос к iiko с подстановкой ключа; path — от base_url (например /resto/api/products).
+
+        На 401 ключ сбрасывается и запрос повторяется один раз с новым ключом.
+        """
+        kwargs.setdefault("verify", self._config.verify_ssl)
+        url = f"{self._base}/{path.lstrip('/')}"
+        for attempt in (1, 2):
+            key = self.get_key()
+            q = dict(params or {})
+            q["key"] = key
+            resp = self._session.request(method, url, params=q, **kwargs)
+            if resp.status_code == 401 and attempt == 1:
+                resp.close()
+                self._invalidate(key)
+                continue
+            return resp
+        return resp
+
+    def logout(self) -> None:
+        """Освобождает ключ (и слот лицензии) в iiko. Ошибки сети игнорируются."""
+        with self._lock:
+            key, self._key = self._key, None
+        if key is None:
+            return
+        path = LOGOUT_PATHS.get(self._auth_path or "", "/resto/api/logout")
+        try:
+            self._session.get(
+                self._base + path,
+                params={"key": key},
+                verify=self._config.verify_ssl,
+                timeout=10,
+            )
+        except requests.RequestException:
+            pass
+
+    def close(self) -> None:
+        self.logout()
+        self._session.close()
+
+    def __enter__(self) -> "IikoSession":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+__all__ = ["IikoSession", "AUTH_PATHS", "DEFAULT_KEY_TTL"]
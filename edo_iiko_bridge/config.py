@@ -13,6 +13,8 @@ class DiadocConfig:
     api_key: str
     login: str
     password: str
+    # Сколько содержимых документов качать параллельно (iter_entity_contents)
+    download_workers: int = 8
 
 
 @dataclass
@@ -29,6 +31,11 @@ class Config:
     diadoc: DiadocConfig
     iiko: IikoRestoConfig
     mapping_file: Path
+    # IndexKey последнего полученного входящего по ящику — fetch-incoming продолжает с него
+    sync_state_file: Path = Path("./diadoc_sync_state.json")
+    # Скачанные УПД на диске (document_store): повторная работа с документом не идёт в Диадок
+    document_store_dir: Path = Path("./diadoc_documents")
+    document_store_max_mb: int = 500
 
     @classmethod
     def from_env(cls) -> "Config":
@@ -46,6 +53,7 @@ class Config:
                 api_key=req("DIADOC_API_KEY"),
                 login=req("DIADOC_LOGIN"),
                 password=req("DIADOC_PASSWORD"),
+                download_workers=int(opt("DIADOC_DOWNLOAD_WORKERS", "8")),
             ),
             iiko=IikoRestoConfig(
                 base_url=req("IIKO_BASE_URL").rstrip("/"),
@@ -54,4 +62,7 @@ class Config:
                 verify_ssl=os.getenv("IIKO_VERIFY_SSL", "1").strip() not in ("0", "false", "False"),
             ),
             mapping_file=Path(opt("MAPPING_FILE", "./mapping.json")),
+            sync_state_file=Path(opt("DIADOC_SYNC_STATE_FILE", "./diadoc_sync_state.json")),
+            document_store_dir=Path(opt("DIADOC_STORE_DIR", "./diadoc_documents")),
+            document_store_max_mb=int(opt("DIADOC_STORE_MAX_MB", "500")),
         )
@@ -0,0 +1,164 @@
+"""Локальное хранилище скачанных УПД: XML по document_key (messageId|entityId), сжатые блобы + индекс.
+
+Блоб называется по SHA-256 содержимого (blobs/ab/abcd….xml.gz), поэтому одинаковый XML хранится один раз.
+Индекс index.json: document_key → sha256, размер на диске, время последнего обращения.
+Когда блобы занимают больше max_bytes, удаляются документы, к которым дольше всего не обращались (LRU).
+Чтение (get) обновляет время обращения только в памяти — на диск индекс пишется при put и close/flush,
+а не на каждое чтение; хранилище используется как контекстный менеджер.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+
+def document_key(message_id: str, entity_id: str) -> str:
+    """Ключ документа — тот же, что в mapping_store (documentKey)."""
+    return f"{message_id}|{entity_id}"
+
+
+class DocumentStore:
+    """Содержимое документов Диадока на диске; get/put потокобезопасны в пределах процесса."""
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self._root = Path(root)
+        self._max_bytes = max_bytes
+        self._index_path = self._root / "index.json"
+        self._lock = threading.Lock()
+        self._index: dict[str, dict] = self._load_index()
+        self._last_access = max((e["accessed_at"] for e in self._index.values()), default=0.0)
+        self._dirty = False  # время обращения из get ещё не записано в index.json
+
+    def _load_index(self) -> dict[str, dict]:
+        """Индекс с диска; записи без sha256/size или с пропавшим блобом пропускаются."""
+        if not self._index_path.exists():
+            return {}
+        try:
+            data = json.loads(self._index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        index = {}
+        for key, entry in data.items():
+            try:
+                sha256, size = entry["sha256"], int(entry["size"])
+                accessed_at = float(entry.get("accessed_at", 0.0))
+            except (TypeError, KeyError, ValueError, AttributeError):
+                continue
+            if isinstance(sha256, str) and self._blob_path(sha256).is_file():
+                index[key] = {"sha256": sha256, "size": size, "accessed_at": accessed_at}
+        return index
+
+    def _save_index(self) -> None:
+        self._root.mkdir(parents=True, exist_ok=True)
+        tmp = self._index_path.with_name(self._index_path.name + ".tmp")
+        tmp.write_text(json.dumps(self._index, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(self._index_path)
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Записать в index.json время обращений из get (put пишет индекс сам)."""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "DocumentStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _touch(self) -> float:
+        """Время обращения, строго возрастающее — порядок LRU однозначен даже при грубых часах."""
+        self._last_access = max(time.time(), self._last_access + 1e-6)
+        return self._last_access
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self._root / "blobs" / sha256[:2] / f"{sha256}.xml.gz"
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._index
+
+    def total_bytes(self) -> int:
+        """Сколько занимают блобы на диске (каждый блоб считается один раз)."""
+        with self._lock:
+            return self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        return sum({e["sha256"]: e["size"] for e in self._index.values()}.values())
+
+    def get(self, key: str) -> bytes | None:
+        """XML документа или None, если его нет (или блоб повреждён — тогда запись удаляется)."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            try:
+                content = gzip.decompress(self._blob_path(entry["sha256"]).read_bytes())
+            except (OSError, EOFError, zlib.error):
+                content = None
+            if content is None or hashlib.sha256(content).hexdigest() != entry["sha256"]:
+                self._drop(key)
+                self._save_index()
+                return None
+            entry["accessed_at"] = self._touch()
+            self._dirty = True
+            return content
+
+    def put(self, key: str, content: bytes) -> None:
+        """Сохранить XML документа и при превышении лимита вытеснить давно не читанные."""
+        sha256 = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            path = self._blob_path(sha256)
+            if not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(path.name + ".tmp")
+                tmp.write_bytes(gzip.compress(content))
+                tmp.replace(path)
+            old = self._index.get(key)
+            self._index[key] = {"sha256": sha256, "size": path.stat().st_size, "accessed_at": self._touch()}
+            if old is not None and old["sha256"] != sha256:
+                self._remove_blob_if_unused(old["sha256"])
+            self._evict(keep=key)
+            self._save_index()
+
+    def _drop(self, key: str) -> None:
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._remove_blob_if_unused(entry["sha256"])
+
+    def _remove_blob_if_unused(self, sha256: str) -> None:
+        if any(e["sha256"] == sha256 for e in self._index.values()):
+            return
+        self._blob_path(sha256).unlink(missing_ok=True)
+
+    def _evict(self, keep: str) -> None:
+        sizes = {e["sha256"]: e["size"] for e in self._index.values()}
+        total = sum(sizes.values())
+        if total <= self._max_bytes:
+            return
+        # Счётчик ссылок на блоб: размер вычитается, только когда удалён последний документ с ним
+        refs = Counter(e["sha256"] for e in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]["accessed_at"]):
+            if total <= self._max_bytes:
+                break
+            if key == keep:
+                continue
+            sha256 = self._index.pop(key)["sha256"]
+            refs[sha256] -= 1
+            if not refs[sha256]:
+                self._blob_path(sha256).unlink(missing_ok=True)
+                total -= sizes[sha256]
@@ -1,4 +1,4 @@
 # Парсеры документов ЭДО (УПД, ТОРГ-12 и т.д.)
-from edo_iiko_bridge.parsers.upd import UpdLineItem, parse_upd_xml_line_items
+from edo_iiko_bridge.parsers.upd import UpdLineItem, iter_upd_line_items, parse_upd_xml_line_items
 
-__all__ = ["parse_upd_xml_line_items", "UpdLineItem"]
+__all__ = ["parse_upd_xml_line_items", "iter_upd_line_items", "UpdLineItem"]
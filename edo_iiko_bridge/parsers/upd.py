@@ -1,9 +1,11 @@
 """Разбор XML УПД (формат ФНС/Диадок): извлечение строк таблицы товаров."""
 from __future__ import annotations
 
+import io
 import xml.etree.ElementTree as ET
+from collections import deque
 from dataclasses import dataclass
-from typing import Any
+from typing import IO, Any, Iterator
 
 
 @dataclass
@@ -49,8 +51,134 @@ def _find_all_rows(root: ET.Element) -> list[ET.Element]:
     return rows
 
 
+# Строки таблицы товаров и синонимы полей в порядке приоритета (первый найденный выигрывает)
+_ROW_TAGS = frozenset(("СведТов", "СвТов"))
+# Строка должна содержать хотя бы наименование или количество
+_ROW_MARKERS = ("НаимТов", "КолТов", "Количество")
+_NAME = ("НаимТов", "Наименование")
+_QUANTITY = ("КолТов", "Количество")
+# Единица измерения: код ОКЕИ или наименование (ФНС: ОКЕИ_Тов, ЕдИзм, НаимЕдИзм, ЕдИзмПрослеж)
+_UNIT = ("ОКЕИ_Тов", "ЕдИзм", "НаимЕдИзм", "НаимЕдИзмПрослеж", "ЕдиницаИзмерения", "ОКЕИ")
+_PRICE = ("ЦенаТов", "Цена")
+_SUM_WITH_VAT = ("СумНал", "СумСНал", "СуммаСНал", "Сумма")
+# Артикул / код товара (ФНС: КодТов; в накладных часто Артикул, НомТов)
+_PRODUCT_CODE = ("КодТов", "Артикул", "Код", "НомТов", "КодНоменклатуры")
+_FIELD_TAGS = frozenset(_ROW_MARKERS + _NAME + _QUANTITY + _UNIT + _PRICE + _SUM_WITH_VAT + _PRODUCT_CODE)
+
+
+class _LocalNames(dict):
+    """tag → локальное имя без namespace; каждый тег разбирается один раз за документ."""
+
+    def __missing__(self, tag: str) -> str:
+        name = tag.split("}")[-1] if "}" in tag else tag
+        self[tag] = name
+        return name
+
+
+def _row_texts(row: ET.Element, local: _LocalNames) -> dict[str, str]:
+    """Один проход по детям строки: {локальное имя: текст первого ребёнка с непустым text}."""
+    texts: dict[str, str] = {}
+    for child in row:
+        if not child.text:
+            continue
+        name = local[child.tag]
+        if name in _FIELD_TAGS and name not in texts:
+            texts[name] = child.text
+    return texts
+
+
+def _pick(texts: dict[str, str], aliases: tuple[str, ...]) -> str:
+    """Как _find_text: текст первого синонима, который есть в строке."""
+    for name in aliases:
+        text = texts.get(name)
+        if text is not None:
+            return text.strip()
+    return ""
+
+
+def _line_item(line_number: int, texts: dict[str, str]) -> UpdLineItem:
+    return UpdLineItem(
+        line_number=line_number,
+        name=_pick(texts, _NAME),
+        quantity=_pick(texts, _QUANTITY),
+        unit=_pick(texts, _UNIT),
+        price=_pick(texts, _PRICE),
+        sum_with_vat=_pick(texts, _SUM_WITH_VAT),
+        product_code=_pick(texts, _PRODUCT_CODE),
+    )
+
+
 def parse_upd_xml_line_items(xml_bytes: bytes) -> list[UpdLineItem]:
-    """Парсит XML УПД (ФНС 5.02/5.03 и др.), возвращает список строк товаров."""
+    """
+    Парсит XML УПД (ФНС 5.02/5.03 и др.), возвращает список строк товаров.
+    Один проход по дереву и по детям каждой строки; результат совпадает с parse_upd_xml_line_items_scan.
+    """
+    try:
+        root = ET.fromstring(xml_bytes)
+    except ET.ParseError:
+        return []
+    local = _LocalNames()
+    result: list[UpdLineItem] = []
+    for elem in root.iter():
+        if local[elem.tag] not in _ROW_TAGS:
+            continue
+        texts = _row_texts(elem, local)
+        if _pick(texts, _ROW_MARKERS):
+            result.append(_line_item(len(result) + 1, texts))
+    return result
+
+
+def iter_upd_line_items(source: bytes | IO[bytes]) -> Iterator[UpdLineItem]:
+    """
+    Потоковый разбор УПД (ET.iterparse): строки отдаются по мере того, как в потоке закрываются
+    их элементы, разобранные поддеревья сразу удаляются — память не растёт с размером документа.
+    source — байты или файловый объект (в том числе DiadocClient.get_entity_content(stream=True)).
+    Результат и нумерация — как у parse_upd_xml_line_items (строки в порядке начала элемента).
+    Невалидный XML до первой строки — пустой результат; обрыв после уже отданных строк — ET.ParseError.
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    local = _LocalNames()
+    path: list[ET.Element] = []
+    # Строки в порядке открытия: [готова ли, тексты реквизитов или None]; open_rows — ещё не закрытые
+    pending: deque[list[Any]] = deque()
+    open_rows: list[list[Any]] = []
+    line_number = 0
+    try:
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            is_row = local[elem.tag] in _ROW_TAGS
+            if event == "start":
+                path.append(elem)
+                if is_row:
+                    slot = [False, None]
+                    pending.append(slot)
+                    open_rows.append(slot)
+                continue
+
+            path.pop()
+            if is_row:
+                slot = open_rows.pop()
+                texts = _row_texts(elem, local)
+                slot[:] = [True, texts if _pick(texts, _ROW_MARKERS) else None]
+                # Отдаём все строки, начавшиеся раньше ещё открытых (вложенная строка ждёт внешнюю)
+                while pending and pending[0][0]:
+                    _, ready = pending.popleft()
+                    if ready is not None:
+                        line_number += 1
+                        yield _line_item(line_number, ready)
+            # Вне строк поддерево больше не нужно: отцепляем его от родителя. Парсер читает блоками и мог
+            # уже добавить родителю следующих детей, но предыдущие удалены — закрытый элемент первый
+            if not open_rows:
+                elem.clear()
+                if path and len(path[-1]) and path[-1][0] is elem:
+                    del path[-1][0]
+    except ET.ParseError:
+        if line_number:
+            raise
+        return
+
+
+def parse_upd_xml_line_items_scan(xml_bytes: bytes) -> list[UpdLineItem]:
+    """Прежний разбор: поиск каждого поля отдельным проходом по детям строки. Эталон для тестов и бенчмарка."""
     try:
         root = ET.fromstring(xml_bytes)
     except ET.ParseError:
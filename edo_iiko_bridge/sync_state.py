@@ -0,0 +1,30 @@
+"""Состояние синхронизации входящих Диадока: IndexKey последнего полученного документа по каждому ящику."""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+
+def _load(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    data = json.loads(path.read_text(encoding="utf-8"))
+    return data if isinstance(data, dict) else {}
+
+
+def load_index_key(path: Path, box_id: str, filter_category: str) -> str | None:
+    """IndexKey, на котором остановилась прошлая синхронизация ящика (None — синхронизаций не было)."""
+    item = _load(path).get(box_id)
+    if not isinstance(item, dict) or item.get("filterCategory") != filter_category:
+        return None
+    return item.get("afterIndexKey") or None
+
+
+def save_index_key(path: Path, box_id: str, filter_category: str, index_key: str) -> None:
+    """Запомнить IndexKey последнего полученного документа ящика (запись через временный файл)."""
+    data = _load(path)
+    data[box_id] = {"filterCategory": filter_category, "afterIndexKey": index_key}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
@@ -1,5 +1,6 @@
 """Тесты клиента Диадока с замоканными HTTP-ответами (реальный API не вызывается)."""
 import pytest
+import requests
 import requests_mock
 
 from edo_iiko_bridge.clients.diadoc_client import DIADOC_API_BASE, DiadocClient
@@ -93,3 +94,122 @@ def test_get_entity_content_returns_bytes(client, requests_mock):
     req = requests_mock.request_history[1]
     assert "GetEntityContent" in req.url
     assert "messageId=msg-1" in req.url or "messageId=msg%2D1" in req.url
+
+
+def test_get_entity_content_stream_returns_file_like(client, requests_mock):
+    from edo_iiko_bridge.parsers import iter_upd_line_items
+
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    xml_body = "<Doc><СведТов><НаимТов>Фарш</НаимТов><КолТов>3</КолТов></СведТов></Doc>".encode()
+    requests_mock.get(f"{DIADOC_API_BASE}/V4/GetEntityContent", content=xml_body)
+    stream = client.get_entity_content("box@diadoc.ru", "msg-1", "ent-1", stream=True)
+    try:
+        items = list(iter_upd_line_items(stream))
+    finally:
+        stream.close()
+    assert [(i.name, i.quantity) for i in items] == [("Фарш", "3")]
+
+
+def test_get_entity_content_stream_raises_on_http_error(client, requests_mock):
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    requests_mock.get(f"{DIADOC_API_BASE}/V4/GetEntityContent", status_code=404)
+    with pytest.raises(requests.HTTPError):
+        client.get_entity_content("box@diadoc.ru", "msg-1", "ent-1", stream=True)
+
+
+def _doc(n: int) -> dict:
+    return {"MessageId": f"m{n}", "EntityId": f"e{n}", "IndexKey": f"key-{n}"}
+
+
+def test_iter_documents_follows_after_index_key(client, requests_mock):
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    pages = [
+        {"json": {"Documents": [_doc(1), _doc(2)], "HasMoreResults": True}},
+        {"json": {"Documents": [_doc(3)], "HasMoreResults": False}},
+    ]
+    requests_mock.get(f"{DIADOC_API_BASE}/V3/GetDocuments", pages)
+    docs = list(client.iter_documents("box@diadoc.ru", page_size=2))
+    assert [d["MessageId"] for d in docs] == ["m1", "m2", "m3"]
+    first, second = requests_mock.request_history[1:]
+    assert "afterindexkey" not in first.qs
+    assert first.qs["sortdirection"] == ["ascending"]
+    assert "afterIndexKey=key-2" in second.url
+
+
+def test_after_index_key_is_sent_encoded_once(client, requests_mock):
+    """IndexKey с +, / и = доходит до Диадока как есть (без двойного процент-кодирования)."""
+    from urllib.parse import parse_qs, urlsplit
+
+    key = "ABC+/def=="
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    requests_mock.get(f"{DIADOC_API_BASE}/V3/GetDocuments", json={"Documents": [], "HasMoreResults": False})
+    client.get_documents("box@diadoc.ru", after_index_key=key)
+    query = parse_qs(urlsplit(requests_mock.request_history[1].url).query)
+    assert query["afterIndexKey"] == [key]
+
+
+def test_iter_documents_is_lazy(client, requests_mock):
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    requests_mock.get(
+        f"{DIADOC_API_BASE}/V3/GetDocuments",
+        json={"Documents": [_doc(1), _doc(2)], "HasMoreResults": True},
+    )
+    it = client.iter_documents("box@diadoc.ru", page_size=2)
+    assert next(it)["MessageId"] == "m1"
+    assert next(it)["MessageId"] == "m2"
+    # Вторая страница ещё не запрошена: только Authenticate и одна GetDocuments
+    assert len(requests_mock.request_history) == 2
+
+
+def test_iter_documents_stops_on_short_page_without_has_more(client, requests_mock):
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    requests_mock.get(f"{DIADOC_API_BASE}/V3/GetDocuments", json={"Documents": [_doc(1)]})
+    docs = list(client.iter_documents("box@diadoc.ru", after_index_key="key-0", page_size=10))
+    assert len(docs) == 1
+    assert len(requests_mock.request_history) == 2
+    assert "afterIndexKey=key-0" in requests_mock.request_history[1].url
+
+
+def test_get_entity_content_retries_on_429_and_5xx(client, requests_mock, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("edo_iiko_bridge.clients.diadoc_client.time.sleep", sleeps.append)
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    requests_mock.get(
+        f"{DIADOC_API_BASE}/V4/GetEntityContent",
+        [
+            {"status_code": 429, "headers": {"Retry-After": "3"}},
+            {"status_code": 503},
+            {"content": b"<xml/>"},
+        ],
+    )
+    assert client.get_entity_content("box", "m1", "e1") == b"<xml/>"
+    assert sleeps == [3.0, 2.0]
+
+
+def test_get_entity_content_gives_up_after_retries(client, requests_mock, monkeypatch):
+    monkeypatch.setattr("edo_iiko_bridge.clients.diadoc_client.time.sleep", lambda _: None)
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+    requests_mock.get(f"{DIADOC_API_BASE}/V4/GetEntityContent", status_code=500)
+    with pytest.raises(requests.HTTPError):
+        client.get_entity_content("box", "m1", "e1")
+
+
+def test_iter_entity_contents_downloads_all_and_reports_errors(client, requests_mock, monkeypatch):
+    monkeypatch.setattr("edo_iiko_bridge.clients.diadoc_client.time.sleep", lambda _: None)
+    requests_mock.post(f"{DIADOC_API_BASE}/V3/Authenticate", text="token")
+
+    def content(request, context):
+        message_id = request.qs["messageid"][0]
+        if message_id == "bad":
+            context.status_code = 404
+            return b""
+        return f"<{message_id}/>".encode()
+
+    requests_mock.get(f"{DIADOC_API_BASE}/V4/GetEntityContent", content=content)
+    refs = [(f"m{i}", f"e{i}") for i in range(10)] + [("bad", "e")]
+    results = list(client.iter_entity_contents("box", refs, workers=4))
+    ok = {r.message_id: r.content for r in results if r.error is None}
+    assert ok == {f"m{i}": f"<m{i}/>".encode() for i in range(10)}
+    assert [r.message_id for r in results if r.error is not None] == ["bad"]
+    # Авторизация одна на все потоки
+    assert sum(1 for r in requests_mock.request_history if "Authenticate" in r.url) == 1
@@ -0,0 +1,116 @@
+"""Тесты локального хранилища УПД."""
+from pathlib import Path
+
+from edo_iiko_bridge.document_store import DocumentStore, document_key
+
+
+def test_document_key_matches_mapping_store_format():
+    assert document_key("msg", "ent") == "msg|ent"
+
+
+def test_put_and_get_roundtrip_survives_reopen(tmp_path: Path):
+    store = DocumentStore(tmp_path)
+    xml = "<Файл><Документ>Молоко</Документ></Файл>".encode("windows-1251")
+    store.put("m|e", xml)
+    assert store.get("m|e") == xml
+    assert DocumentStore(tmp_path).get("m|e") == xml
+    assert DocumentStore(tmp_path).get("other|e") is None
+
+
+def test_same_content_is_stored_once(tmp_path: Path):
+    store = DocumentStore(tmp_path)
+    store.put("a|1", b"<xml>same</xml>")
+    store.put("b|2", b"<xml>same</xml>")
+    assert len(list((tmp_path / "blobs").rglob("*.xml.gz"))) == 1
+    assert store.get("a|1") == store.get("b|2") == b"<xml>same</xml>"
+
+
+def test_evicts_least_recently_used_over_size_cap(tmp_path: Path):
+    blobs = {k: bytes(range(256)) * 40 + k.encode() for k in ("a|1", "b|2", "c|3")}
+    probe = DocumentStore(tmp_path / "probe")
+    probe.put("x", blobs["a|1"])
+    one_blob = probe.total_bytes()
+
+    store = DocumentStore(tmp_path / "store", max_bytes=one_blob * 2 + one_blob // 2)
+    store.put("a|1", blobs["a|1"])
+    store.put("b|2", blobs["b|2"])
+    assert store.get("a|1") is not None  # a|1 свежее, чем b|2
+    store.put("c|3", blobs["c|3"])
+    assert "b|2" not in store
+    assert store.get("a|1") == blobs["a|1"]
+    assert store.get("c|3") == blobs["c|3"]
+    assert store.total_bytes() <= one_blob * 2 + one_blob // 2
+
+
+def test_corrupted_blob_is_dropped(tmp_path: Path):
+    store = DocumentStore(tmp_path)
+    store.put("m|e", b"<xml/>")
+    for blob in (tmp_path / "blobs").rglob("*.xml.gz"):
+        blob.write_bytes(b"not gzip")
+    assert store.get("m|e") is None
+    assert "m|e" not in store
+
+
+def test_blob_with_corrupted_gzip_body_is_dropped(tmp_path: Path):
+    import gzip
+
+    store = DocumentStore(tmp_path)
+    store.put("m|e", bytes(range(256)) * 20)
+    for blob in (tmp_path / "blobs").rglob("*.xml.gz"):
+        # Заголовок gzip цел, поток deflate испорчен — gzip.decompress падает с zlib.error
+        data = bytearray(blob.read_bytes())
+        for i in range(12, len(data) - 8):
+            data[i] ^= 0x55
+        blob.write_bytes(bytes(data))
+    assert store.get("m|e") is None
+    assert "m|e" not in store
+    assert "m|e" not in DocumentStore(tmp_path)
+
+
+def test_get_defers_index_write_until_close(tmp_path: Path):
+    index = tmp_path / "index.json"
+    with DocumentStore(tmp_path) as store:
+        store.put("a|1", b"<xml>a</xml>")
+        store.put("b|2", b"<xml>b</xml>")
+        written = index.read_bytes()
+        assert store.get("a|1") == b"<xml>a</xml>"
+        assert index.read_bytes() == written
+    reopened = DocumentStore(tmp_path)
+    assert reopened._index["a|1"]["accessed_at"] > reopened._index["b|2"]["accessed_at"]
+
+
+def test_eviction_counts_shared_blob_once_its_last_document_is_gone(tmp_path: Path):
+    shared, other = bytes(range(256)) * 40, bytes(range(255, -1, -1)) * 40
+    probe = DocumentStore(tmp_path / "probe")
+    probe.put("x", other)
+    one_blob = probe.total_bytes()
+
+    store = DocumentStore(tmp_path / "store", max_bytes=one_blob + one_blob // 2)
+    store.put("a|1", shared)
+    store.put("c|3", shared)
+    # a|1 вытеснение не освобождает: его блоб держит c|3 — уходит и он
+    store.put("b|2", other)
+    assert list(store._index) == ["b|2"]
+    assert store.total_bytes() == one_blob
+    assert len(list((tmp_path / "store" / "blobs").rglob("*.xml.gz"))) == 1
+
+
+def test_load_index_skips_broken_entries(tmp_path: Path):
+    import json
+
+    with DocumentStore(tmp_path) as store:
+        store.put("ok|1", b"<xml>ok</xml>")
+        store.put("gone|2", b"<xml>gone</xml>")
+        gone = store._blob_path(store._index["gone|2"]["sha256"])
+        ok = store._index["ok|1"]
+    gone.unlink()
+    index = tmp_path / "index.json"
+    data = json.loads(index.read_text(encoding="utf-8"))
+    data["no-size|3"] = {"sha256": ok["sha256"], "accessed_at": 1.0}
+    data["no-sha|4"] = {"size": 1, "accessed_at": 1.0}
+    data["junk|5"] = "not an entry"
+    index.write_text(json.dumps(data), encoding="utf-8")
+
+    reopened = DocumentStore(tmp_path)
+    assert list(reopened._index) == ["ok|1"]
+    assert reopened.get("ok|1") == b"<xml>ok</xml>"
@@ -0,0 +1,79 @@
+"""Тесты общей сессии iiko (кэш ключа, 401, logout) с замоканными HTTP."""
+import pytest
+import requests_mock
+
+from edo_iiko_bridge.clients.iiko_session import IikoSession
+from edo_iiko_bridge.config import IikoRestoConfig
+
+
+@pytest.fixture
+def iiko_config():
+    return IikoRestoConfig(
+        base_url="https://iiko.example",
+        login="user",
+        password_sha1="ABC123",
+        verify_ssl=True,
+    )
+
+
+def _auth_calls(requests_mock):
+    return [r for r in requests_mock.request_history if "/auth" in r.path]
+
+
+def test_key_is_cached_between_requests(iiko_config, requests_mock):
+    requests_mock.get("https://iiko.example/api/auth", text="key-1")
+    requests_mock.get("https://iiko.example/resto/api/products", json=[])
+    session = IikoSession(iiko_config)
+    session.request("GET", "/resto/api/products")
+    session.request("GET", "/resto/api/products")
+    assert len(_auth_calls(requests_mock)) == 1
+    assert requests_mock.request_history[0].qs["pass"] == ["abc123"]
+    assert requests_mock.request_history[-1].qs["key"] == ["key-1"]
+
+
+def test_reauth_on_401_and_retry(iiko_config, requests_mock):
+    requests_mock.get("https://iiko.example/api/auth", [{"text": "old"}, {"text": "new"}])
+    requests_mock.get(
+        "https://iiko.example/resto/api/products",
+        [{"status_code": 401}, {"json": [{"id": "p1"}]}],
+    )
+    session = IikoSession(iiko_config)
+    resp = session.request("GET", "/resto/api/products")
+    assert resp.status_code == 200
+    assert len(_auth_calls(requests_mock)) == 2
+    assert requests_mock.request_history[-1].qs["key"] == ["new"]
+
+
+def test_remembers_working_auth_path(iiko_config, requests_mock):
+    requests_mock.get("https://iiko.example/api/auth", status_code=404)
+    requests_mock.get("https://iiko.example/resto/api/auth", text="key")
+    session = IikoSession(iiko_config, key_ttl=0)
+    session.get_key()
+    assert session.auth_path == "/resto/api/auth"
+    # TTL истёк — повторная авторизация сразу по сработавшему пути
+    session.get_key()
+    paths = [r.path for r in _auth_calls(requests_mock)]
+    assert paths == ["/api/auth", "/resto/api/auth", "/resto/api/auth"]
+
+
+def test_auth_failed_raises(iiko_config, requests_mock):
+    requests_mock.get("https://iiko.example/api/auth", status_code=401)
+    requests_mock.get("https://iiko.example/resto/api/auth", status_code=401)
+    with pytest.raises(RuntimeError, match="iiko auth failed"):
+        IikoSession(iiko_config).get_key()
+
+
+def test_close_logs_out_with_matching_path(iiko_config, requests_mock):
+    requests_mock.get("https://iiko.example/api/auth", status_code=404)
+    requests_mock.get("https://iiko.example/resto/api/auth", text="key-7")
+    requests_mock.get("https://iiko.example/resto/api/logout", text="")
+    with IikoSession(iiko_config) as session:
+        session.get_key()
+    logout = requests_mock.request_history[-1]
+    assert logout.path == "/resto/api/logout"
+    assert logout.qs["key"] == ["key-7"]
+
+
+def test_close_without_key_does_not_call_iiko(iiko_config, requests_mock):
+    IikoSession(iiko_config).close()
+    assert requests_mock.request_history == []
@@ -0,0 +1,23 @@
+"""Тесты состояния синхронизации входящих Диадока."""
+from pathlib import Path
+
+from edo_iiko_bridge.sync_state import load_index_key, save_index_key
+
+
+def test_load_index_key_missing_file(tmp_path: Path):
+    assert load_index_key(tmp_path / "state.json", "box", "Any.InboundNotRevoked") is None
+
+
+def test_save_and_load_index_key_per_box(tmp_path: Path):
+    path = tmp_path / "state.json"
+    save_index_key(path, "box-1", "Any.InboundNotRevoked", "key-1")
+    save_index_key(path, "box-2", "Any.InboundNotRevoked", "key-2")
+    save_index_key(path, "box-1", "Any.InboundNotRevoked", "key-3")
+    assert load_index_key(path, "box-1", "Any.InboundNotRevoked") == "key-3"
+    assert load_index_key(path, "box-2", "Any.InboundNotRevoked") == "key-2"
+
+
+def test_index_key_ignored_for_other_filter_category(tmp_path: Path):
+    path = tmp_path / "state.json"
+    save_index_key(path, "box", "Any.InboundNotRevoked", "key-1")
+    assert load_index_key(path, "box", "Any.Outbound") is None
@@ -79,3 +79,103 @@ def test_parse_upd_with_namespace():
     assert len(lines) == 1
     assert lines[0].name == "Item A"
     assert lines[0].quantity == "1"
+
+
+def _random_upd(seed: int, rows: int = 60) -> bytes:
+    """УПД со случайным набором синонимов, пустыми/пробельными значениями, дублями и вложенными строками."""
+    import random
+
+    rnd = random.Random(seed)
+    fields = [
+        "НаимТов", "Наименование", "КолТов", "Количество", "ОКЕИ_Тов", "ЕдИзм", "НаимЕдИзм",
+        "НаимЕдИзмПрослеж", "ЕдиницаИзмерения", "ОКЕИ", "ЦенаТов", "Цена", "СумНал", "СумСНал",
+        "СуммаСНал", "Сумма", "КодТов", "Артикул", "Код", "НомТов", "КодНоменклатуры", "Прочее",
+    ]
+    values = ["", "  ", " 12,5 ", "Молоко 3,2%", "796", "кг", "ART-1"]
+    prefix = rnd.choice(["", "ns:"])
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><Doc xmlns:ns="urn:fns"><ТаблСвТов>']
+    for _ in range(rows):
+        tag = prefix + rnd.choice(["СведТов", "СвТов", "ДопСведТов"])
+        children = []
+        for _ in range(rnd.randint(0, 8)):
+            child = prefix + rnd.choice(fields)
+            children.append(f"<{child}>{rnd.choice(values)}</{child}>")
+        if rnd.random() < 0.2:
+            children.append(f"<{prefix}СвТов><{prefix}НаимТов>Вложенная</{prefix}НаимТов></{prefix}СвТов>")
+        parts.append(f"<{tag}>{''.join(children)}</{tag}>")
+    parts.append("</ТаблСвТов></Doc>")
+    return "".join(parts).encode("utf-8")
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_single_pass_parser_matches_scan_parser(seed):
+    from edo_iiko_bridge.parsers.upd import parse_upd_xml_line_items_scan
+
+    xml = _random_upd(seed)
+    assert parse_upd_xml_line_items(xml) == parse_upd_xml_line_items_scan(xml)
+
+
+def test_whitespace_alias_stops_search_like_scan_parser():
+    """Пробельное значение первого синонима даёт пустое поле, следующие синонимы не смотрятся."""
+    xml = "<Doc><СведТов><НаимТов>X</НаимТов><КолТов>  </КолТов><Количество>5</Количество></СведТов></Doc>".encode()
+    (line,) = parse_upd_xml_line_items(xml)
+    assert line.quantity == ""
+
+
+class _ChunkedStream:
+    """Файловый объект, отдающий XML маленькими кусками — как тело ответа Диадока при stream=True."""
+
+    def __init__(self, data: bytes, chunk: int = 7):
+        self._data = data
+        self._pos = 0
+        self._chunk = chunk
+
+    def read(self, size: int = -1) -> bytes:
+        n = self._chunk if size < 0 else min(size, self._chunk)
+        out = self._data[self._pos:self._pos + n]
+        self._pos += len(out)
+        return out
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_streaming_parser_matches_tree_parser(seed):
+    from edo_iiko_bridge.parsers.upd import iter_upd_line_items
+
+    xml = _random_upd(seed)
+    assert list(iter_upd_line_items(_ChunkedStream(xml))) == parse_upd_xml_line_items(xml)
+    assert list(iter_upd_line_items(xml)) == parse_upd_xml_line_items(xml)
+
+
+def test_streaming_parser_invalid_xml():
+    from xml.etree.ElementTree import ParseError
+
+    from edo_iiko_bridge.parsers.upd import iter_upd_line_items
+
+    assert list(iter_upd_line_items(b"")) == []
+    assert list(iter_upd_line_items(b"not xml")) == []
+    truncated = "<Doc><СведТов><НаимТов>A</НаимТов></СведТов><СведТов><НаимТ".encode()
+    items = iter_upd_line_items(truncated)
+    assert next(items).name == "A"
+    with pytest.raises(ParseError):
+        next(items)
+
+
+def test_streaming_parser_memory_does_not_grow_with_rows():
+    """Разобранные строки отцепляются от дерева: пик памяти на 20× больших УПД почти тот же."""
+    import io
+    import tracemalloc
+
+    from edo_iiko_bridge.parsers.upd import iter_upd_line_items
+
+    row = "<СведТов><НаимТов>Говядина охл.</НаимТов><КолТов>12,5</КолТов><ЦенаТов>640</ЦенаТов></СведТов>"
+
+    def peak(rows: int) -> int:
+        xml = f"<Doc><ТаблСвТов>{row * rows}</ТаблСвТов></Doc>".encode()
+        tracemalloc.start()
+        try:
+            assert sum(1 for _ in iter_upd_line_items(io.BytesIO(xml))) == rows
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert peak(20_000) < 2 * peak(1_000)
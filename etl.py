@@ -1,10 +1,22 @@
 import os
+import io
+import sys
+import re
+import csv
+import gzip
 import json
+import codecs
+import zlib
 import hashlib
-from dataclasses import dataclass
+import time
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone, date, timedelta
+from itertools import chain, islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from zoneinfo import ZoneInfo
 
 import requests
@@ -12,6 +24,11 @@ from dotenv import load_dotenv
 
 import psycopg2
 from psycopg2.extras import execute_values
+from psycopg2.sql import SQL, Identifier
+
+import neon_db
+from edo_iiko_bridge.clients.iiko_session import IikoSession
+from edo_iiko_bridge.config import IikoRestoConfig
 
 
 # =============================
@@ -39,6 +56,41 @@ class Config:
 
     raw_dir: Path
 
+    # Нарезка OLAP-запроса на срезы: 0 — один запрос на весь период
+    olap_slice_hours: int = 0
+    olap_workers: int = 4
+    olap_retries: int = 3
+
+    # Потоковый режим: строки OLAP читаются по одной и пишутся в БД пачками
+    olap_stream: bool = False
+    load_batch_size: int = 5000
+
+    # Способ загрузки в RAW: values (execute_values) или copy (COPY во временную таблицу + merge)
+    loader: str = "values"
+
+    # Нормализация: rows (построчно) или pandas (колоночно, см. normalize_columns)
+    normalizer: str = "rows"
+
+    # Схема source_hash (см. HASH_SCHEMES); migrate — переписывать совпавшие старые хэши на текущую схему
+    hash_scheme: str = "v1"
+    hash_migrate: bool = False
+
+    # Инкрементальный режим: пишем только разницу с тем, что уже лежит в RAW за период
+    incremental: bool = False
+
+    # RAW секционирована по периодам (docs/migrations/partition-olap-postings.sql): неделя заменяется TRUNCATE секции
+    partitioned: bool = False
+
+    # После загрузки пересчитать материализованные витрины (*_mat) за неделю, см. refresh_materialized
+    materialize: bool = False
+
+    # Бэкфилл: сколько недель грузить одновременно (и размер пула соединений с Neon)
+    backfill_workers: int = 2
+
+    # Кэш ответов OLAP в raw_dir/olap: off, write (качаем из iiko и сохраняем) или replay (только из кэша)
+    olap_cache: str = "off"
+    raw_cache_max_mb: int = 1024
+
 
 def _env(name: str) -> str:
     v = os.getenv(name)
@@ -52,6 +104,20 @@ def _env_list(name: str) -> List[str]:
     return [p.strip() for p in raw.replace(";", ",").split(",") if p.strip()]
 
 
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"Env {name} must be integer, got: {raw!r}")
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").strip() in ("1", "true", "True", "yes", "YES")
+
+
 def _verify_ssl() -> bool:
     raw = os.getenv("IIKO_VERIFY_SSL", "1").strip()
     return raw not in ("0", "false", "False", "no", "NO")
@@ -100,6 +166,27 @@ def load_config() -> Config:
     else:
         date_from, date_to = last_closed_week_tue_to_tue()
 
+    olap_slice_hours = _env_int("OLAP_SLICE_HOURS", 0)
+    if olap_slice_hours < 0 or olap_slice_hours % 24:
+        # DateTime.OperDayFilter режет по операционным дням, дробить сутки бессмысленно
+        raise RuntimeError(f"OLAP_SLICE_HOURS must be a multiple of 24, got: {olap_slice_hours}")
+
+    loader = (os.getenv("ETL_LOADER", "") or "values").strip().lower()
+    if loader not in ("values", "copy"):
+        raise RuntimeError(f"Env ETL_LOADER must be 'values' or 'copy', got: {loader!r}")
+
+    normalizer = (os.getenv("ETL_NORMALIZE", "") or "rows").strip().lower()
+    if normalizer not in ("rows", "pandas"):
+        raise RuntimeError(f"Env ETL_NORMALIZE must be 'rows' or 'pandas', got: {normalizer!r}")
+
+    hash_scheme = (os.getenv("SOURCE_HASH", "") or "v1").strip().lower()
+    if hash_scheme not in HASH_SCHEMES:
+        raise RuntimeError(f"Env SOURCE_HASH must be one of {', '.join(HASH_SCHEMES)}, got: {hash_scheme!r}")
+
+    olap_cache = (os.getenv("OLAP_CACHE", "") or "off").strip().lower()
+    if olap_cache not in ("off", "write", "replay"):
+        raise RuntimeError(f"Env OLAP_CACHE must be 'off', 'write' or 'replay', got: {olap_cache!r}")
+
     return Config(
         neon_host=_env("NEON_HOST"),
         neon_db=_env("NEON_DB"),
@@ -119,6 +206,23 @@ def load_config() -> Config:
         product_types=_env_list("PRODUCT_TYPES"),
 
         raw_dir=Path(os.getenv("RAW_DIR", "src/data/raw")).resolve(),
+
+        olap_slice_hours=olap_slice_hours,
+        olap_workers=max(1, _env_int("OLAP_WORKERS", 4)),
+        olap_retries=max(1, _env_int("OLAP_RETRIES", 3)),
+
+        olap_stream=_env_flag("OLAP_STREAM"),
+        load_batch_size=max(1, _env_int("LOAD_BATCH_SIZE", 5000)),
+        loader=loader,
+        normalizer=normalizer,
+        hash_scheme=hash_scheme,
+        hash_migrate=_env_flag("SOURCE_HASH_MIGRATE"),
+        incremental=_env_flag("ETL_INCREMENTAL"),
+        materialize=_env_flag("ETL_MATERIALIZE"),
+        partitioned=_env_flag("ETL_PARTITIONS"),
+        backfill_workers=max(1, _env_int("BACKFILL_WORKERS", 2)),
+        olap_cache=olap_cache,
+        raw_cache_max_mb=max(1, _env_int("RAW_CACHE_MAX_MB", 1024)),
     )
 
 
@@ -126,34 +230,217 @@ def load_config() -> Config:
 # iiko auth
 # =============================
 
+# Один ключ iiko на процесс: каждая авторизация занимает слот лицензии
+_iiko: Optional[IikoSession] = None
+_iiko_lock = threading.Lock()
+
+
+def get_iiko_session(cfg: Config) -> IikoSession:
+    global _iiko
+    with _iiko_lock:
+        if _iiko is None:
+            _iiko = IikoSession(
+                IikoRestoConfig(
+                    base_url=cfg.iiko_base_url,
+                    login=cfg.iiko_login,
+                    password_sha1=cfg.iiko_pass_sha1,
+                    verify_ssl=cfg.iiko_verify_ssl,
+                ),
+                pool_size=max(cfg.olap_workers, cfg.backfill_workers),
+            )
+        return _iiko
+
+
+def close_iiko_session() -> None:
+    """Logout в iiko и закрытие HTTP-сессии (в конце прогона)."""
+    global _iiko
+    with _iiko_lock:
+        if _iiko is not None:
+            _iiko.close()
+            _iiko = None
+
+
 def get_iiko_key(cfg: Config) -> str:
-    base = cfg.iiko_base_url.rstrip("/")
-    login = cfg.iiko_login.strip()
-    sha1 = cfg.iiko_pass_sha1.strip().lower()
-
-    endpoints = [
-        f"{base}/api/auth",
-        f"{base}/resto/api/auth",
-    ]
-
-    for url in endpoints:
-        resp = requests.get(
-            url,
-            params={"login": login, "pass": sha1},
-            verify=cfg.iiko_verify_ssl,
-            timeout=30,
-        )
-        if resp.status_code == 200 and resp.text.strip():
-            return resp.text.strip()
+    return get_iiko_session(cfg).get_key()
+
+
+# =============================
+# Raw cache
+# =============================
 
-    raise RuntimeError("iiko auth failed")
+# Битый .gz: не gzip или неверный CRC (BadGzipFile), обрезан (EOFError), испорчен deflate (zlib.error)
+_GZIP_ERRORS = (gzip.BadGzipFile, EOFError, zlib.error)
+
+
+class RawCache:
+    """
+    Кэш сырых ответов OLAP на диске. Ключ — sha256 от base_url и канонического JSON тела запроса
+    (build_olap_request), значение — тело ответа как есть, сжатое gzip. Файлы пишутся через .tmp + rename,
+    при превышении max_bytes удаляются самые давно использованные (по mtime, попадание в кэш его обновляет).
+    """
+
+    SUFFIX = ".json.gz"
+
+    def __init__(self, root: Path, max_bytes: int):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(base_url: str, body: Dict[str, Any]) -> str:
+        canon = json.dumps(body, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{base_url}\n{canon}".encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self._root / f"{key}{self.SUFFIX}"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Тело ответа или None, если ключа нет или файл битый (битый удаляется)."""
+        path = self.path(key)
+        try:
+            with gzip.open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        except _GZIP_ERRORS as e:
+            self._drop_corrupt(path, e)
+            return None
+        self._touch(path)
+        return data
+
+    def iter_chunks(self, key: str, chunk_size: int = 1 << 16) -> Optional[Iterator[bytes]]:
+        """
+        Тело ответа кусками (для потокового разбора) или None, если ключа нет или файл битый.
+        Первый кусок читается сразу: файл не gzip — промах. Порча дальше по файлу всплывает
+        при чтении — строки уже отданы, промахом её не сделать; файл при этом удаляется.
+        """
+        path = self.path(key)
+        try:
+            f = gzip.open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            first = f.read(chunk_size)
+        except _GZIP_ERRORS as e:
+            f.close()
+            self._drop_corrupt(path, e)
+            return None
+        self._touch(path)
+
+        def chunks() -> Iterator[bytes]:
+            with f:
+                chunk = first
+                while chunk:
+                    yield chunk
+                    try:
+                        chunk = f.read(chunk_size)
+                    except _GZIP_ERRORS as e:
+                        self._drop_corrupt(path, e)
+                        raise
+
+        return chunks()
+
+    def put(self, key: str, data: bytes) -> None:
+        for _ in self.put_chunks(key, [data]):
+            pass
+
+    def put_chunks(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Пишет куски в кэш, отдавая их дальше. Запись фиксируется, только если куски дочитаны до конца:
+        оборванный ответ в кэш не попадает.
+        """
+        self._root.mkdir(parents=True, exist_ok=True)
+        path = self.path(key)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        done = False
+        try:
+            with gzip.open(tmp, "wb", compresslevel=6) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            tmp.replace(path)
+            done = True
+        finally:
+            if not done:
+                tmp.unlink(missing_ok=True)
+        self.evict()
+
+    def _drop_corrupt(self, path: Path, error: BaseException) -> None:
+        print(f"[cache] битый файл {path.name} ({error!r}) — удаляем, считаем промахом")
+        path.unlink(missing_ok=True)
+
+    def _touch(self, path: Path) -> None:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> None:
+        """Удаляет самые старые файлы, пока суммарный размер кэша больше max_bytes."""
+        with self._lock:
+            files = []
+            for p in self._root.glob(f"*{self.SUFFIX}"):
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+            total = sum(size for _, size, _ in files)
+            for _, size, p in sorted(files):
+                if total <= self._max_bytes:
+                    break
+                p.unlink(missing_ok=True)
+                total -= size
+                print(f"[cache] вытеснен {p.name} ({size / 1e6:.1f} МБ)")
+
+
+_raw_caches: Dict[Path, RawCache] = {}
+_raw_caches_lock = threading.Lock()
+
+
+def get_raw_cache(cfg: Config) -> RawCache:
+    """Один RawCache на каталог: срезы и недели бэкфилла вытесняют через общий lock."""
+    root = cfg.raw_dir / "olap"
+    with _raw_caches_lock:
+        if root not in _raw_caches:
+            _raw_caches[root] = RawCache(root, cfg.raw_cache_max_mb * 1024 * 1024)
+        return _raw_caches[root]
+
+
+def _cache_miss(key: str, body: Dict[str, Any]) -> RuntimeError:
+    period = body["filters"]["DateTime.OperDayFilter"]
+    return RuntimeError(
+        f"OLAP_CACHE=replay: нет ответа в кэше за {period['from']} → {period['to']} (ключ {key})"
+    )
 
 
 # =============================
 # OLAP
 # =============================
 
-def build_olap_request(cfg: Config) -> Dict[str, Any]:
+def _olap_ts(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000")
+
+
+def split_period(date_from: str, date_to: str, slice_hours: int) -> List[Tuple[str, str]]:
+    """Режет период [date_from, date_to) на срезы по slice_hours часов (границы — в формате фильтра OLAP)."""
+    start = datetime.strptime(date_from, "%Y-%m-%d")
+    end = datetime.strptime(date_to, "%Y-%m-%d")
+    step = timedelta(hours=slice_hours)
+
+    periods = []
+    cur = start
+    while cur < end:
+        nxt = min(cur + step, end)
+        periods.append((_olap_ts(cur), _olap_ts(nxt)))
+        cur = nxt
+    return periods
+
+
+def build_olap_request(cfg: Config, period: Optional[Tuple[str, str]] = None) -> Dict[str, Any]:
+    if period is None:
+        period = (f"{cfg.date_from}T00:00:00.000", f"{cfg.date_to}T00:00:00.000")
+
     return {
         "reportType": "TRANSACTIONS",
         "buildSummary": False,
@@ -178,8 +465,8 @@ def build_olap_request(cfg: Config) -> Dict[str, Any]:
             "DateTime.OperDayFilter": {
                 "filterType": "DateRange",
                 "periodType": "CUSTOM",
-                "from": f"{cfg.date_from}T00:00:00.000",
-                "to": f"{cfg.date_to}T00:00:00.000",
+                "from": period[0],
+                "to": period[1],
                 "includeLow": True,
                 "includeHigh": False,
             },
@@ -196,19 +483,152 @@ def build_olap_request(cfg: Config) -> Dict[str, Any]:
 
 
 def fetch_olap(cfg: Config, body: Dict[str, Any]) -> Dict[str, Any]:
-    key = get_iiko_key(cfg)
-    resp = requests.post(
-        f"{cfg.iiko_base_url}/resto/api/v2/reports/olap?key={key}",
+    if cfg.olap_cache != "off":
+        cache = get_raw_cache(cfg)
+        key = RawCache.key(cfg.iiko_base_url, body)
+        if cfg.olap_cache == "replay":
+            data = cache.get(key)
+            if data is None:
+                raise _cache_miss(key, body)
+            return json.loads(data)
+
+    resp = get_iiko_session(cfg).request(
+        "POST",
+        "/resto/api/v2/reports/olap",
         json=body,
         headers={"Content-Type": "application/json"},
-        verify=cfg.iiko_verify_ssl,
         timeout=180,
     )
     if resp.status_code != 200:
         raise RuntimeError(resp.text)
+    if cfg.olap_cache == "write":
+        cache.put(key, resp.content)
     return resp.json()
 
 
+def fetch_olap_sliced(cfg: Config) -> List[Dict[str, Any]]:
+    """
+    Забирает период срезами по cfg.olap_slice_hours параллельно (не больше cfg.olap_workers запросов).
+    Упавший срез повторяется сам по себе, до cfg.olap_retries попыток. Возвращает склеенный `data`.
+    """
+    periods = split_period(cfg.date_from, cfg.date_to, cfg.olap_slice_hours)
+    if not periods:
+        return []
+
+    def fetch_slice(period: Tuple[str, str]) -> List[Dict[str, Any]]:
+        body = build_olap_request(cfg, period)
+        for attempt in range(1, cfg.olap_retries + 1):
+            try:
+                return fetch_olap(cfg, body).get("data") or []
+            except (requests.RequestException, RuntimeError) as e:
+                if attempt == cfg.olap_retries:
+                    raise
+                print(f"[olap] срез {period[0]} → {period[1]}: попытка {attempt} не удалась ({e!r}), повтор")
+                time.sleep(2 ** attempt)
+        return []
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(cfg.olap_workers, len(periods))) as pool:
+        chunks = list(pool.map(fetch_slice, periods))
+
+    data = [r for chunk in chunks for r in chunk]
+    print(f"[olap] срезов: {len(periods)}, строк: {len(data)}, за {time.monotonic() - started:.1f} с")
+    return data
+
+
+_OLAP_DATA_START = re.compile(r'"data"\s*:\s*\[')
+
+
+def iter_olap_data(chunks: Iterable[bytes]) -> Iterator[Dict[str, Any]]:
+    """
+    Потоково разбирает массив `data` из ответа OLAP: читает тело кусками (resp.iter_content или кэш)
+    и отдаёт строки по одной, не держа в памяти ни весь ответ, ни весь список.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+
+    def read_more() -> bool:
+        nonlocal buf, pos
+        for chunk in chunks:
+            if chunk:
+                buf = buf[pos:] + text_decoder.decode(chunk)
+                pos = 0
+                return True
+        return False
+
+    while True:
+        m = _OLAP_DATA_START.search(buf)
+        if m:
+            pos = m.end()
+            break
+        if not read_more():
+            return
+
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                break
+            if not read_more():
+                raise RuntimeError("OLAP: ответ оборвался внутри массива data")
+        if buf[pos] == "]":
+            return
+        try:
+            row, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Строка пришла не целиком — дочитываем следующий кусок
+            if not read_more():
+                raise
+            continue
+        pos = end
+        yield row
+
+
+def stream_olap(cfg: Config, body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Как fetch_olap, но отдаёт строки `data` по мере чтения ответа."""
+    if cfg.olap_cache != "off":
+        cache = get_raw_cache(cfg)
+        key = RawCache.key(cfg.iiko_base_url, body)
+        if cfg.olap_cache == "replay":
+            cached = cache.iter_chunks(key)
+            if cached is None:
+                raise _cache_miss(key, body)
+            yield from iter_olap_data(cached)
+            return
+
+    with get_iiko_session(cfg).request(
+        "POST",
+        "/resto/api/v2/reports/olap",
+        json=body,
+        headers={"Content-Type": "application/json"},
+        timeout=180,
+        stream=True,
+    ) as resp:
+        if resp.status_code != 200:
+            raise RuntimeError(resp.text)
+        chunks = resp.iter_content(chunk_size=1 << 16)
+        if cfg.olap_cache == "write":
+            chunks = cache.put_chunks(key, chunks)
+        yield from iter_olap_data(chunks)
+        # Дочитываем хвост ответа после data: иначе запись в кэш не зафиксируется
+        for _ in chunks:
+            pass
+
+
+def stream_olap_period(cfg: Config) -> Iterator[Dict[str, Any]]:
+    """Строки OLAP за весь период; при заданном OLAP_SLICE_HOURS срезы читаются по очереди."""
+    if cfg.olap_slice_hours:
+        periods = split_period(cfg.date_from, cfg.date_to, cfg.olap_slice_hours)
+    else:
+        periods = [None]
+    for period in periods:
+        yield from stream_olap(cfg, build_olap_request(cfg, period))
+
+
 # =============================
 # Normalize
 # =============================
@@ -223,107 +643,805 @@ def parse_posting_dt(raw: str) -> datetime:
     return dt
 
 
-def normalize(cfg: Config, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    rows = []
+# Схемы source_hash. Схему строки видно по самому хэшу, поэтому хэши разных схем в RAW не пересекаются.
+#   v1 — sha256 от json.dumps(payload, sort_keys=True): так посчитано всё, что уже лежит в RAW;
+#   v2 — blake2b (16 байт) от полей в фиксированном порядке через \x1f, с префиксом "v2:".
+HASH_SCHEMES = ("v1", "v2")
+_HASH_V2_PREFIX = "v2:"
+
+# Порядок полей ключа v2 — часть схемы: поменять его значит поменять все хэши v2
+_HASH_V2_FIELDS = (
+    "report_id", "date_from", "date_to", "department", "posting_dt",
+    "product_num", "product_name", "product_category", "product_measure_unit",
+    "contr_account_name", "transaction_type",
+    "amount_out", "amount_in", "sum_outgoing", "sum_incoming",
+)
+
+
+def hash_scheme_of(source_hash: str) -> str:
+    return "v2" if source_hash.startswith(_HASH_V2_PREFIX) else "v1"
+
+
+def source_hash_v1(key: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def source_hash_v2(fields: Iterable[Any]) -> str:
+    """Поля — в порядке _HASH_V2_FIELDS: строки как есть, float через str (= repr), posting_dt — UTC isoformat."""
+    key = "\x1f".join(map(str, fields))
+    return _HASH_V2_PREFIX + hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def row_source_hash(row: Dict[str, Any], scheme: str) -> str:
+    """source_hash нормализованной строки RAW по схеме scheme (для сверки со строками, записанными другой схемой)."""
+    key = {k: row[k] for k in _HASH_V2_FIELDS}
+    key["posting_dt"] = row["posting_dt"].astimezone(timezone.utc).isoformat()
+    if scheme == "v2":
+        return source_hash_v2(key[k] for k in _HASH_V2_FIELDS)
+    return source_hash_v1(key)
+
+
+def normalize_row(cfg: Config, r: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Одна строка OLAP → строка RAW с source_hash. None, если строку не удалось разобрать."""
+    try:
+        posting_dt = parse_posting_dt(r["DateTime.Typed"])
+        amount_out = float(r.get("Amount.Out") or 0)
+        amount_in = float(r.get("Amount.In") or 0)
+        sum_outgoing = float(r.get("Sum.Outgoing") or 0)
+        sum_incoming = float(r.get("Sum.Incoming") or 0)
+    except Exception:
+        return None
+
+    posting_norm = posting_dt.astimezone(timezone.utc).isoformat()
+
+    payload = {
+        "report_id": cfg.report_id,
+        "date_from": cfg.date_from,
+        "date_to": cfg.date_to,
+        "department": str(r["Department"]).strip(),
+        "posting_dt": posting_dt,
+        "product_num": str(r["Product.Num"]).strip(),
+        "product_name": str(r.get("Product.Name") or "").strip(),
+        "product_category": str(r.get("Product.Category") or "").strip(),
+        "product_measure_unit": str(r.get("Product.MeasureUnit") or "").strip(),
+        "contr_account_name": str(r.get("Contr-Account.Name") or "").strip(),
+        "transaction_type": str(r["TransactionType"]).strip(),
+        "amount_out": amount_out,
+        "amount_in": amount_in,
+        "sum_outgoing": sum_outgoing,
+        "sum_incoming": sum_incoming,
+    }
+
+    if cfg.hash_scheme == "v2":
+        payload["source_hash"] = source_hash_v2((
+            cfg.report_id, cfg.date_from, cfg.date_to, payload["department"], posting_norm,
+            payload["product_num"], payload["product_name"], payload["product_category"],
+            payload["product_measure_unit"], payload["contr_account_name"], payload["transaction_type"],
+            amount_out, amount_in, sum_outgoing, sum_incoming,
+        ))
+    else:
+        payload["source_hash"] = source_hash_v1({**payload, "posting_dt": posting_norm})
+    return payload
 
+
+def iter_normalized(cfg: Config, data: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
     for r in data:
-        try:
-            posting_dt = parse_posting_dt(r["DateTime.Typed"])
-            amount_out = float(r.get("Amount.Out") or 0)
-            amount_in = float(r.get("Amount.In") or 0)
-            sum_outgoing = float(r.get("Sum.Outgoing") or 0)
-            sum_incoming = float(r.get("Sum.Incoming") or 0)
-        except Exception:
-            continue
+        row = normalize_row(cfg, r)
+        if row is not None:
+            yield row
+
+
+def normalize(cfg: Config, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return list(iter_normalized(cfg, data))
+
+
+# Колоночный normalize (pandas/NumPy): тот же результат и те же source_hash, что у normalize_row,
+# но разбор дат, чисел и строк идёт по колонкам, а ключ хэша собирается из готовых текстовых фрагментов
+# (JSON-фрагментов для v1, текста полей для v2).
+
+_MISSING = object()
+
+# Ключи payload в порядке json.dumps(sort_keys=True) — так устроен канонический JSON source_hash
+_HASH_KEYS = (
+    "amount_in", "amount_out", "contr_account_name", "date_from", "date_to", "department", "posting_dt",
+    "product_category", "product_measure_unit", "product_name", "product_num", "report_id",
+    "sum_incoming", "sum_outgoing", "transaction_type",
+)
+
+# Колонка RAW → (поле OLAP, обязательное: r[...] у normalize_row, иначе r.get(...) or "")
+_STR_FIELDS = {
+    "department": ("Department", True),
+    "product_num": ("Product.Num", True),
+    "product_name": ("Product.Name", False),
+    "product_category": ("Product.Category", False),
+    "product_measure_unit": ("Product.MeasureUnit", False),
+    "contr_account_name": ("Contr-Account.Name", False),
+    "transaction_type": ("TransactionType", True),
+}
+
+_FLOAT_FIELDS = {
+    "amount_out": "Amount.Out",
+    "amount_in": "Amount.In",
+    "sum_outgoing": "Sum.Outgoing",
+    "sum_incoming": "Sum.Incoming",
+}
+
+
+def _str_column(values: List[Any], np, pd, as_json: bool):
+    """str(x).strip() по колонке: считаем один раз на уникальное значение. Возвращает (значения, фрагменты ключа)."""
+    codes, uniques = pd.factorize(np.array([str(x) for x in values], dtype=object))
+    stripped = [u.strip() for u in uniques]
+    column = np.array(stripped, dtype=object)[codes]
+    if not as_json:
+        return column, column
+    return column, np.array([json.dumps(u) for u in stripped], dtype=object)[codes]
+
+
+def _float_column(values: List[Any], np, as_json: bool):
+    """float(x or 0) по колонке. Возвращает (значения, фрагменты ключа, маска строк, которые не разобрались)."""
+    n = len(values)
+    bad = np.zeros(n, dtype=bool)
+    try:
+        arr = np.fromiter(map(float, [x or 0 for x in values]), dtype=float, count=n)
+    except Exception:
+        arr = np.zeros(n)
+        for i, x in enumerate(values):
+            try:
+                arr[i] = float(x or 0)
+            except Exception:
+                bad[i] = True
+    # json.dumps для конечных float — это float.__repr__; NaN/Infinity пишутся по-своему
+    to_text = float.__repr__ if not as_json or np.isfinite(arr).all() else json.dumps
+    return arr, np.array(list(map(to_text, arr.tolist())), dtype=object), bad
+
+
+# Время с явным смещением в конце ISO-строки (после замены Z на +00:00): ...T10:00:00+03:00, ...T10:00+0300
+_TZ_OFFSET_SUFFIX = re.compile(r"[T ]\d{2}(:?\d{2}){0,2}([.,]\d+)?\s*[+-]\d{2}(:?\d{2})?$")
+
+
+def _to_datetime_group(prepared: List[str], positions: List[int], parsed: List[Optional[datetime]], pd, aware: bool) -> None:
+    """
+    pd.to_datetime по строкам одного вида — все со смещением (aware) или все без; без смещения —
+    Europe/Moscow, как у parse_posting_dt. Если pandas понял группу иначе (регулярка ошиблась,
+    смесь смещений, мусор) — группа остаётся на построчный разбор.
+    """
+    if not positions:
+        return
+    try:
+        with warnings.catch_warnings():
+            # Смесь часовых поясов pandas отдаёт object-индексом с FutureWarning — разберём построчно
+            warnings.simplefilter("ignore", FutureWarning)
+            idx = pd.to_datetime(pd.Index([prepared[i] for i in positions], dtype=object), format="ISO8601", errors="coerce")
+        if not isinstance(idx, pd.DatetimeIndex) or (idx.tz is not None) != aware:
+            return
+        if not aware:
+            idx = idx.tz_localize(ZoneInfo("Europe/Moscow"))
+        for i, ts, ok in zip(positions, idx.to_pydatetime(), ~idx.isna()):
+            if ok:
+                parsed[i] = ts
+    except Exception:
+        pass
+
+
+def _posting_dt_column(values: List[Any], np, pd, as_json: bool):
+    """
+    parse_posting_dt по колонке: уникальные значения разбираются pd.to_datetime отдельно для строк
+    со смещением и без (в одном вызове pandas применил бы смещение соседей к строкам без него),
+    то, что pandas не осилил (или смесь часовых поясов), — построчно через parse_posting_dt.
+    Возвращает (datetime, фрагменты ключа — UTC isoformat, маска строк, которые не разобрались).
+    """
+    codes, uniques = pd.factorize(np.array([x if isinstance(x, str) else None for x in values], dtype=object))
+    prepared = []
+    for u in uniques:
+        u = u.strip()
+        prepared.append(u.replace("Z", "+00:00") if u.endswith("Z") else u)
+
+    parsed: List[Optional[datetime]] = [None] * len(prepared)
+    aware = [bool(_TZ_OFFSET_SUFFIX.search(u)) for u in prepared]
+    _to_datetime_group(prepared, [i for i, a in enumerate(aware) if a], parsed, pd, aware=True)
+    _to_datetime_group(prepared, [i for i, a in enumerate(aware) if not a], parsed, pd, aware=False)
+    for i, u in enumerate(uniques):
+        if parsed[i] is None:
+            try:
+                parsed[i] = parse_posting_dt(u)
+            except Exception:
+                pass
+
+    ok_u = np.array([p is not None for p in parsed] + [False], dtype=bool)
+    dts = np.array(parsed + [None], dtype=object)
+    to_text = json.dumps if as_json else str
+    iso = np.array(
+        [to_text(p.astimezone(timezone.utc).isoformat()) if p is not None else None for p in parsed] + [None],
+        dtype=object,
+    )
+    # factorize кодирует None как -1 — это последний (пустой) элемент
+    return dts[codes], iso[codes], ~ok_u[codes]
 
-        posting_norm = posting_dt.astimezone(timezone.utc).isoformat()
 
-        payload = {
-            "report_id": cfg.report_id,
-            "date_from": cfg.date_from,
-            "date_to": cfg.date_to,
-            "department": str(r["Department"]).strip(),
-            "posting_dt": posting_dt,
-            "product_num": str(r["Product.Num"]).strip(),
-            "product_name": str(r.get("Product.Name") or "").strip(),
-            "product_category": str(r.get("Product.Category") or "").strip(),
-            "product_measure_unit": str(r.get("Product.MeasureUnit") or "").strip(),
-            "contr_account_name": str(r.get("Contr-Account.Name") or "").strip(),
-            "transaction_type": str(r["TransactionType"]).strip(),
-            "amount_out": amount_out,
-            "amount_in": amount_in,
-            "sum_outgoing": sum_outgoing,
-            "sum_incoming": sum_incoming,
-        }
+def normalize_columns(cfg: Config, data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Колоночный normalize: OLAP `data` → столбцы RAW (NumPy-массивы) с source_hash.
+    Строки, которые normalize_row отбросил бы, отбрасываются и здесь; хэши совпадают побайтно.
+    """
+    import numpy as np
+    import pandas as pd
+
+    as_json = cfg.hash_scheme != "v2"
+    columns: Dict[str, Any] = {}
+    frags: Dict[str, Any] = {}
+
+    posting_dt, frags["posting_dt"], bad = _posting_dt_column([r.get("DateTime.Typed") for r in data], np, pd, as_json)
+    for col, field in _FLOAT_FIELDS.items():
+        columns[col], frags[col], col_bad = _float_column([r.get(field) for r in data], np, as_json)
+        bad |= col_bad
+    keep = ~bad
+
+    for col, (field, required) in _STR_FIELDS.items():
+        if required:
+            values = [r.get(field, _MISSING) for r in data]
+            # Как у normalize_row: отсутствие обязательного поля в разобранной строке — KeyError
+            if _MISSING in values and any(v is _MISSING for v, k in zip(values, keep) if k):
+                raise KeyError(field)
+        else:
+            values = [r.get(field) or "" for r in data]
+        columns[col], frags[col] = _str_column(values, np, pd, as_json)
+
+    if not keep.all():
+        posting_dt = posting_dt[keep]
+        columns = {k: v[keep] for k, v in columns.items()}
+        frags = {k: v[keep] for k, v in frags.items()}
+
+    n = len(posting_dt)
+    for col in ("report_id", "date_from", "date_to"):
+        columns[col] = np.full(n, getattr(cfg, col), dtype=object)
+    columns["posting_dt"] = posting_dt
+
+    if not as_json:
+        # Ключ v2: константы периода идут первыми в _HASH_V2_FIELDS — склеиваем их один раз
+        prefix = "\x1f".join((cfg.report_id, cfg.date_from, cfg.date_to, ""))
+        per_row = [frags[key].tolist() for key in _HASH_V2_FIELDS[3:]]
+        blake2b = hashlib.blake2b
+        columns["source_hash"] = np.array(
+            [
+                _HASH_V2_PREFIX + blake2b((prefix + "\x1f".join(values)).encode(), digest_size=16).hexdigest()
+                for values in zip(*per_row)
+            ],
+            dtype=object,
+        )
+        return columns
+
+    # Канонический JSON — шаблон с готовыми JSON-фрагментами; константы периода подставлены заранее
+    template = "{" + ", ".join(
+        f'"{key}": ' + (json.dumps(getattr(cfg, key)).replace("%", "%%") if key in ("report_id", "date_from", "date_to") else "%s")
+        for key in _HASH_KEYS
+    ) + "}"
+    per_row = [frags[key].tolist() for key in _HASH_KEYS if key in frags]
+    sha256 = hashlib.sha256
+    columns["source_hash"] = np.array(
+        [sha256((template % values).encode()).hexdigest() for values in zip(*per_row)], dtype=object
+    )
+    return columns
+
 
-        source_hash = hashlib.sha256(
-            json.dumps({**payload, "posting_dt": posting_norm}, sort_keys=True).encode()
-        ).hexdigest()
+# Порядок полей — как в словаре normalize_row
+_ROW_KEYS = (
+    "report_id", "date_from", "date_to", "department", "posting_dt",
+    "product_num", "product_name", "product_category", "product_measure_unit",
+    "contr_account_name", "transaction_type",
+    "amount_out", "amount_in", "sum_outgoing", "sum_incoming",
+    "source_hash",
+)
 
-        payload["source_hash"] = source_hash
-        rows.append(payload)
 
-    return rows
+def normalize_vectorized(cfg: Config, data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """То же, что normalize, через normalize_columns."""
+    columns = normalize_columns(cfg, data)
+    cols = [columns[k].tolist() for k in _ROW_KEYS]
+    return [dict(zip(_ROW_KEYS, values)) for values in zip(*cols)]
 
 
 # =============================
 # DB
 # =============================
 
+def neon_params(cfg: Config) -> neon_db.NeonParams:
+    return neon_db.NeonParams(cfg.neon_host, cfg.neon_db, cfg.neon_user, cfg.neon_password)
+
+
 def db_connect(cfg: Config):
-    return psycopg2.connect(
-        host=cfg.neon_host,
-        dbname=cfg.neon_db,
-        user=cfg.neon_user,
-        password=cfg.neon_password,
-        sslmode="require",
-    )
+    return neon_db.connect(neon_params(cfg))
+
+
+def db_session(cfg: Config):
+    """Соединение из пула процесса (neon_db, до cfg.backfill_workers соединений) в рамках одной транзакции."""
+    return neon_db.session(neon_params(cfg), cfg.backfill_workers)
+
+
+def warmup_db(cfg: Config) -> None:
+    """Будит Neon в фоне, пока идёт выгрузка из iiko: к первому запросу пул уже подключён."""
+    neon_db.warmup(neon_params(cfg), cfg.backfill_workers)
 
 
-def delete_period(cfg: Config) -> int:
+close_pool = neon_db.close_pool
+
+
+DELETE_PERIOD_SQL = """
+delete from inventory_raw.olap_postings
+where report_id = %s and date_from = %s and date_to = %s;
+"""
+
+
+def delete_period(cfg: Config, conn=None) -> int:
     """Удаляет из RAW все строки за период (report_id, date_from, date_to). Возвращает число удалённых строк."""
-    sql = """
-    delete from inventory_raw.olap_postings
-    where report_id = %s and date_from = %s and date_to = %s;
+    if conn is None:
+        with db_session(cfg) as conn:
+            return delete_period(cfg, conn)
+    with conn.cursor() as cur:
+        cur.execute(DELETE_PERIOD_SQL, (cfg.report_id, cfg.date_from, cfg.date_to))
+        return cur.rowcount
+
+
+def period_partition(cfg: Config) -> Optional[str]:
     """
-    with db_connect(cfg) as conn:
-        with conn.cursor() as cur:
-            cur.execute(sql, (cfg.report_id, cfg.date_from, cfg.date_to))
-            deleted = cur.rowcount
-            conn.commit()
-    return deleted
+    Секция RAW ровно под период [date_from, date_to) — olap_postings_YYYYMMDD_YYYYMMDD; нет — создаёт.
+    Создание идёт отдельной короткой транзакцией (оно блокирует всю таблицу). None, если секцию завести нельзя
+    (период пересекается с другой секцией или таблица не секционирована) — тогда период удаляется строками.
+    """
+    name = "olap_postings_{}_{}".format(cfg.date_from.replace("-", ""), cfg.date_to.replace("-", ""))
+    try:
+        with db_session(cfg) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    SQL(
+                        "create table if not exists inventory_raw.{} partition of inventory_raw.olap_postings "
+                        "for values from (%s) to (%s);"
+                    ).format(Identifier(name)),
+                    (cfg.date_from, cfg.date_to),
+                )
+    except psycopg2.Error as e:
+        print(f"[partition] {cfg.date_from} → {cfg.date_to}: секцию не завести ({(e.pgerror or str(e)).strip()}), удаление строками")
+        return None
+    return name
 
 
-def insert_rows(cfg: Config, rows: List[Dict[str, Any]]):
+def truncate_period(cfg: Config, conn, partition: str) -> int:
+    """
+    Очищает период TRUNCATE его секции вместо построчного DELETE. Если в секции есть строки другого периода
+    (report_id, date_from, date_to — как в DELETE_PERIOD_SQL), очищать её целиком нельзя — тогда delete_period.
+    Проверка — exists до первой чужой строки, без подсчёта секции. Возвращает число удалённых строк:
+    для TRUNCATE — оценку из pg_class.reltuples (только для лога).
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            SQL(
+                "select exists (select 1 from inventory_raw.{} "
+                "where not (report_id = %s and date_from = %s and date_to = %s)), "
+                "(select c.reltuples from pg_class c join pg_namespace n on n.oid = c.relnamespace "
+                "where n.nspname = 'inventory_raw' and c.relname = %s);"
+            ).format(Identifier(partition)),
+            (cfg.report_id, cfg.date_from, cfg.date_to, partition),
+        )
+        foreign, estimate = cur.fetchone()
+        if foreign:
+            return delete_period(cfg, conn)
+        cur.execute(SQL("truncate inventory_raw.{};").format(Identifier(partition)))
+    # reltuples = -1 — секцию ещё не анализировали
+    return max(int(estimate or 0), 0)
+
+
+INSERT_SQL = """
+insert into inventory_raw.olap_postings
+(report_id, date_from, date_to, department, posting_dt,
+ product_num, product_name, product_category, product_measure_unit,
+ contr_account_name, transaction_type,
+ amount_out, amount_in, sum_outgoing, sum_incoming,
+ source_hash, loaded_at)
+values %s
+on conflict do nothing;
+"""
+
+
+def _row_values(r: Dict[str, Any]) -> tuple:
+    return (
+        r["report_id"], r["date_from"], r["date_to"], r["department"], r["posting_dt"],
+        r["product_num"], r["product_name"], r["product_category"], r["product_measure_unit"],
+        r["contr_account_name"], r["transaction_type"],
+        r["amount_out"], r["amount_in"], r["sum_outgoing"], r["sum_incoming"],
+        r["source_hash"], datetime.now(timezone.utc),
+    )
+
+
+def insert_rows(cfg: Config, rows: List[Dict[str, Any]], conn=None):
     if not rows:
         return
+    if conn is None:
+        with db_session(cfg) as conn:
+            return insert_rows(cfg, rows, conn)
+
+    values = [_row_values(r) for r in rows]
+
+    with conn.cursor() as cur:
+        execute_values(cur, INSERT_SQL, values, page_size=1000)
+
+
+def insert_rows_stream(cfg: Config, rows: Iterable[Dict[str, Any]], batch_size: int, conn=None) -> int:
+    """Пишет строки пачками по batch_size, не собирая их в список. Возвращает число строк."""
+    if conn is None:
+        with db_session(cfg) as conn:
+            return insert_rows_stream(cfg, rows, batch_size, conn)
+
+    rows = iter(rows)
+    total = 0
+    with conn.cursor() as cur:
+        while True:
+            batch = [_row_values(r) for r in islice(rows, batch_size)]
+            if not batch:
+                break
+            execute_values(cur, INSERT_SQL, batch, page_size=batch_size)
+            total += len(batch)
+    return total
+
+
+COPY_COLUMNS = (
+    "report_id, date_from, date_to, department, posting_dt, "
+    "product_num, product_name, product_category, product_measure_unit, "
+    "contr_account_name, transaction_type, "
+    "amount_out, amount_in, sum_outgoing, sum_incoming, "
+    "source_hash"
+)
+
+
+class _CsvRowsReader:
+    """Файлоподобная обёртка для copy_expert: отдаёт строки RAW в CSV по мере чтения, не собирая их в память."""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        self._rows = iter(rows)
+        self._out = io.StringIO()
+        # Строки всегда в кавычках: в CSV-режиме COPY пустое поле без кавычек — это NULL
+        self._writer = csv.writer(self._out, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+        self._buf = ""
+        self.count = 0
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buf) < size:
+            batch = list(islice(self._rows, 1000))
+            if not batch:
+                break
+            for r in batch:
+                self._writer.writerow(_row_values(r)[:-1])
+            self.count += len(batch)
+            self._buf += self._out.getvalue()
+            self._out.seek(0)
+            self._out.truncate()
+        if size < 0:
+            out, self._buf = self._buf, ""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+def stage_rows(cfg: Config, rows: Iterable[Dict[str, Any]], conn) -> int:
+    """
+    Льёт строки во временную таблицу olap_postings_stage (живёт до конца транзакции): COPY FROM STDIN
+    при cfg.loader == "copy", иначе execute_values пачками. RAW не трогается. Возвращает число строк.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            create temp table olap_postings_stage on commit drop as
+            select {COPY_COLUMNS} from inventory_raw.olap_postings with no data;
+            """
+        )
+        if cfg.loader == "copy":
+            reader = _CsvRowsReader(rows)
+            cur.copy_expert(f"copy olap_postings_stage ({COPY_COLUMNS}) from stdin with (format csv)", reader)
+            return reader.count
+        rows = iter(rows)
+        total = 0
+        while True:
+            batch = [_row_values(r)[:-1] for r in islice(rows, cfg.load_batch_size)]
+            if not batch:
+                return total
+            execute_values(
+                cur, f"insert into olap_postings_stage ({COPY_COLUMNS}) values %s;", batch, page_size=cfg.load_batch_size
+            )
+            total += len(batch)
+
+
+def insert_from_stage(conn, staged: int) -> int:
+    """Одним INSERT ... SELECT переносит olap_postings_stage в RAW. Возвращает число вставленных строк."""
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            insert into inventory_raw.olap_postings ({COPY_COLUMNS}, loaded_at)
+            select {COPY_COLUMNS}, now() from olap_postings_stage
+            on conflict do nothing;
+            """
+        )
+        inserted = cur.rowcount
+    if staged != inserted:
+        print(f"[stage] строк во временной таблице: {staged}, из них дублей по source_hash: {staged - inserted}")
+    return inserted
+
+
+def copy_rows(cfg: Config, rows: Iterable[Dict[str, Any]], conn=None) -> int:
+    """
+    Льёт строки COPY FROM STDIN во временную таблицу и одним INSERT ... SELECT переносит их в RAW.
+    Возвращает число вставленных строк.
+    """
+    if conn is None:
+        with db_session(cfg) as conn:
+            return copy_rows(cfg, rows, conn)
+    return insert_from_stage(conn, stage_rows(replace(cfg, loader="copy"), rows, conn))
+
+
+def replace_period(cfg: Config, rows: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Перезаливка периода одной транзакцией на одном соединении: удаление старых строк и вставка новых.
+    До commit читатели (DataLens, alerts_bot) видят прежнюю неделю, после — сразу новую целиком.
 
+    Строки сначала целиком ложатся во временную таблицу (stage_rows): пока идёт выгрузка из iiko
+    (в том числе потоком, OLAP_STREAM=1), RAW не заблокирован. TRUNCATE секции берёт ACCESS EXCLUSIVE
+    до commit, поэтому очистка и вставка идут уже после — блокировка держится только на время
+    INSERT ... SELECT из временной таблицы внутри Neon. Возвращает (удалено, вставлено).
+    """
+    partition = period_partition(cfg) if cfg.partitioned else None
+    with db_session(cfg) as conn:
+        staged = stage_rows(cfg, rows, conn)
+        deleted = truncate_period(cfg, conn, partition) if partition else delete_period(cfg, conn)
+        inserted = insert_from_stage(conn, staged)
+    return deleted, inserted
+
+
+def fetch_period_hashes(cfg: Config, conn) -> Set[str]:
+    """source_hash всех строк RAW за период (report_id, date_from, date_to)."""
     sql = """
-    insert into inventory_raw.olap_postings
-    (report_id, date_from, date_to, department, posting_dt,
-     product_num, product_name, product_category, product_measure_unit,
-     contr_account_name, transaction_type,
-     amount_out, amount_in, sum_outgoing, sum_incoming,
-     source_hash, loaded_at)
-    values %s
-    on conflict (source_hash) do nothing;
+    select source_hash from inventory_raw.olap_postings
+    where report_id = %s and date_from = %s and date_to = %s;
     """
+    with conn.cursor() as cur:
+        cur.execute(sql, (cfg.report_id, cfg.date_from, cfg.date_to))
+        return {r[0] for r in cur.fetchall()}
 
-    values = [
-        (
-            r["report_id"], r["date_from"], r["date_to"], r["department"], r["posting_dt"],
-            r["product_num"], r["product_name"], r["product_category"], r["product_measure_unit"],
-            r["contr_account_name"], r["transaction_type"],
-            r["amount_out"], r["amount_in"], r["sum_outgoing"], r["sum_incoming"],
-            r["source_hash"], datetime.now(timezone.utc),
-        )
-        for r in rows
-    ]
 
-    with db_connect(cfg) as conn:
+def apply_delta(cfg: Config, rows: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Инкрементальная загрузка периода по разнице source_hash: вставляет только новые строки
+    и удаляет только исчезнувшие из iiko. Всё в одной транзакции. Возвращает (удалено, вставлено).
+
+    Если в RAW за период лежат хэши другой схемы (например, v1 после перехода на SOURCE_HASH=v2),
+    строка сверяется и по ним; при cfg.hash_migrate совпавшие старые хэши переписываются на текущую схему.
+    """
+    with db_session(cfg) as conn:
+        existing = fetch_period_hashes(cfg, conn)
+        legacy_schemes = sorted({hash_scheme_of(h) for h in existing} - {cfg.hash_scheme})
+
+        seen: Set[str] = set()
+        renamed: List[Tuple[str, str]] = []
+
+        def fresh_rows() -> Iterator[Dict[str, Any]]:
+            """Строки, которых нет в RAW, — потоком в загрузчик; по пути копятся seen и renamed."""
+            for r in rows:
+                h = r["source_hash"]
+                if h not in existing:
+                    for scheme in legacy_schemes:
+                        old = row_source_hash(r, scheme)
+                        if old in existing:
+                            if cfg.hash_migrate and old not in seen:
+                                renamed.append((old, h))
+                            h = old
+                            break
+                if h in seen:
+                    continue
+                seen.add(h)
+                if h not in existing:
+                    yield r
+
+        # Новые хэши не пересекаются с existing, поэтому переименование и удаление ниже
+        # вставленные строки не задевают
+        if cfg.loader == "copy":
+            inserted = copy_rows(cfg, fresh_rows(), conn)
+        else:
+            inserted = insert_rows_stream(cfg, fresh_rows(), cfg.load_batch_size, conn)
+        vanished = list(existing - seen)
+
+        if renamed:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    """
+                    update inventory_raw.olap_postings p set source_hash = v.new_hash
+                    from (values %s) as v(old_hash, new_hash)
+                    where p.source_hash = v.old_hash;
+                    """,
+                    renamed,
+                    page_size=cfg.load_batch_size,
+                )
+            print(f"[delta] хэшей переписано на схему {cfg.hash_scheme}: {len(renamed)}")
+
+        deleted = 0
+        if vanished:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    delete from inventory_raw.olap_postings
+                    where report_id = %s and date_from = %s and date_to = %s
+                      and source_hash = any(%s);
+                    """,
+                    (cfg.report_id, cfg.date_from, cfg.date_to, vanished),
+                )
+                deleted = cur.rowcount
+
+    legacy = f", сверено по схемам {', '.join(legacy_schemes)}" if legacy_schemes else ""
+    print(f"[delta] в RAW: {len(existing)}, из iiko: {len(seen)}, новых: {inserted}, исчезло: {deleted}{legacy}")
+    return deleted, inserted
+
+
+def refresh_materialized(cfg: Config) -> None:
+    """
+    Пересчитывает материализованные витрины (docs/migrations/materialize-weekly-mart.sql) за загруженный период
+    и за следующую неделю: её флаги «прошлой недели» зависят от загруженной. Одна транзакция.
+    """
+    next_to = (date.fromisoformat(cfg.date_to) + timedelta(days=7)).isoformat()
+    started = time.monotonic()
+    with db_session(cfg) as conn:
         with conn.cursor() as cur:
-            execute_values(cur, sql, values, page_size=1000)
-            conn.commit()
+            for week in ((cfg.date_from, cfg.date_to), (cfg.date_to, next_to)):
+                cur.execute("select inventory_mart.refresh_weekly_mat(%s, %s);", week)
+    print(f"[mat] витрины пересчитаны за {cfg.date_from} → {cfg.date_to} (+ следующая неделя), {time.monotonic() - started:.1f} с")
+
+
+# =============================
+# Run
+# =============================
+
+def extract_rows(cfg: Config) -> Iterator[Dict[str, Any]]:
+    """Нормализованные строки за период — выбранным способом извлечения (целиком, срезами или потоком)."""
+    if cfg.olap_stream:
+        if cfg.normalizer == "pandas":
+            return _normalize_batches(cfg, stream_olap_period(cfg))
+        return iter_normalized(cfg, stream_olap_period(cfg))
+    if cfg.olap_slice_hours:
+        data = fetch_olap_sliced(cfg)
+    else:
+        body = build_olap_request(cfg)
+        data = fetch_olap(cfg, body).get("data") or []
+    if cfg.normalizer == "pandas":
+        return iter(normalize_vectorized(cfg, data))
+    return iter(normalize(cfg, data))
+
+
+def _normalize_batches(cfg: Config, data: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Потоковый режим + колоночный normalize: нормализуем пачками по cfg.load_batch_size."""
+    data = iter(data)
+    while True:
+        batch = list(islice(data, cfg.load_batch_size))
+        if not batch:
+            return
+        yield from normalize_vectorized(cfg, batch)
+
+
+def run_period(cfg: Config) -> Tuple[int, int]:
+    """Полный цикл за период cfg.date_from → cfg.date_to: iiko → normalize → RAW. Возвращает (удалено, вставлено)."""
+    rows = extract_rows(cfg)
+    # Дожидаемся первой строки до удаления периода: если iiko не ответил, старые данные остаются
+    first = next(rows, None)
+    rows = chain([first], rows) if first is not None else iter(())
+
+    started = time.monotonic()
+    if cfg.incremental:
+        deleted, inserted = apply_delta(cfg, rows)
+    else:
+        deleted, inserted = replace_period(cfg, rows)
+    elapsed = time.monotonic() - started
+
+    if deleted and not cfg.incremental:
+        print(f"[period] {cfg.date_from} → {cfg.date_to}: перезапись, удалено строк за период: {deleted}")
+    print(f"[load] loader={cfg.loader}: {inserted} строк за {elapsed:.1f} с ({inserted / max(elapsed, 1e-6):,.0f} rows/s)")
+    # Инкрементальный прогон без изменений витрины не меняет
+    if cfg.materialize and (deleted or inserted or not cfg.incremental):
+        refresh_materialized(cfg)
+    return deleted, inserted
+
+
+# =============================
+# Backfill
+# =============================
+
+def backfill_weeks(date_from: str, date_to: str, today: Optional[date] = None) -> List[Tuple[str, str]]:
+    """
+    Недели Tue→Tue (конец не включается), покрывающие [date_from, date_to).
+    Начало выравнивается на вторник; недели, которые ещё не закрыты (см. last_closed_week_tue_to_tue), не берём.
+    """
+    start = datetime.strptime(date_from, "%Y-%m-%d").date()
+    end = datetime.strptime(date_to, "%Y-%m-%d").date()
+    start -= timedelta(days=(start.weekday() - 1) % 7)
+    closed_end = date.fromisoformat(last_closed_week_tue_to_tue(today)[1])
+
+    weeks = []
+    while start < end and start + timedelta(days=7) <= closed_end:
+        weeks.append((start.isoformat(), (start + timedelta(days=7)).isoformat()))
+        start += timedelta(days=7)
+    return weeks
+
+
+class BackfillProgress:
+    """Прогресс бэкфилла в JSON-файле: выполненные недели пропускаются при повторном запуске."""
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._done: Dict[str, Dict[str, Any]] = {}
+        if path.exists():
+            self._done = json.loads(path.read_text(encoding="utf-8"))
+
+    @staticmethod
+    def key(cfg: Config) -> str:
+        return f"{cfg.report_id}:{cfg.date_from}:{cfg.date_to}"
+
+    def is_done(self, cfg: Config) -> bool:
+        return self.key(cfg) in self._done
+
+    def mark_done(self, cfg: Config, rows: int, seconds: float) -> None:
+        with self._lock:
+            self._done[self.key(cfg)] = {
+                "rows": rows,
+                "seconds": round(seconds, 1),
+                "done_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._done, ensure_ascii=False, indent=2), encoding="utf-8")
+            tmp.replace(self._path)
+
+
+def backfill(cfg: Config, date_from: str, date_to: str) -> bool:
+    """
+    Перезаливает историю понедельно: недели из backfill_weeks идут через пул на cfg.backfill_workers потоков
+    с общим ключом iiko и общим пулом соединений с Neon. Возвращает True, если все недели загружены.
+    """
+    weeks = backfill_weeks(date_from, date_to)
+    progress = BackfillProgress(cfg.raw_dir / "backfill_progress.json")
+    todo = [replace(cfg, date_from=w[0], date_to=w[1]) for w in weeks]
+    todo = [c for c in todo if not progress.is_done(c)]
+    print(f"[backfill] недель в диапазоне: {len(weeks)}, уже загружено: {len(weeks) - len(todo)}, к загрузке: {len(todo)}")
+    if not todo:
+        return True
+
+    # Авторизуемся один раз до старта потоков: дальше все недели идут с этим ключом
+    if cfg.olap_cache != "replay":
+        get_iiko_key(cfg)
+
+    def run_week(week_cfg: Config) -> int:
+        started = time.monotonic()
+        _, inserted = run_period(week_cfg)
+        elapsed = time.monotonic() - started
+        progress.mark_done(week_cfg, inserted, elapsed)
+        print(f"[backfill] {week_cfg.date_from} → {week_cfg.date_to}: {inserted} строк за {elapsed:.1f} с")
+        return inserted
+
+    started = time.monotonic()
+    total_rows = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=cfg.backfill_workers) as pool:
+        futures = {pool.submit(run_week, c): c for c in todo}
+        for fut in as_completed(futures):
+            week_cfg = futures[fut]
+            try:
+                total_rows += fut.result()
+            except Exception as e:
+                failed.append(week_cfg)
+                print(f"[backfill] {week_cfg.date_from} → {week_cfg.date_to}: ошибка {e!r}")
+    elapsed = time.monotonic() - started
+
+    done = len(todo) - len(failed)
+    print(
+        f"[backfill] итог: недель {done}/{len(todo)}, строк {total_rows} за {elapsed:.1f} с "
+        f"({total_rows / max(elapsed, 1e-6):,.0f} rows/s, {done / max(elapsed, 1e-6) * 60:.1f} недель/мин)"
+    )
+    if failed:
+        print("[backfill] не загружены: " + ", ".join(f"{c.date_from} → {c.date_to}" for c in failed))
+    return not failed
 
 
 # =============================
@@ -332,18 +1450,33 @@ def insert_rows(cfg: Config, rows: List[Dict[str, Any]]):
 
 def main():
     cfg = load_config()
-    print(f"[period] {cfg.date_from} → {cfg.date_to}")
 
-    body = build_olap_request(cfg)
-    resp = fetch_olap(cfg, body)
-
-    rows = normalize(cfg, resp.get("data") or [])
-    deleted = delete_period(cfg)
-    if deleted:
-        print(f"[period] перезапись: удалено строк за период: {deleted}")
-    insert_rows(cfg, rows)
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        if len(sys.argv) != 4:
+            raise SystemExit("Использование: python etl.py backfill YYYY-MM-DD YYYY-MM-DD")
+        for raw in sys.argv[2:]:
+            try:
+                datetime.strptime(raw, "%Y-%m-%d")
+            except ValueError:
+                raise RuntimeError(f"backfill: date must be YYYY-MM-DD, got: {raw!r}")
+        warmup_db(cfg)
+        try:
+            ok = backfill(cfg, sys.argv[2], sys.argv[3])
+        finally:
+            close_pool()
+            close_iiko_session()
+        if not ok:
+            sys.exit(1)
+        return
 
-    print(f"[done] rows inserted: {len(rows)}")
+    print(f"[period] {cfg.date_from} → {cfg.date_to}")
+    warmup_db(cfg)
+    try:
+        _, inserted = run_period(cfg)
+    finally:
+        close_pool()
+        close_iiko_session()
+    print(f"[done] rows inserted: {inserted}")
 
 
 if __name__ == "__main__":
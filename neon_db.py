@@ -0,0 +1,229 @@
+"""
+Соединения с Neon для etl.py, alerts_bot.py и scripts/*.
+
+Neon усыпляет compute при простое, поэтому первое подключение часто занимает секунды
+или падает с OperationalError. Здесь:
+  - connect / new_pool — подключение с повтором и экспоненциальной паузой (1, 2, 4, 8 с);
+  - get_pool / session — один пул на процесс, соединение переиспользуется всеми этапами;
+    session ждёт свободное соединение, а не падает с PoolError;
+  - warmup — подключение и select 1 в фоне, пока процесс занят другим (выгрузка из iiko):
+    холодный старт Neon идёт параллельно с полезной работой;
+  - stats — суммарное время подключений и сессий, печатается при close_pool.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+
+CONNECT_ATTEMPTS = 5
+CONNECT_BACKOFF_SEC = 1.0
+CONNECT_TIMEOUT_SEC = 10
+# Соединение из пула, простоявшее дольше, проверяется select 1 перед выдачей (Neon мог его закрыть)
+IDLE_CHECK_SEC = 60.0
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class NeonParams:
+    host: str
+    dbname: str
+    user: str
+    password: str
+
+    @classmethod
+    def from_env(cls) -> Optional["NeonParams"]:
+        """NEON_HOST, NEON_DB, NEON_USER, NEON_PASSWORD; None, если чего-то не хватает."""
+        values = [os.getenv(name) for name in ("NEON_HOST", "NEON_DB", "NEON_USER", "NEON_PASSWORD")]
+        if not all(values):
+            return None
+        return cls(*values)
+
+
+class Stats:
+    """Сколько времени ушло на подключения и на работу в сессиях — чтобы отличать холодный старт от запросов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connect_sec = 0.0
+        self.connects = 0
+        self.session_sec = 0.0
+        self.sessions = 0
+
+    def add_connect(self, seconds: float) -> None:
+        with self._lock:
+            self.connect_sec += seconds
+            self.connects += 1
+
+    def add_session(self, seconds: float) -> None:
+        with self._lock:
+            self.session_sec += seconds
+            self.sessions += 1
+
+    def summary(self) -> str:
+        return (
+            f"подключения {self.connect_sec:.2f} с ({self.connects}), "
+            f"запросы {self.session_sec:.2f} с ({self.sessions} сессий)"
+        )
+
+
+stats = Stats()
+
+
+def connect_kwargs(params: NeonParams, **extra: Any) -> Dict[str, Any]:
+    return dict(
+        host=params.host,
+        dbname=params.dbname,
+        user=params.user,
+        password=params.password,
+        sslmode="require",
+        connect_timeout=CONNECT_TIMEOUT_SEC,
+        **extra,
+    )
+
+
+def _retrying(open_fn: Callable[[], T], what: str) -> T:
+    """open_fn() с повтором на OperationalError (холодный или просыпающийся compute), время — в stats и лог."""
+    for attempt in range(1, CONNECT_ATTEMPTS + 1):
+        started = time.monotonic()
+        try:
+            result = open_fn()
+        except psycopg2.OperationalError as e:
+            if attempt == CONNECT_ATTEMPTS:
+                raise
+            delay = CONNECT_BACKOFF_SEC * 2 ** (attempt - 1)
+            print(f"[neon] {what}: попытка {attempt} не удалась ({str(e).strip()}), повтор через {delay:.0f} с")
+            time.sleep(delay)
+            continue
+        elapsed = time.monotonic() - started
+        stats.add_connect(elapsed)
+        retry_note = f", попытка {attempt}" if attempt > 1 else ""
+        print(f"[neon] {what}: {elapsed:.2f} с{retry_note}")
+        return result
+    raise AssertionError("unreachable")
+
+
+def connect(params: NeonParams, **extra: Any):
+    """Отдельное соединение (psycopg2.connect) с повтором; extra — например cursor_factory."""
+    return _retrying(lambda: psycopg2.connect(**connect_kwargs(params, **extra)), "connect")
+
+
+def new_pool(params: NeonParams, minconn: int, maxconn: int, **extra: Any) -> ThreadedConnectionPool:
+    """ThreadedConnectionPool, первые minconn соединений открываются с повтором."""
+    return _retrying(
+        lambda: ThreadedConnectionPool(minconn, maxconn, **connect_kwargs(params, **extra)),
+        "pool",
+    )
+
+
+# Один пул на процесс: каждое новое соединение с Neon — это ещё один TLS-хендшейк
+_pool: Optional[ThreadedConnectionPool] = None
+# Слоты пула: ThreadedConnectionPool.getconn при исчерпании бросает PoolError, а session ждёт слот
+_slots: Optional[threading.BoundedSemaphore] = None
+_pool_lock = threading.Lock()
+_last_used: Dict[int, float] = {}
+
+
+def _pool_and_slots(params: NeonParams, maxconn: int) -> Tuple[ThreadedConnectionPool, threading.BoundedSemaphore]:
+    global _pool, _slots
+    size = max(1, maxconn)
+    with _pool_lock:
+        if _pool is None:
+            _pool = new_pool(params, 1, size)
+            _slots = threading.BoundedSemaphore(size)
+        elif size > _pool.maxconn:
+            raise ValueError(f"пул Neon уже создан на {_pool.maxconn} соединений, запрошено {size}")
+        return _pool, _slots
+
+
+def get_pool(params: NeonParams, maxconn: int = 1) -> ThreadedConnectionPool:
+    """
+    Пул процесса на maxconn соединений (создаётся при первом вызове, в том числе из warmup).
+    Если пул уже создан меньшим, ValueError: молча урезать параллельность нельзя.
+    """
+    return _pool_and_slots(params, maxconn)[0]
+
+
+def close_pool() -> None:
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _slots = None
+            _last_used.clear()
+            print(f"[neon] {stats.summary()}")
+
+
+def _checked_conn(pool: ThreadedConnectionPool):
+    """Соединение из пула; простоявшее дольше IDLE_CHECK_SEC — с проверкой, закрытое Neon — заменяется."""
+    conn = pool.getconn()
+    idle = time.monotonic() - _last_used.get(id(conn), time.monotonic())
+    if not conn.closed and idle < IDLE_CHECK_SEC:
+        return conn
+    try:
+        if conn.closed:
+            raise psycopg2.InterfaceError("connection already closed")
+        with conn.cursor() as cur:
+            cur.execute("select 1;")
+        conn.rollback()
+        return conn
+    except psycopg2.Error:
+        pool.putconn(conn, close=True)
+        return _retrying(pool.getconn, "reconnect")
+
+
+@contextmanager
+def session(params: NeonParams, maxconn: int = 1):
+    """
+    Соединение из пула процесса в рамках одной транзакции: commit при успехе, rollback при ошибке.
+    Когда все соединения пула заняты (например, прогревом), ждёт свободное.
+    """
+    pool, slots = _pool_and_slots(params, maxconn)
+    slots.acquire()
+    try:
+        conn = _checked_conn(pool)
+    except BaseException:
+        slots.release()
+        raise
+    started = time.monotonic()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        stats.add_session(time.monotonic() - started)
+        _last_used[id(conn)] = time.monotonic()
+        try:
+            pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            slots.release()
+
+
+def warmup(params: NeonParams, maxconn: int = 1) -> threading.Thread:
+    """
+    В фоне создаёт пул процесса и делает select 1 — будит compute Neon, пока основной поток
+    занят другим. Первая session дождётся прогрева (общая блокировка пула), а не начнёт свой.
+    Ошибку прогрева только печатаем: session повторит подключение сама.
+    """
+
+    def run() -> None:
+        try:
+            with session(params, maxconn) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("select 1;")
+        except psycopg2.Error as e:
+            print(f"[neon] прогрев не удался: {str(e).strip()}")
+
+    thread = threading.Thread(target=run, name="neon-warmup", daemon=True)
+    thread.start()
+    return thread
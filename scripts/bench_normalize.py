@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Сравнивает построчный normalize и колоночный normalize_vectorized (pandas/NumPy) из etl.py
+на синтетических строках OLAP: время, строк в секунду и совпадение source_hash и posting_dt.
+Отдельно меряет схему source_hash v2 (blake2b по полям) против v1 (sha256 от JSON).
+
+Запуск (из корня проекта, сеть и Neon не нужны):
+  python scripts/bench_normalize.py                 # 100k и 1M строк
+  python scripts/bench_normalize.py 50000 200000    # свои размеры
+"""
+import random
+import sys
+import time
+from dataclasses import replace
+from pathlib import Path
+
+# корень проекта = родитель папки scripts
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import etl
+import pandas  # noqa: F401 — импорт pandas не входит в замер normalize_vectorized
+
+
+DEPARTMENTS = ["Кухня", "Бар", "Кондитерский цех", "Склад"]
+TYPES = ["WRITEOFF", "INVENTORY_CORRECTION", "INCOMING_INVOICE", "OUTGOING_INVOICE", "PRODUCTION"]
+UNITS = ["кг", "л", "шт"]
+
+
+def make_data(n: int, seed: int = 42) -> list:
+    """Строки в форме ответа OLAP TRANSACTIONS; словари товаров и дат — как у реальной недели."""
+    rnd = random.Random(seed)
+    products = [(f"{i:05d}", f"Товар {i}", f"Категория {i % 40}") for i in range(3000)]
+    # В основном время без пояса (iiko отдаёт московское), часть — с Z и со смещением: в одной пачке
+    # должны разбираться одинаково с построчным normalize
+    stamps = [
+        f"2024-01-{d:02d}T{h:02d}:{m:02d}:{s:02d}{rnd.choice(('', '', '', '', 'Z', '+05:00'))}"
+        for d in range(2, 9) for h in range(24) for m in range(0, 60, 3) for s in (0, 17, 42)
+    ]
+    data = []
+    for _ in range(n):
+        num, name, category = rnd.choice(products)
+        data.append({
+            "Department": rnd.choice(DEPARTMENTS),
+            "DateTime.Typed": rnd.choice(stamps),
+            "TransactionType": rnd.choice(TYPES),
+            "Product.Num": num,
+            "Product.Name": name,
+            "Product.Category": category,
+            "Product.MeasureUnit": rnd.choice(UNITS),
+            "Contr-Account.Name": rnd.choice(["", "Списание", "Порча"]),
+            "Amount.Out": round(rnd.random() * 10, 3) if rnd.random() < 0.5 else None,
+            "Amount.In": round(rnd.random() * 10, 3) if rnd.random() < 0.5 else None,
+            "Sum.Outgoing": round(rnd.random() * 1000, 2),
+            "Sum.Incoming": round(rnd.random() * 1000, 2),
+        })
+    return data
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - started
+
+
+def bench(cfg: etl.Config, n: int) -> None:
+    data = make_data(n)
+    print(f"\n[bench] строк: {n:,}")
+
+    rows, t_rows = timed(etl.normalize, cfg, data)
+    fast, t_fast = timed(etl.normalize_vectorized, cfg, data)
+    print(f"  normalize            {t_rows:7.2f} с  ({n / t_rows:,.0f} rows/s)")
+    print(f"  normalize_vectorized {t_fast:7.2f} с  ({n / t_fast:,.0f} rows/s)  x{t_rows / t_fast:.1f}")
+
+    same = len(rows) == len(fast) and all(
+        a["source_hash"] == b["source_hash"] and a["posting_dt"].utcoffset() == b["posting_dt"].utcoffset()
+        for a, b in zip(rows, fast)
+    )
+    print(f"  source_hash и posting_dt совпадают: {'да' if same else 'НЕТ'}")
+    if not same:
+        sys.exit(1)
+    del fast
+    v1_hashes = [r["source_hash"] for r in rows[:1000]]
+    del rows
+
+    cfg_v2 = replace(cfg, hash_scheme="v2")
+    rows_v2, t_rows_v2 = timed(etl.normalize, cfg_v2, data)
+    fast_v2, t_fast_v2 = timed(etl.normalize_vectorized, cfg_v2, data)
+    print(f"  SOURCE_HASH=v2: normalize            {t_rows_v2:7.2f} с  (x{t_rows / t_rows_v2:.1f} к v1)")
+    print(f"  SOURCE_HASH=v2: normalize_vectorized {t_fast_v2:7.2f} с  (x{t_fast / t_fast_v2:.1f} к v1)")
+    same = all(a["source_hash"] == b["source_hash"] for a, b in zip(rows_v2, fast_v2))
+    legacy = all(etl.row_source_hash(a, "v1") == b for a, b in zip(rows_v2[:1000], v1_hashes))
+    print(f"  v2 source_hash совпадают: {'да' if same else 'НЕТ'}, пересчёт v2 → v1 совпадает: {'да' if legacy else 'НЕТ'}")
+    if not (same and legacy):
+        sys.exit(1)
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [100_000, 1_000_000]
+    cfg = etl.Config(
+        neon_host="", neon_db="", neon_user="", neon_password="",
+        report_id="bench", date_from="2024-01-02", date_to="2024-01-09",
+        iiko_base_url="", iiko_login="", iiko_pass_sha1="", iiko_verify_ssl=True,
+        transaction_types=[], product_types=[],
+        raw_dir=ROOT / "src" / "data" / "raw",
+    )
+    for n in sizes:
+        bench(cfg, n)
+
+
+if __name__ == "__main__":
+    main()
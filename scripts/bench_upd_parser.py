@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Сравнивает разбор УПД из edo_iiko_bridge: прежний parse_upd_xml_line_items_scan (поиск каждого
+поля отдельным проходом по детям строки) и однопроходный parse_upd_xml_line_items — на синтетических
+УПД крупного дистрибьютора (namespace ФНС, тысячи строк, по ~15 реквизитов в строке).
+Отдельно — потоковый iter_upd_line_items: время и пик памяти (tracemalloc) против разбора целого дерева.
+Проверяет, что результаты совпадают.
+
+Запуск (из корня проекта, сеть и Диадок не нужны):
+  python scripts/bench_upd_parser.py               # 2 000, 10 000 и 50 000 строк
+  python scripts/bench_upd_parser.py 5000 20000    # свои размеры
+"""
+import io
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# корень проекта = родитель папки scripts
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from edo_iiko_bridge.parsers.upd import (
+    iter_upd_line_items,
+    parse_upd_xml_line_items,
+    parse_upd_xml_line_items_scan,
+)
+
+NS = "urn:x-fns:upd"
+UNITS = [("796", "шт"), ("166", "кг"), ("112", "л")]
+
+
+def make_upd(n: int, seed: int = 42) -> bytes:
+    """УПД на n строк: строка — СведТов с реквизитами-детьми, часть синонимов, доп. сведения и прослеживаемость."""
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(1, n + 1):
+        okei, unit = rnd.choice(UNITS)
+        qty = round(rnd.random() * 50, 3)
+        price = round(rnd.random() * 900 + 10, 2)
+        total = round(qty * price * 1.2, 2)
+        rows.append(
+            f"<ns:СведТов>"
+            f"<ns:НомСтр>{i}</ns:НомСтр>"
+            f"<ns:НаимТов>Товар {i % 5000} фасованный, упаковка {i % 12 + 1}</ns:НаимТов>"
+            f"<ns:ОКЕИ_Тов>{okei}</ns:ОКЕИ_Тов>"
+            f"<ns:НаимЕдИзм>{unit}</ns:НаимЕдИзм>"
+            f"<ns:КолТов>{qty}</ns:КолТов>"
+            f"<ns:ЦенаТов>{price}</ns:ЦенаТов>"
+            f"<ns:СтТовБезНДС>{round(qty * price, 2)}</ns:СтТовБезНДС>"
+            f"<ns:НалСт>20%</ns:НалСт>"
+            f"<ns:СумНал>{round(total - qty * price, 2)}</ns:СумНал>"
+            f"<ns:СтТовУчНал>{total}</ns:СтТовУчНал>"
+            f"<ns:Акциз>без акциза</ns:Акциз>"
+            f"<ns:ДопСведТов><ns:ПрТовРаб>1</ns:ПрТовРаб><ns:КодТов>{i:07d}</ns:КодТов></ns:ДопСведТов>"
+            f"<ns:Артикул>ART-{i:06d}</ns:Артикул>"
+            f"<ns:СтранаПроисх>643</ns:СтранаПроисх>"
+            f"</ns:СведТов>"
+        )
+    body = "".join(rows)
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<ns:Файл xmlns:ns="{NS}"><ns:Документ><ns:ТаблСчФакт>{body}</ns:ТаблСчФакт></ns:Документ></ns:Файл>'
+    ).encode("utf-8")
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - started
+
+
+def peak_mb(fn) -> float:
+    """Пик памяти Python во время fn() (tracemalloc), МБ."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def count_streamed(xml: bytes) -> int:
+    # Строки не копятся в список — так их обрабатывает потоковый потребитель
+    return sum(1 for _ in iter_upd_line_items(io.BytesIO(xml)))
+
+
+def bench(n: int) -> None:
+    xml = make_upd(n)
+    print(f"\n[bench] строк в УПД: {n:,}, размер {len(xml) / 1024 / 1024:.1f} МБ")
+    scan, t_scan = timed(parse_upd_xml_line_items_scan, xml)
+    fast, t_fast = timed(parse_upd_xml_line_items, xml)
+    print(f"  parse_upd_xml_line_items_scan {t_scan:7.2f} с  ({n / t_scan:,.0f} строк/с)")
+    print(f"  parse_upd_xml_line_items      {t_fast:7.2f} с  ({n / t_fast:,.0f} строк/с)  x{t_scan / t_fast:.1f}")
+    stream, t_stream = timed(lambda x: list(iter_upd_line_items(io.BytesIO(x))), xml)
+    print(f"  iter_upd_line_items           {t_stream:7.2f} с  ({n / t_stream:,.0f} строк/с)")
+    # Сам XML лежит в памяти до замера; смотрим, сколько сверх него занимает разбор
+    tree_peak = peak_mb(lambda: parse_upd_xml_line_items(xml))
+    stream_peak = peak_mb(lambda: count_streamed(xml))
+    print(f"  пик памяти: дерево {tree_peak:.1f} МБ, поток {stream_peak:.1f} МБ")
+    same = scan == fast == stream
+    print(f"  результаты совпадают: {'да' if same else 'НЕТ'}")
+    if not same:
+        sys.exit(1)
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [2_000, 10_000, 50_000]
+    for n in sizes:
+        bench(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Проверяет по EXPLAIN, что запросы etl.py и alerts_bot.py к inventory_raw.olap_postings
+идут по индексам или по одной секции недели (docs/migrations/partition-olap-postings.sql).
+
+Запросы не переписываются: функции etl/alerts_bot вызываются как есть, но с соединением,
+которое вместо выполнения делает EXPLAIN (FORMAT JSON) и запоминает план. В плане ищутся
+узлы сканирования olap_postings и его секций:
+  - Index Scan / Index Only Scan / Bitmap Heap Scan — ок;
+  - Seq Scan только по секции проверяемой недели — ок (секция и есть неделя);
+  - любой другой Seq Scan по olap_postings — ошибка, код выхода 1.
+
+Запуск (из корня проекта, .env с NEON_*; REPORT_ID опционален):
+  python scripts/check_olap_indexes.py
+"""
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+load_dotenv(ROOT / ".env")
+
+import alerts_bot
+import etl
+import neon_db
+
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Heap Scan")
+
+
+class _DummyRow:
+    """Строка-заглушка: непустая, по любому ключу или индексу — None (функции, ждущие строку, не падают)."""
+
+    def __getitem__(self, key):
+        return None
+
+
+class _ExplainCursor:
+    rowcount = 0
+
+    def __init__(self, cur, plans: List[Any]):
+        self._cur = cur
+        self._plans = plans
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cur.close()
+
+    def execute(self, sql, args=None):
+        self._cur.execute("explain (format json) " + sql.strip(), args)
+        self._plans.append(self._cur.fetchone()[0])
+
+    def fetchone(self):
+        return _DummyRow()
+
+    def fetchall(self):
+        return []
+
+
+class ExplainConnection:
+    """Соединение для функций etl/alerts_bot: каждый execute превращается в EXPLAIN, результаты пустые."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.plans: List[Any] = []
+
+    def cursor(self):
+        return _ExplainCursor(self._conn.cursor(), self.plans)
+
+
+def olap_scans(plan: Any) -> List[Tuple[str, str]]:
+    """(тип узла, relation) для всех сканов olap_postings и его секций в плане."""
+    out = []
+    stack = [p["Plan"] for p in plan]
+    while stack:
+        node = stack.pop()
+        rel = node.get("Relation Name") or ""
+        if rel.startswith("olap_postings"):
+            out.append((node["Node Type"], rel))
+        stack.extend(node.get("Plans", []))
+    return out
+
+
+def check(name: str, conn, fn, *args, week_partition: str) -> bool:
+    explain = ExplainConnection(conn)
+    fn(explain, *args)
+    ok = True
+    for plan in explain.plans:
+        scans = olap_scans(plan)
+        bad = [
+            (node, rel) for node, rel in scans
+            if node not in INDEX_SCANS and not (node == "Seq Scan" and rel == week_partition)
+        ]
+        ok = ok and not bad
+        summary = ", ".join(f"{node} {rel}" for node, rel in sorted(set(scans))) or "olap_postings не читается"
+        print(f"[{'ok' if not bad else 'FAIL'}] {name}: {summary}")
+    conn.rollback()
+    return ok
+
+
+def main() -> None:
+    params = neon_db.NeonParams.from_env()
+    if params is None:
+        print("Задай NEON_HOST, NEON_DB, NEON_USER, NEON_PASSWORD в .env или в секретах workflow.")
+        sys.exit(1)
+
+    bot_cfg = alerts_bot.BotConfig(
+        neon_host=params.host, neon_db=params.dbname, neon_user=params.user, neon_password=params.password,
+        telegram_token="", allowed_chat_id=0,
+    )
+    conn = alerts_bot.db_connect(bot_cfg)
+    try:
+        week_start, week_end = alerts_bot.get_last_week(conn)
+        report_id = os.getenv("REPORT_ID", "").strip()
+        if not report_id:
+            with conn.cursor() as cur:
+                cur.execute("select report_id from inventory_raw.olap_postings where date_from = %s limit 1;", (week_start,))
+                row = cur.fetchone()
+                report_id = row[0] if row else ""
+        week_partition = "olap_postings_{}_{}".format(week_start.replace("-", ""), week_end.replace("-", ""))
+        print(f"[check] неделя {week_start} → {week_end}, report_id={report_id!r}, секция {week_partition}")
+
+        # Реальные ТОПы недели — чтобы проверять пакетные запросы на живых товарах
+        snapshot = alerts_bot.load_week_snapshot(conn, week_start, week_end, 5)
+        products: Dict[str, List[str]] = {
+            dept: [r["product_num"] for r in rows] for dept, rows in snapshot.top_neg_money(5).items()
+        }
+        period = SimpleNamespace(report_id=report_id, date_from=week_start, date_to=week_end)
+
+        checks = [
+            ("etl.delete_period", lambda c: etl.delete_period(period, c)),
+            ("etl.fetch_period_hashes", lambda c: etl.fetch_period_hashes(period, c)),
+            ("alerts.get_last_week", alerts_bot.get_last_week),
+            ("alerts.get_loaded_at", alerts_bot.get_loaded_at),
+            ("alerts.load_week_snapshot", lambda c: alerts_bot.load_week_snapshot(c, week_start, week_end, 5)),
+            ("alerts.get_receipts_for_products_by_dept",
+             lambda c: alerts_bot.get_receipts_for_products_by_dept(c, week_start, week_end, products)),
+            ("alerts.get_deviation_for_products_by_dept",
+             lambda c: alerts_bot.get_deviation_for_products_by_dept(c, week_start, week_end, products)),
+            ("alerts.get_movement_qty_for_products_by_dept",
+             lambda c: alerts_bot.get_movement_qty_for_products_by_dept(c, week_start, week_end, products)),
+            ("alerts.get_top_writeoffs_by_department",
+             lambda c: alerts_bot.get_top_writeoffs_by_department(c, week_start, week_end, 5)),
+        ]
+        results = [check(name, conn, fn, week_partition=week_partition) for name, fn in checks]
+    finally:
+        conn.close()
+
+    if not all(results):
+        print("[check] есть запросы с полным сканированием olap_postings — см. FAIL выше")
+        sys.exit(1)
+    print("[check] все запросы идут по индексам или по секции недели")
+
+
+if __name__ == "__main__":
+    main()
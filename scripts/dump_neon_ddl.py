@@ -11,12 +11,10 @@ CREATE VIEW / MATERIALIZED VIEW и функции.
   - Локально: из корня проекта с .env (NEON_HOST, NEON_DB, NEON_USER, NEON_PASSWORD).
   - Через GitHub: workflow "Dump Neon schema" вызывает этот скрипт.
 """
-import os
 import sys
 from pathlib import Path
 from collections import defaultdict
 
-import psycopg2
 from dotenv import load_dotenv
 
 ROOT = Path(__file__).resolve().parent.parent
@@ -24,26 +22,19 @@ sys.path.insert(0, str(ROOT))
 
 load_dotenv(ROOT / ".env")
 
+import neon_db
+
 
 SCHEMAS = ("inventory_raw", "inventory_core", "inventory_mart")
 
 
 def main() -> None:
-    host = os.getenv("NEON_HOST")
-    db = os.getenv("NEON_DB")
-    user = os.getenv("NEON_USER")
-    password = os.getenv("NEON_PASSWORD")
-    if not all([host, db, user, password]):
+    params = neon_db.NeonParams.from_env()
+    if params is None:
         print("Задай NEON_HOST, NEON_DB, NEON_USER, NEON_PASSWORD в .env или в секретах workflow.")
         sys.exit(1)
 
-    conn = psycopg2.connect(
-        host=host,
-        dbname=db,
-        user=user,
-        password=password,
-        sslmode="require",
-    )
+    conn = neon_db.connect(params)
 
     out_path = ROOT / "docs" / "neon-schema.sql"
     out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -7,7 +7,6 @@
   - Локально: из корня проекта с .env (NEON_HOST, NEON_DB, NEON_USER, NEON_PASSWORD).
   - Через GitHub: Actions → "Dump Neon schema" → Run workflow (берёт NEON_* из секретов и пушит обновлённый файл).
 """
-import os
 import sys
 from pathlib import Path
 
@@ -18,25 +17,16 @@ sys.path.insert(0, str(ROOT))
 from dotenv import load_dotenv
 load_dotenv(ROOT / ".env")
 
-import psycopg2
+import neon_db
 
 
 def main():
-    host = os.getenv("NEON_HOST")
-    db = os.getenv("NEON_DB")
-    user = os.getenv("NEON_USER")
-    password = os.getenv("NEON_PASSWORD")
-    if not all([host, db, user, password]):
+    params = neon_db.NeonParams.from_env()
+    if params is None:
         print("Задай NEON_HOST, NEON_DB, NEON_USER, NEON_PASSWORD в .env или запусти workflow Dump Neon schema в GitHub Actions (секреты).")
         sys.exit(1)
 
-    conn = psycopg2.connect(
-        host=host,
-        dbname=db,
-        user=user,
-        password=password,
-        sslmode="require",
-    )
+    conn = neon_db.connect(params)
 
     sql = """
     SELECT table_schema, table_name, column_name, data_type, is_nullable
@@ -0,0 +1,59 @@
+"""Колоночный normalize (ETL_NORMALIZE=pandas) должен давать те же строки и source_hash, что построчный."""
+from dataclasses import replace
+
+import pytest
+
+pytest.importorskip("pandas")
+
+import etl
+
+CFG = etl.Config(
+    neon_host="", neon_db="", neon_user="", neon_password="",
+    report_id="test", date_from="2024-01-02", date_to="2024-01-09",
+    iiko_base_url="", iiko_login="", iiko_pass_sha1="", iiko_verify_ssl=True,
+    transaction_types=[], product_types=[],
+    raw_dir=".",
+)
+
+
+def _olap_rows(stamps):
+    return [
+        {
+            "Department": "Кухня",
+            "DateTime.Typed": stamp,
+            "TransactionType": "WRITEOFF",
+            "Product.Num": f"{i:05d}",
+            "Product.Name": "Говядина",
+            "Sum.Outgoing": 100.5,
+        }
+        for i, stamp in enumerate(stamps)
+    ]
+
+
+@pytest.mark.parametrize("scheme", etl.HASH_SCHEMES)
+@pytest.mark.parametrize(
+    "stamps",
+    [
+        ["2024-01-03T10:00:00Z", "2024-01-04T10:00:00"],
+        ["2024-01-04T10:00:00+05:00", "2024-01-04T10:00:00", "2024-01-05"],
+        ["2024-01-04T10:00:00.123", "2024-01-04 10:00+0300", "2024-01-04T10:00:00+05:00"],
+        ["2024-01-03T10:00:00Z", "2024-01-04T10:00:00+05:00", "2024-01-04T10:00:00", "не дата"],
+    ],
+)
+def test_vectorized_matches_rows_on_mixed_timezones(stamps, scheme):
+    """Строки без смещения — по Москве, даже если в пачке есть строки с Z или +05:00."""
+    cfg = replace(CFG, hash_scheme=scheme)
+    data = _olap_rows(stamps)
+    rows = etl.normalize(cfg, data)
+    fast = etl.normalize_vectorized(cfg, data)
+    assert [r["source_hash"] for r in fast] == [r["source_hash"] for r in rows]
+    assert [r["posting_dt"].utcoffset() for r in fast] == [r["posting_dt"].utcoffset() for r in rows]
+    assert fast == rows
+
+
+def test_naive_timestamp_hash_does_not_depend_on_batch():
+    data = _olap_rows(["2024-01-03T10:00:00Z", "2024-01-04T10:00:00"])
+    alone = etl.normalize_vectorized(CFG, data[1:])
+    mixed = etl.normalize_vectorized(CFG, data)
+    assert mixed[1]["posting_dt"].isoformat() == "2024-01-04T10:00:00+03:00"
+    assert mixed[1]["source_hash"] == alone[0]["source_hash"]
@@ -0,0 +1,72 @@
+"""Кэш сырых ответов OLAP (RawCache): попадание, промах по другому ключу, битый файл — промах."""
+import gzip
+from dataclasses import replace
+
+import pytest
+
+import etl
+
+CFG = etl.Config(
+    neon_host="", neon_db="", neon_user="", neon_password="",
+    report_id="test", date_from="2024-01-02", date_to="2024-01-09",
+    iiko_base_url="https://iiko.example", iiko_login="", iiko_pass_sha1="", iiko_verify_ssl=True,
+    transaction_types=["WRITEOFF"], product_types=["GOODS"],
+    raw_dir=".",
+)
+BODY = b'{"data": [{"Department": "\xd0\x9a\xd1\x83\xd1\x85\xd0\xbd\xd1\x8f"}], "summary": []}'
+
+
+def _key(cfg, period=None):
+    return etl.RawCache.key(cfg.iiko_base_url, etl.build_olap_request(cfg, period))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return etl.RawCache(tmp_path, max_bytes=1 << 20)
+
+
+def test_round_trip(cache):
+    key = _key(CFG)
+    cache.put(key, BODY)
+    assert cache.get(key) == BODY
+    assert b"".join(cache.iter_chunks(key, chunk_size=7)) == BODY
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        lambda: _key(CFG, ("2024-01-09T00:00:00.000", "2024-01-16T00:00:00.000")),
+        lambda: _key(replace(CFG, transaction_types=["INVOICE"])),
+        lambda: _key(replace(CFG, iiko_base_url="https://other.example")),
+    ],
+    ids=["period", "report", "base_url"],
+)
+def test_other_key_is_a_miss(cache, other):
+    cache.put(_key(CFG), BODY)
+    key = other()
+    assert key != _key(CFG)
+    assert cache.get(key) is None
+    assert cache.iter_chunks(key) is None
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [
+        lambda data: b"not a gzip file",
+        lambda data: data[: len(data) // 2],
+        lambda data: data[:12] + bytes(b ^ 0xFF for b in data[12:-8]) + data[-8:],
+        lambda data: data[:-8] + bytes(8),
+    ],
+    ids=["not-gzip", "truncated", "bad-deflate", "bad-crc"],
+)
+def test_corrupted_file_is_a_miss(cache, corrupt):
+    key = _key(CFG)
+    cache.put(key, BODY)
+    path = cache.path(key)
+    path.write_bytes(corrupt(path.read_bytes()))
+    assert cache.get(key) is None
+    assert not path.exists()
+
+    path.write_bytes(corrupt(gzip.compress(BODY)))
+    assert cache.iter_chunks(key) is None
+    assert not path.exists()
@@ -0,0 +1,88 @@
+"""Переход SOURCE_HASH v1 → v2: строки, записанные v1, должны находиться в RAW и после переключения."""
+import contextlib
+from dataclasses import replace
+
+import pytest
+
+import etl
+
+CFG = etl.Config(
+    neon_host="", neon_db="", neon_user="", neon_password="",
+    report_id="test", date_from="2024-01-02", date_to="2024-01-09",
+    iiko_base_url="", iiko_login="", iiko_pass_sha1="", iiko_verify_ssl=True,
+    transaction_types=[], product_types=[],
+    raw_dir=".",
+)
+OLAP_ROW = {
+    "Department": "Кухня",
+    "DateTime.Typed": "2024-01-04T10:00:00+05:00",
+    "TransactionType": "WRITEOFF",
+    "Product.Num": "00042",
+    "Product.Name": "Говядина",
+    "Product.MeasureUnit": "кг",
+    "Amount.Out": 1.25,
+    "Sum.Outgoing": 100.5,
+}
+
+
+def _row(scheme):
+    return etl.normalize_row(replace(CFG, hash_scheme=scheme), OLAP_ROW)
+
+
+def test_v2_hash_has_prefix_and_v1_does_not():
+    v1, v2 = _row("v1")["source_hash"], _row("v2")["source_hash"]
+    assert v2.startswith("v2:")
+    assert not v1.startswith("v2:")
+    assert etl.hash_scheme_of(v1) == "v1"
+    assert etl.hash_scheme_of(v2) == "v2"
+
+
+@pytest.mark.parametrize("scheme", etl.HASH_SCHEMES)
+def test_row_source_hash_matches_normalize_row(scheme):
+    for written in etl.HASH_SCHEMES:
+        assert etl.row_source_hash(_row(written), scheme) == _row(scheme)["source_hash"]
+
+
+class _Cursor:
+    rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, params=None):
+        raise AssertionError(f"неожиданный запрос: {sql}")
+
+
+class _Conn:
+    def cursor(self):
+        return _Cursor()
+
+
+@pytest.fixture
+def raw_v1(monkeypatch):
+    """RAW за период, записанный схемой v1; перехватывает вставку и переименование хэшей."""
+    calls = {"inserted": [], "renamed": []}
+
+    def insert_rows_stream(cfg, rows, batch_size, conn):
+        calls["inserted"].extend(rows)
+        return len(calls["inserted"])
+
+    monkeypatch.setattr(etl, "db_session", lambda cfg: contextlib.nullcontext(_Conn()))
+    monkeypatch.setattr(etl, "fetch_period_hashes", lambda cfg, conn: {_row("v1")["source_hash"]})
+    monkeypatch.setattr(etl, "insert_rows_stream", insert_rows_stream)
+    monkeypatch.setattr(etl, "execute_values", lambda cur, sql, rows, page_size: calls["renamed"].extend(rows))
+    return calls
+
+
+def test_v1_row_is_found_after_switching_to_v2(raw_v1):
+    assert etl.apply_delta(replace(CFG, hash_scheme="v2"), [_row("v2")]) == (0, 0)
+    assert raw_v1 == {"inserted": [], "renamed": []}
+
+
+def test_v1_hash_is_migrated_to_v2(raw_v1):
+    cfg = replace(CFG, hash_scheme="v2", hash_migrate=True)
+    assert etl.apply_delta(cfg, [_row("v2")]) == (0, 0)
+    assert raw_v1["renamed"] == [(_row("v1")["source_hash"], _row("v2")["source_hash"])]
@@ -0,0 +1,48 @@
+"""Потоковый разбор OLAP (iter_olap_data) не должен зависеть от того, где сеть разрезала тело ответа."""
+import json
+import random
+
+import pytest
+
+import etl
+
+PAYLOAD = json.dumps(
+    {
+        "data": [
+            {"Department": "Кухня", "Product.Name": "Соус \"Фирменный\" \\ 1/2", "Sum.Outgoing": -12.5e3},
+            {"Department": "Бар", "Product.Name": "Лёд\nЖ\t", "Amount.In": 0.001, "Product.Num": None},
+            {"Department": "Склад", "Product.Name": "𝄞 нота", "Amount.Out": 123456789012, "Nested": {"a": [1, 2]}},
+        ],
+        "summary": [],
+    },
+    ensure_ascii=False,
+    indent=1,
+).encode("utf-8")
+EXPECTED = json.loads(PAYLOAD)["data"]
+
+
+def _split(data: bytes, cuts):
+    bounds = [0, *sorted(cuts), len(data)]
+    return [data[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def test_rows_survive_any_single_cut():
+    # Каждая позиция: внутри строки, escape-последовательности, числа, многобайтового UTF-8
+    for cut in range(1, len(PAYLOAD)):
+        assert list(etl.iter_olap_data(_split(PAYLOAD, [cut]))) == EXPECTED, cut
+
+
+def test_rows_survive_one_byte_chunks():
+    assert list(etl.iter_olap_data(PAYLOAD[i:i + 1] for i in range(len(PAYLOAD)))) == EXPECTED
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rows_survive_random_cuts(seed):
+    rnd = random.Random(seed)
+    cuts = rnd.sample(range(1, len(PAYLOAD)), rnd.randint(2, 30))
+    assert list(etl.iter_olap_data(_split(PAYLOAD, cuts))) == EXPECTED
+
+
+def test_truncated_body_raises():
+    with pytest.raises((RuntimeError, json.JSONDecodeError)):
+        list(etl.iter_olap_data([PAYLOAD[: len(PAYLOAD) // 2]]))
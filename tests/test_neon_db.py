@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+from psycopg2.pool import PoolError
+
+import neon_db
+
+PARAMS = neon_db.NeonParams("host", "db", "user", "password")
+
+
+class _Conn:
+    closed = 0
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _Pool:
+    """Как ThreadedConnectionPool: при исчерпании getconn бросает PoolError, а не ждёт."""
+
+    def __init__(self, minconn, maxconn):
+        self.maxconn = maxconn
+        self._free = [_Conn() for _ in range(maxconn)]
+
+    def getconn(self):
+        if not self._free:
+            raise PoolError("connection pool exhausted")
+        return self._free.pop()
+
+    def putconn(self, conn, close=False):
+        self._free.append(conn)
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_pool(monkeypatch):
+    monkeypatch.setattr(neon_db, "new_pool", lambda params, minconn, maxconn: _Pool(minconn, maxconn))
+    yield
+    neon_db.close_pool()
+
+
+def test_session_waits_for_free_connection():
+    done = threading.Event()
+
+    def worker():
+        with neon_db.session(PARAMS, 1):
+            done.set()
+
+    with neon_db.session(PARAMS, 1):
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not done.wait(0.2)
+    thread.join(5)
+    assert done.is_set()
+
+
+def test_get_pool_rejects_larger_size_than_created():
+    pool = neon_db.get_pool(PARAMS, 1)
+    assert neon_db.get_pool(PARAMS) is pool
+    with pytest.raises(ValueError):
+        neon_db.get_pool(PARAMS, 4)